@@ -0,0 +1,12 @@
+import sys
+import metrics
+
+API_NAMES = {'documentai': 'Document AI', 'vision': 'Vision'}
+
+
+def record_api_call(api, units=1, wait=0.0, retries=0):
+    print('Warning: %s API call' % API_NAMES.get(api, api))
+    sys.stdout.flush()
+    # Consumo e attese finiscono nel registro del processo e in quello della sessione (o pratica) corrente,
+    # anche quando la chiamata parte da un thread del pool
+    metrics.api_call(api, units, wait, retries)
@@ -0,0 +1,187 @@
+# Elaborazione batch delle pratiche, senza Streamlit
+#
+# Uso:
+#   python batch.py archivio/ --output risultati.jsonl [--workers 4] [--parquet risultati.parquet]
+#   python batch.py --manifest manifest.csv --output risultati.jsonl [--metrics metriche.prom]
+#
+# In una cartella ogni sottocartella è una pratica: i file il cui nome inizia con "denuncia", "foto" e
+# "fattura"/"preventivo" vengono assegnati alla rispettiva analisi. Il manifest è un csv con le colonne
+# claim_id, denuncia, foto, fattura (percorsi relativi al manifest, anche vuoti; più righe con lo stesso
+# claim_id aggiungono file alla stessa pratica).
+# I risultati vengono scritti in JSONL man mano che le pratiche terminano; rilanciando il comando con lo stesso
+# output le pratiche già completate senza errori vengono saltate.
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import mimetypes
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import metrics
+
+ROLES = ['denuncia', 'foto', 'fattura']
+ROLE_PREFIXES = {'denuncia': 'denuncia', 'foto': 'foto', 'fattura': 'fattura', 'preventivo': 'fattura'}
+MIME_TYPES = {'.txt': 'text/plain', '.pdf': 'application/pdf', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+              '.png': 'image/png'}
+
+
+def _mime_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    return MIME_TYPES.get(ext) or mimetypes.guess_type(path)[0]
+
+
+def claims_from_directory(directory):
+    claims = []
+    for claim_id in sorted(os.listdir(directory)):
+        claim_dir = os.path.join(directory, claim_id)
+        if not os.path.isdir(claim_dir):
+            continue
+        claim = {'claim_id': claim_id, 'files': []}
+        for name in sorted(os.listdir(claim_dir)):
+            for prefix, role in ROLE_PREFIXES.items():
+                if name.lower().startswith(prefix):
+                    claim['files'].append((role, os.path.join(claim_dir, name)))
+                    break
+        claims.append(claim)
+    return claims
+
+
+def claims_from_manifest(manifest):
+    base = os.path.dirname(os.path.abspath(manifest))
+    claims = {}
+    with open(manifest, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            claim = claims.setdefault(row['claim_id'], {'claim_id': row['claim_id'], 'files': []})
+            for role in ROLES:
+                if row.get(role):
+                    claim['files'].append((role, os.path.join(base, row[role])))
+    return list(claims.values())
+
+
+def process_claim(claim):
+    # Gira nei processi del pool: importo qui i moduli di analisi
+    from text_analysis import analyze_text
+    from image_analysis import analyze_images
+    from invoice_analysis import analyze_invoice
+    import quota
+
+    # Le chiamate del batch cedono il passo a quelle delle sessioni interattive
+    quota.set_default_priority(quota.PRIORITY_BATCH)
+    start = time.time()
+    files = []
+    # Registro delle misure della sola pratica: le fasi più lente finiscono nel risultato
+    claim_metrics = metrics.Registry()
+    for role, path in claim['files']:
+        entry = {'role': role, 'path': path}
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            mime_type = _mime_type(path)
+            with metrics.scope(claim_metrics):
+                if role == 'denuncia':
+                    entry['result'] = analyze_text(content, mime_type)
+                elif role == 'fattura':
+                    entry['result'] = analyze_invoice(content, mime_type)
+                else:
+                    # Per le foto salvo solo le label, non i byte delle immagini
+                    entry['result'] = {str(i): labels for i, (_, labels) in analyze_images(content,
+                                                                                            mime_type).items()}
+        except Exception as e:
+            entry['error'] = '%s: %s' % (type(e).__name__, e)
+        files.append(entry)
+
+    snapshot = claim_metrics.snapshot()
+    return {'claim_id': claim['claim_id'], 'files': files, 'elapsed': round(time.time() - start, 3),
+            'stages': {stage: round(h['sum'], 4) for stage, h in snapshot['stages'].items()},
+            'metrics': snapshot}
+
+
+def _resume(output):
+    # L'output stesso fa da checkpoint: scarto un'eventuale ultima riga troncata e
+    # considero completate solo le pratiche senza errori
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'rb') as f:
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    if end != len(data):
+        with open(output, 'r+b') as f:
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not any('error' in entry for entry in record['files']):
+            done.add(record['claim_id'])
+    return done
+
+
+def to_parquet(output, parquet):
+    import pandas as pd
+
+    # Una riga per file analizzato; se una pratica è stata rielaborata vale l'ultimo risultato
+    records = {}
+    with open(output, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            records[record['claim_id']] = record
+    rows = []
+    for record in records.values():
+        for entry in record['files']:
+            rows.append({'claim_id': record['claim_id'],
+                         'role': entry['role'],
+                         'path': entry['path'],
+                         'result': json.dumps(entry.get('result'), ensure_ascii=False),
+                         'error': entry.get('error')})
+    pd.DataFrame(rows, columns=['claim_id', 'role', 'path', 'result', 'error']).to_parquet(parquet, index=False)
+
+
+def run(claims, output, workers=None, metrics_path=None):
+    done = _resume(output)
+    pending = [c for c in claims if c['claim_id'] not in done]
+    print('Pratiche: %d, già completate: %d, da elaborare: %d' % (len(claims), len(claims) - len(pending),
+                                                                  len(pending)))
+    sys.stdout.flush()
+
+    with open(output, 'a', encoding='utf-8') as out, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_claim, claim) for claim in pending]
+        for n, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            # Le misure complete della pratica confluiscono nel registro di questo processo
+            metrics.REGISTRY.merge(record.pop('metrics'))
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+            print('[%d/%d] %s (%.1fs)' % (n, len(pending), record['claim_id'], record['elapsed']))
+            sys.stdout.flush()
+            if metrics_path:
+                metrics.export(metrics_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analisi batch delle pratiche senza Streamlit')
+    parser.add_argument('directory', nargs='?', help='cartella con una sottocartella per pratica')
+    parser.add_argument('--manifest', help='csv con le colonne claim_id, denuncia, foto, fattura')
+    parser.add_argument('--output', required=True, help='file JSONL dei risultati (fa anche da checkpoint)')
+    parser.add_argument('--parquet', help='al termine converte i risultati anche in Parquet')
+    parser.add_argument('--metrics', help='file delle metriche per fase (.prom in formato Prometheus, oppure .json)')
+    parser.add_argument('--workers', type=int, default=None, help='numero di processi (default: numero di CPU)')
+    args = parser.parse_args()
+
+    if args.manifest:
+        claims = claims_from_manifest(args.manifest)
+    elif args.directory:
+        claims = claims_from_directory(args.directory)
+    else:
+        parser.error('specificare una cartella o un manifest')
+
+    run(claims, args.output, args.workers, args.metrics)
+    if args.parquet:
+        to_parquet(args.output, args.parquet)
+
+
+if __name__ == '__main__':
+    main()
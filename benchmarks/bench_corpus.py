@@ -0,0 +1,77 @@
+# Parità e throughput della modalità corpus rispetto all'estrazione documento per documento
+#
+# Uso: python benchmarks/bench_corpus.py [--documents 20000] [--chunksize 10000]
+#
+# Genera denunce e fatture sintetiche brevi (da 1 a 12 righe, così alcuni campi mancano), più alcuni testi limite
+# (righe senza ritorno a capo finale, \r\n, maiuscole che cambiano lunghezza in minuscolo, email escluse), verifica
+# che corpus.read_claims / read_invoices restituiscano per ogni documento lo stesso dizionario di
+# read_claim_data / read_invoice_data e confronta i tempi.
+import io
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import synthetic
+import corpus
+from extraction import read_claim_data, read_invoice_data
+
+EDGE_CASES = ['',
+              'nessun dato utile',
+              'Polizza n. 1234567 del 3 marzo 2019',
+              'polizza\nnumero 12/345678 avvenuto il 04/05/2018',
+              'Sinistro del 01/02/2019\r\nP.IVA 12345678901\r\nsinistri@realemutua.it\r\n',
+              'scrivere a mario@x.it, oppure a sinistri@realemutua.it\nRSSMRA80A01L219M',
+              'İstanbul iva 12345678901 data evento 12 gen 2020',
+              'Totale € 1.234,50\nacconto 300 euro\nTOTALE FINALE 2.000 €',
+              'incendio incendi fuoco\nacqua acqua',
+              'info@studio.it sinistri@reale.it\nluca@verdi.it']
+
+
+def _documents(n, generate, seed):
+    rnd = random.Random(seed)
+    texts = [''.join(generate(rnd.randint(1, 12), seed=seed * 1000003 + i)) for i in range(n)]
+    # Metà dei documenti senza ritorno a capo finale
+    texts = [t.rstrip('\n') if i % 2 else t for i, t in enumerate(texts)]
+    return texts + EDGE_CASES
+
+
+def check(name, texts, single, bulk):
+    series = pd.Series(texts)
+    start = time.perf_counter()
+    expected = [single(io.StringIO(t).readlines()) for t in texts]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    got = corpus.records(bulk(series))
+    bulk_time = time.perf_counter() - start
+    mismatches = [(t, e, g) for t, e, g in zip(texts, expected, got) if e != g]
+    print('%-10s %8d documenti  singolo %8.2f s  corpus %8.2f s  %6.2fx  differenze %d' % (
+        name, len(texts), single_time, bulk_time, single_time / bulk_time, len(mismatches)))
+    for t, e, g in mismatches[:5]:
+        print('  %r\n    atteso  %r\n    trovato %r' % (t[:200], e, g))
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    now = datetime.now()
+    ok = check('denunce', _documents(args.documents, synthetic.denuncia, args.seed), read_claim_data,
+               lambda s: corpus.read_claims(s, now))
+    ok = check('fatture', _documents(args.documents, synthetic.fattura, args.seed), read_invoice_data,
+               corpus.read_invoices) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
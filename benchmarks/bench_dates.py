@@ -0,0 +1,64 @@
+# Throughput del riconoscimento delle date rispetto alla cascata originale re.sub + dateutil
+#
+# Uso: python benchmarks/bench_dates.py [--n 20000]
+#
+# Confronta le velocità sulle date scritte nei formati più comuni. La parità con la versione originale è verificata
+# da tests/test_dates.py.
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dateutil.parser as dparser
+import dates
+from extraction import DATE_RE
+
+COMMON = ['{d:02d}/{m:02d}/{y}', '{d:02d}-{m:02d}-{y}', '{d:02d}.{m:02d}.{y}', '{d:02d} {n} {y}', '{d:02d}/{m:02d}']
+
+
+def legacy_parse(matched_date):
+    # Copia del codice originale di _extract_data_evento
+    for month, english in dates._ENGLISH:
+        matched_date = month.sub(english, matched_date)
+    try:
+        return dparser.parse(matched_date)
+    except:
+        return None
+
+
+def common_matches(n, seed=0):
+    rnd = random.Random(seed)
+    names = list(dates.MONTHS)
+    out = []
+    for _ in range(n):
+        year = rnd.choice(['%d' % rnd.randint(2005, 2021), '%02d' % rnd.randint(5, 21)])
+        text = rnd.choice(COMMON).format(d=rnd.randint(1, 28), m=rnd.randint(1, 12), n=rnd.choice(names), y=year)
+        out.append(DATE_RE.search(text))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=20000, help='date per il benchmark di throughput')
+    args = parser.parse_args()
+
+    now = datetime.now()
+    matches = common_matches(args.n)
+    start = time.perf_counter()
+    for match in matches:
+        legacy_parse(match.group())
+    t_legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    for match in matches:
+        dates.parse_date(match, now)
+    t_fast = time.perf_counter() - start
+    print('Throughput: originale %.0f date/s, parse_date %.0f date/s (%.1fx)' % (args.n / t_legacy, args.n / t_fast,
+                                                                               t_legacy / t_fast))
+
+
+if __name__ == '__main__':
+    main()
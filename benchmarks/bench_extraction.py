@@ -0,0 +1,50 @@
+# Micro-benchmark del motore di estrazione rispetto agli estrattori originali. La parità e lo scarto dei codici
+# non validi sono verificati in tests/test_extraction.py
+#
+# Uso: python benchmarks/bench_extraction.py [--sizes 100 1000 10000] [--repeat 3]
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import extraction
+import legacy_extraction
+import synthetic
+
+
+def _best_time(func, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [('denuncia', synthetic.denuncia, legacy_extraction.read_claim_data, extraction.read_claim_data),
+             ('fattura', synthetic.fattura, legacy_extraction.read_invoice_data, extraction.read_invoice_data)]
+    print('%-10s %8s %12s %12s %8s' % ('documento', 'righe', 'originale', 'motore', 'speedup'))
+    for name, generate, legacy, engine in cases:
+        for size in args.sizes:
+            lines = generate(size)
+            t_legacy, r_legacy = _best_time(legacy, lines, args.repeat)
+            t_engine, r_engine = _best_time(engine, lines, args.repeat)
+            # Il motore deve restituire esattamente gli stessi dati
+            if r_legacy != r_engine:
+                raise AssertionError('%s (%d righe): %r != %r' % (name, size, r_engine, r_legacy))
+            print('%-10s %8d %10.1fms %10.1fms %7.1fx' % (name, size, t_legacy * 1000, t_engine * 1000,
+                                                          t_legacy / t_engine))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# Indice dei dati estratti: costruzione e latenza delle ricerche su molte pratiche
+#
+# Uso: python benchmarks/bench_index.py [--documents 300000] [--lookups 2000]
+#
+# Genera denunce e fatture sintetiche (campi come quelli di read_claim_data / read_invoice_data, con codici fiscali
+# e partite IVA validi quasi tutti diversi e alcune polizze condivise tra denuncia e fattura), le indicizza a blocchi
+# in un database temporaneo e misura l'aggiunta incrementale di un documento, le ricerche per polizza, CF e P.IVA,
+# la ricerca dei documenti collegati (matches) e una ricerca su un valore molto frequente.
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+from claim_index import ClaimIndex
+from identifiers import cf_check_char
+from run_benchmarks import _percentile
+
+LETTERS = 'ABCDEFGHILMNOPRSTUVZ'
+MONTHS = 'ABCDEHLMPRST'
+
+
+def _cf(rnd):
+    code = ''.join(rnd.choice(LETTERS) for _ in range(6)) + '%02d' % rnd.randint(0, 99) + rnd.choice(MONTHS) + \
+        '%02d' % rnd.randint(1, 28) + rnd.choice('ABCDEFGHLMZ') + '%03d' % rnd.randint(100, 999)
+    return code + cf_check_char(code)
+
+
+def _documents(n, seed):
+    # Coppie denuncia/fattura: metà delle fatture riporta la polizza e il CF della denuncia
+    rnd = random.Random(seed)
+    for i in range(n // 2):
+        values = synthetic._valori(rnd)
+        cf = _cf(rnd)
+        claim = {'Numero polizza': values['polizza'], 'Data evento': values['data_breve'].replace('/', '-'),
+                 'Codice Fiscale': cf, 'Partita IVA': synthetic._piva(rnd), 'Email': values['email'],
+                 'Causale': 'Acqua condotta'}
+        invoice = {'Codice Fiscale': cf if i % 2 else _cf(rnd), 'Partita IVA': synthetic._piva(rnd),
+                   'Importo': float(rnd.randint(100, 9000))}
+        if i % 2:
+            invoice['Numero polizza'] = values['polizza']
+        yield 'denuncia-%d' % i, 'denuncia', claim
+        yield 'fattura-%d' % i, 'fattura', invoice
+
+
+def _timed(func, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _print(name, latencies):
+    print('%-26s %7d %10.3f %10.3f %10.3f' % (name, len(latencies), _percentile(latencies, 50) * 1000,
+                                              _percentile(latencies, 95) * 1000, _percentile(latencies, 99) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=300000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        index = ClaimIndex(os.path.join(workdir, 'index.sqlite'))
+        documents = list(_documents(args.documents, args.seed))
+        start = time.perf_counter()
+        for i in range(0, len(documents), 1000):
+            index.add_many(documents[i:i + 1000])
+        elapsed = time.perf_counter() - start
+        print('%d documenti indicizzati in %.1f s (%.0f documenti/s), %.1f MB' % (
+            len(index), elapsed, len(documents) / elapsed,
+            os.path.getsize(os.path.join(workdir, 'index.sqlite')) / 1e6))
+
+        rnd = random.Random(args.seed + 1)
+        sample = [rnd.choice(documents) for _ in range(args.lookups)]
+        claims = [d for d in sample if d[1] == 'denuncia']
+        print('%-26s %7s %10s %10s %10s' % ('caso', 'n', 'p50 ms', 'p95 ms', 'p99 ms'))
+        _print('add (incrementale)', _timed(index.add, [('nuovo-%d' % i, 'denuncia', d[2])
+                                                        for i, d in enumerate(sample[:200])]))
+        _print('lookup polizza', _timed(index.lookup, [('polizza', d[2]['Numero polizza']) for d in claims]))
+        _print('lookup cf', _timed(index.lookup, [('cf', d[2]['Codice Fiscale']) for d in sample]))
+        _print('lookup iva', _timed(index.lookup, [('iva', d[2]['Partita IVA']) for d in sample]))
+        _print('matches', _timed(lambda fields, key: index.matches(fields, exclude=key),
+                                 [(d[2], d[0]) for d in sample]))
+        # Le email sintetiche sono solo tre: ogni valore compare in circa un terzo delle denunce
+        _print('lookup valore frequente', _timed(index.lookup, [('email', 'info@studio.it')] * 20))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
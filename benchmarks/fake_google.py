@@ -0,0 +1,234 @@
+# Server gRPC locale che sostituisce Document AI (ProcessDocument) e Vision (BatchAnnotateImages) per i test di carico
+#
+# Uso:
+#   python benchmarks/fake_google.py [--port 50051] [--documentai-latency 1.0] [--vision-latency 0.3] [--jitter 0.3]
+#                                    [--error-rate 0.01] [--quota-rate 0.02] [--documentai-per-minute 600]
+#                                    [--vision-per-minute 1800] [--recordings registrazioni/ [--record]]
+#
+# L'app si collega al server con le impostazioni documentai_endpoint e vision_endpoint (clients.py), ad esempio
+#   RMA_DOCUMENTAI_ENDPOINT=localhost:50051 RMA_VISION_ENDPOINT=localhost:50051 streamlit run main.py
+#
+# Risposte: se nella cartella delle registrazioni c'è documentai/<sha256 del pdf>.json (ProcessResponse) oppure
+# vision/<sha256 dell'immagine>.json (AnnotateImageResponse) restituisco quella, altrimenti una risposta sintetica:
+# il livello di testo del pdf (o una denuncia sintetica per le pagine senza testo) e label scelte in modo
+# deterministico dal contenuto dell'immagine. Con --record le richieste senza registrazione vengono inoltrate alle
+# API vere (credenziali dai secrets, come l'app) e le risposte salvate.
+# Guasti: latenza per chiamata e per unità (pagine, immagini), errori UNAVAILABLE con probabilità --error-rate,
+# RESOURCE_EXHAUSTED con probabilità --quota-rate o quando si supera la quota al minuto.
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from concurrent import futures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import grpc
+import fitz
+from google.cloud import documentai, vision
+import synthetic
+
+DOCUMENTAI_SERVICE = 'google.cloud.documentai.v1.DocumentProcessorService'
+VISION_SERVICE = 'google.cloud.vision.v1.ImageAnnotator'
+# Label in inglese, come quelle di Vision: _select_labels le traduce e tiene solo quelle note
+LABELS = ['Plumbing', 'Plumbing fixture', 'Ceiling', 'Plaster', 'Bathroom', 'Floor', 'Flooring', 'Building',
+          'Building material', 'House', 'Window', 'Toilet', 'Wall', 'Water', 'Tile', 'Wood']
+
+
+class _Quota(object):
+    # Token bucket in unità al minuto (pagine per Document AI, immagini per Vision); 0 = illimitata
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.capacity = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, units):
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < units:
+                return False
+            self.tokens -= units
+            return True
+
+
+class FakeGoogle(object):
+    def __init__(self, documentai_latency=1.0, vision_latency=0.3, unit_latency=0.05, jitter=0.3, error_rate=0.0,
+                 quota_rate=0.0, documentai_per_minute=0, vision_per_minute=0, recordings=None, record=False,
+                 seed=None):
+        self.latency = {'documentai': documentai_latency, 'vision': vision_latency}
+        self.unit_latency = unit_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.quotas = {'documentai': _Quota(documentai_per_minute), 'vision': _Quota(vision_per_minute)}
+        self.recordings = recordings
+        self.record = record
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def _count(self, api, outcome, units=1):
+        with self.lock:
+            s = self.stats.setdefault(api, {'calls': 0, 'units': 0, 'ok': 0, 'unavailable': 0, 'quota': 0})
+            s['calls'] += 1
+            s['units'] += units
+            s[outcome] += 1
+
+    def _fault(self, api, units, context):
+        # Latenza simulata, poi eventuale errore: un errore viene restituito dopo la stessa attesa di una risposta
+        with self.lock:
+            draw = self.random.random()
+            factor = self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(max(0.0, self.latency[api] * factor + self.unit_latency * units))
+        if draw < self.quota_rate or not self.quotas[api].take(units):
+            self._count(api, 'quota', units)
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Quota exceeded (fake)')
+        if draw < self.quota_rate + self.error_rate:
+            self._count(api, 'unavailable', units)
+            context.abort(grpc.StatusCode.UNAVAILABLE, 'Service unavailable (fake)')
+        self._count(api, 'ok', units)
+
+    def _recording_path(self, api, content):
+        return os.path.join(self.recordings, api, hashlib.sha256(content).hexdigest() + '.json')
+
+    def _recorded(self, api, content, message_class, fetch):
+        # Risposta registrata; con --record, se manca, la chiedo all'API vera e la salvo
+        if not self.recordings:
+            return None
+        path = self._recording_path(api, content)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return message_class.from_json(f.read())
+        if not self.record:
+            return None
+        response = fetch()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(message_class.to_json(response))
+        return response
+
+    def process_document(self, request, context):
+        content = request.raw_document.content
+        pdf = fitz.open(stream=content, filetype='pdf')
+        self._fault('documentai', len(pdf), context)
+        response = self._recorded('documentai', content, documentai.ProcessResponse,
+                                  lambda: self._forward_document(request))
+        return response if response is not None else self._synthetic_document(pdf, content)
+
+    def _synthetic_document(self, pdf, content):
+        # Testo del pdf pagina per pagina; le pagine senza testo (scansioni) diventano una denuncia sintetica
+        seed = int.from_bytes(hashlib.sha256(content).digest()[:4], 'little')
+        text = ''
+        pages = []
+        for i, page in enumerate(pdf):
+            page_text = page.getText() or ''.join(synthetic.denuncia(20, seed + i))
+            segment = documentai.Document.TextAnchor.TextSegment(start_index=len(text),
+                                                                 end_index=len(text) + len(page_text))
+            layout = documentai.Document.Page.Layout(text_anchor=documentai.Document.TextAnchor(
+                text_segments=[segment]))
+            pages.append(documentai.Document.Page(page_number=i + 1, layout=layout))
+            text += page_text
+        return documentai.ProcessResponse(document=documentai.Document(text=text, pages=pages))
+
+    def _forward_document(self, request):
+        from clients import documentai_client
+        import config
+        secrets = config.get_secrets()
+        request.name = 'projects/%s/locations/%s/processors/%s' % (secrets['project_id'], secrets['location'],
+                                                                     secrets['processor_id'])
+        return documentai_client().process_document(request=request)
+
+    def batch_annotate_images(self, request, context):
+        self._fault('vision', len(request.requests), context)
+        responses = []
+        for r in request.requests:
+            content = r.image.content
+            response = self._recorded('vision', content, vision.AnnotateImageResponse,
+                                      lambda: self._forward_image(r))
+            responses.append(response if response is not None else self._synthetic_labels(content))
+        return vision.BatchAnnotateImagesResponse(responses=responses)
+
+    def _synthetic_labels(self, content):
+        rnd = random.Random(hashlib.sha256(content).digest())
+        labels = rnd.sample(LABELS, 4)
+        return vision.AnnotateImageResponse(label_annotations=[
+            vision.EntityAnnotation(description=label, score=round(rnd.uniform(0.55, 0.98), 2))
+            for label in labels])
+
+    def _forward_image(self, request):
+        from clients import vision_client
+        return vision_client().batch_annotate_images(requests=[request]).responses[0]
+
+    def handlers(self):
+        documentai_handler = grpc.unary_unary_rpc_method_handler(
+            self.process_document, request_deserializer=documentai.ProcessRequest.deserialize,
+            response_serializer=documentai.ProcessResponse.serialize)
+        vision_handler = grpc.unary_unary_rpc_method_handler(
+            self.batch_annotate_images, request_deserializer=vision.BatchAnnotateImagesRequest.deserialize,
+            response_serializer=vision.BatchAnnotateImagesResponse.serialize)
+        return [grpc.method_handlers_generic_handler(DOCUMENTAI_SERVICE, {'ProcessDocument': documentai_handler}),
+                grpc.method_handlers_generic_handler(VISION_SERVICE, {'BatchAnnotateImages': vision_handler})]
+
+
+def serve(fake, port=50051, max_workers=64):
+    # Avvia il server e restituisce (server, porta); port=0 sceglie una porta libera
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers(fake.handlers())
+    port = server.add_insecure_port('localhost:%d' % port)
+    server.start()
+    return server, port
+
+
+def add_arguments(parser):
+    parser.add_argument('--documentai-latency', type=float, default=1.0, help='secondi per chiamata')
+    parser.add_argument('--vision-latency', type=float, default=0.3, help='secondi per chiamata')
+    parser.add_argument('--unit-latency', type=float, default=0.05, help='secondi in più per pagina o immagine')
+    parser.add_argument('--jitter', type=float, default=0.3, help='variazione relativa della latenza')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probabilità di UNAVAILABLE')
+    parser.add_argument('--quota-rate', type=float, default=0.0, help='probabilità di RESOURCE_EXHAUSTED')
+    parser.add_argument('--documentai-per-minute', type=int, default=0, help='quota in pagine al minuto (0: nessuna)')
+    parser.add_argument('--vision-per-minute', type=int, default=0, help='quota in immagini al minuto (0: nessuna)')
+    parser.add_argument('--recordings', help='cartella delle risposte registrate')
+    parser.add_argument('--record', action='store_true', help='inoltra alle API vere e registra le risposte mancanti')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def from_arguments(args):
+    return FakeGoogle(args.documentai_latency, args.vision_latency, args.unit_latency, args.jitter, args.error_rate,
+                      args.quota_rate, args.documentai_per_minute, args.vision_per_minute, args.recordings,
+                      args.record, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Document AI e Vision finti per i test di carico')
+    parser.add_argument('--port', type=int, default=50051)
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.record and not args.recordings:
+        parser.error('--record richiede --recordings')
+
+    fake = from_arguments(args)
+    server, port = serve(fake, args.port)
+    print('In ascolto su localhost:%d' % port)
+    sys.stdout.flush()
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(0)
+    print(json.dumps(fake.stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
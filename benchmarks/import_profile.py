@@ -0,0 +1,112 @@
+# Profilo dei tempi di import, da confrontare prima e dopo una modifica
+#
+# Uso: python benchmarks/import_profile.py [--repeat 5] [--top 15] [--output profilo.json] [--compare prima.json]
+#
+# Ogni misura gira in un interprete nuovo con python -X importtime. "startup" sono gli import di primo livello di
+# main.py (quelli eseguiti prima che la pagina venga mostrata, letti con ast), gli altri obiettivi sono i moduli di
+# analisi importati dai worker della coda. Per ogni obiettivo riporto la mediana del tempo cumulativo e il tempo
+# proprio dei pacchetti più pesanti; con --compare stampa la differenza rispetto a un profilo salvato in precedenza.
+import os
+import re
+import ast
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = ['text_analysis', 'invoice_analysis', 'image_analysis', 'jobs', 'corpus']
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def startup_imports():
+    # Gli import di primo livello di main.py (gli import dentro i blocchi condizionali sono esclusi)
+    with open(os.path.join(ROOT, 'main.py'), encoding='utf-8') as f:
+        source = f.read()
+    return [ast.get_source_segment(source, node) for node in ast.parse(source).body
+            if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def _importtime(code):
+    # Righe di -X importtime: (tempo proprio in ms, tempo cumulativo in ms, profondità, modulo)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError('import non riuscito:\n' + proc.stderr[-2000:])
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match is not None:
+            rows.append((int(match.group(1)) / 1000.0, int(match.group(2)) / 1000.0, len(match.group(3)),
+                         match.group(4)))
+    return rows
+
+
+def _profile(statements, interpreter):
+    # Tempo totale degli import e tempo proprio sommato per pacchetto, esclusi i moduli caricati dall'interprete
+    # all'avvio (che non dipendono dall'applicazione)
+    packages = {}
+    total = 0.0
+    for own, cumulative, depth, name in _importtime('\n'.join(statements)):
+        if name in interpreter:
+            continue
+        if depth == 1:
+            total += cumulative
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + own
+    return total, packages
+
+
+def profile(name, statements, repeat, interpreter):
+    runs = [_profile(statements, interpreter) for _ in range(repeat)]
+    packages = {}
+    for package in set(p for _, pkgs in runs for p in pkgs):
+        packages[package] = statistics.median(pkgs.get(package, 0.0) for _, pkgs in runs)
+    return {'target': name, 'statements': statements,
+            'total_ms': statistics.median(total for total, _ in runs),
+            'packages_ms': dict(sorted(packages.items(), key=lambda item: -item[1]))}
+
+
+def report(profiles, top, before=None):
+    before = {p['target']: p for p in (before or [])}
+    for p in profiles:
+        old = before.get(p['target'])
+        line = '%-18s %9.1f ms' % (p['target'], p['total_ms'])
+        if old is not None:
+            line += '  prima %9.1f ms  (%+.1f ms)' % (old['total_ms'], p['total_ms'] - old['total_ms'])
+        print(line)
+        for package, ms in list(p['packages_ms'].items())[:top]:
+            line = '    %-24s %9.1f ms' % (package, ms)
+            if old is not None:
+                line += '  prima %9.1f ms' % old['packages_ms'].get(package, 0.0)
+            print(line)
+        if old is not None:
+            # Pacchetti che non vengono più importati dall'obiettivo
+            for package in [k for k in old['packages_ms'] if k not in p['packages_ms']][:top]:
+                print('    %-24s %9s     prima %9.1f ms' % (package, '-', old['packages_ms'][package]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', help='file json in cui salvare il profilo')
+    parser.add_argument('--compare', help='profilo json salvato in precedenza (es. prima della modifica)')
+    args = parser.parse_args()
+
+    interpreter = set(name for _, _, _, name in _importtime('pass'))
+    profiles = [profile('startup', startup_imports(), args.repeat, interpreter)]
+    profiles += [profile(target, ['import ' + target], args.repeat, interpreter) for target in TARGETS]
+    before = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            before = json.load(f)
+    report(profiles, args.top, before)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(profiles, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
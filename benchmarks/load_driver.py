@@ -0,0 +1,241 @@
+# Test di carico del flusso di main.py con sessioni Streamlit simulate, senza consumare quota
+#
+# Uso:
+#   python benchmarks/load_driver.py [--sessions 40] [--concurrency 8] [--mix denuncia=1,foto=0.8,fattura=0.6]
+#                                  [--pages 2] [--photos 4] [--repeat-rate 0] [--output risultati.json]
+#                                  [--endpoint localhost:50051 | opzioni di fake_google.py]
+#
+# Ogni sessione carica una combinazione di denuncia (pdf), foto (pdf con più immagini) e fattura (pdf) secondo le
+# probabilità di --mix ed esegue gli stessi passi dello script a ogni rerun: jobs.poll (la stessa funzione di
+# run_job in main.py: accodamento del job una sola volta, lettura dello stato, misure del job alla sessione che lo ha
+# accodato) e, per le foto, lettura della miniatura; finché ci sono job in corso aspetta --rerun secondi e
+# riesegue, come st.experimental_rerun in main.py.
+# Le sessioni girano in thread dello stesso processo, come nel server Streamlit, con la coda dei job e le cache in
+# una cartella temporanea. Document AI e Vision sono sostituiti dal server finto (fake_google.py), avviato in questo
+# processo oppure già in ascolto su --endpoint. Con --repeat-rate una parte delle sessioni ricarica i file di una
+# sessione precedente (cache e single-flight). Il rapporto riporta throughput e percentili di latenza.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+import fake_google
+from run_benchmarks import FakeUpload, _percentile
+
+KINDS = ['denuncia', 'foto', 'fattura']
+DEFAULT_MIX = 'denuncia=1,foto=0.8,fattura=0.6'
+FAKE_SECRETS = {'project_id': 'load-test', 'location': 'eu', 'processor_id': 'fake-processor'}
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        kind, _, probability = item.partition('=')
+        if kind not in KINDS:
+            raise ValueError('Tipo di documento sconosciuto: %s' % kind)
+        mix[kind] = float(probability or 1)
+    return mix
+
+
+def make_uploads(n_sessions, mix, pages, photos, photo_side, repeat_rate, seed):
+    # Contenuti (tipo, bytes, mime) di ogni sessione; le sessioni ripetute riusano i file di una precedente
+    rnd = random.Random(seed)
+    sessions = []
+    for s in range(n_sessions):
+        if sessions and rnd.random() < repeat_rate:
+            sessions.append(rnd.choice(sessions))
+            continue
+        files = []
+        if rnd.random() < mix.get('denuncia', 0):
+            files.append(('denuncia', synthetic.testo_pdf(pages, seed * 1000003 + s), 'application/pdf'))
+        if rnd.random() < mix.get('foto', 0):
+            files.append(('foto', synthetic.foto_pdf(photos, photo_side, seed * 1000003 + s), 'application/pdf'))
+        if rnd.random() < mix.get('fattura', 0):
+            files.append(('fattura', synthetic.testo_pdf(1, seed * 1000003 + s, synthetic.fattura), 'application/pdf'))
+        sessions.append(files)
+    return sessions
+
+
+class Session(object):
+    # Lo stato di una sessione Streamlit (SessionState in main.py) e i passi di una esecuzione dello script
+    _ids = iter(range(1, 1 << 62))
+    _ids_lock = threading.Lock()
+
+    def __init__(self, queue, files):
+        import metrics
+        self.queue = queue
+        with Session._ids_lock:
+            # Come gli UploadedFile: ogni sessione ha i suoi id di upload
+            self.uploads = [(kind, content, mime_type, next(Session._ids)) for kind, content, mime_type in files]
+        self.metrics = metrics.Registry()
+        self.jobs = {}
+        self.seen = {}
+
+    def rerun(self, started):
+        # Una esecuzione dello script; True se ci sono ancora job in corso
+        import jobs
+        import metrics
+        metrics.bind(self.metrics)
+        pending = False
+        for kind, content, mime_type, upload_id in self.uploads:
+            job = jobs.poll(self.queue, kind, FakeUpload(content, upload_id, mime_type), self.jobs, self.metrics)
+            if job['status'] in ('queued', 'running'):
+                pending = True
+                continue
+            if kind not in self.seen:
+                self.seen[kind] = {'job': job, 'seen': time.perf_counter() - started}
+            if kind == 'foto' and job['status'] == 'done' and job['result']:
+                # La prima immagine viene mostrata come miniatura
+                from image_analysis import image_at, get_thumbnail
+                first = min(job['result'], key=int)
+                get_thumbnail(job['result'][first]['thumbnail']) or image_at(FakeUpload(content, upload_id,
+                                                                                          mime_type), int(first))
+        return pending
+
+
+def run_session(queue, files, rerun_interval):
+    session = Session(queue, files)
+    started = time.perf_counter()
+    script_times = []
+    while True:
+        start = time.perf_counter()
+        pending = session.rerun(started)
+        script_times.append(time.perf_counter() - start)
+        if not pending:
+            break
+        time.sleep(rerun_interval)
+    return {'seconds': time.perf_counter() - started, 'reruns': len(script_times), 'script': script_times,
+            'jobs': session.seen}
+
+
+def _stats(values):
+    if not values:
+        return {'count': 0}
+    return {'count': len(values),
+            'p50_ms': _percentile(values, 50) * 1000,
+            'p90_ms': _percentile(values, 90) * 1000,
+            'p99_ms': _percentile(values, 99) * 1000,
+            'max_ms': max(values) * 1000}
+
+
+def report(results, wall, fake=None):
+    import jobs
+    import metrics
+    out = {'sessions': len(results), 'wall_seconds': wall,
+           'sessions_per_minute': len(results) / wall * 60 if wall else 0.0,
+           'session': _stats([r['seconds'] for r in results]),
+           'script_rerun': _stats([t for r in results for t in r['script']]),
+           'reruns_per_session': sum(r['reruns'] for r in results) / len(results) if results else 0.0,
+           'kinds': {}}
+    for kind in KINDS:
+        seen = [r['jobs'][kind] for r in results if kind in r['jobs']]
+        if not seen:
+            continue
+        timings = [jobs.job_timings(s['job']) for s in seen]
+        out['kinds'][kind] = {'errors': sum(1 for s in seen if s['job']['status'] == 'error'),
+                              'visible': _stats([s['seen'] for s in seen]),
+                              'coda': _stats([t['coda'] for t in timings if 'coda' in t]),
+                              'analisi': _stats([t['analisi'] for t in timings if 'analisi' in t])}
+        out['jobs_per_minute'] = out.get('jobs_per_minute', 0.0) + (len(seen) / wall * 60 if wall else 0.0)
+    out['apis'] = metrics.REGISTRY.summary()['apis']
+    if fake is not None:
+        out['fake_server'] = fake.stats
+    return out
+
+
+def print_report(out):
+    print('%d sessioni in %.1f s: %.1f sessioni/min, %.1f job/min, %.1f rerun per sessione' % (
+        out['sessions'], out['wall_seconds'], out['sessions_per_minute'], out.get('jobs_per_minute', 0.0),
+        out['reruns_per_session']))
+    print('%-28s %7s %10s %10s %10s %10s' % ('latenza', 'n', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    rows = [('sessione completa', out['session']), ('esecuzione script', out['script_rerun'])]
+    for kind, k in out['kinds'].items():
+        rows += [(kind + ' visibile', k['visible']), (kind + ' coda', k['coda']), (kind + ' analisi', k['analisi'])]
+    for name, s in rows:
+        if s['count']:
+            print('%-28s %7d %10.1f %10.1f %10.1f %10.1f' % (name, s['count'], s['p50_ms'], s['p90_ms'],
+                                                              s['p99_ms'], s['max_ms']))
+    for kind, k in out['kinds'].items():
+        if k['errors']:
+            print('%s: %d job in errore' % (kind, k['errors']))
+    for api, usage in out['apis'].items():
+        print('%-12s chiamate %5d  unità %6d  retry quota %4d  attesa rate limiter %.1f s' % (
+            api, usage.get('calls', 0), usage.get('units', 0), usage.get('retries', 0), usage.get('wait_seconds', 0)))
+    for api, s in out.get('fake_server', {}).items():
+        print('server finto %-12s %s' % (api, s))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test di carico delle sessioni di main.py con API finte')
+    parser.add_argument('--sessions', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8, help='sessioni contemporanee')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='probabilità di ogni file per sessione')
+    parser.add_argument('--pages', type=int, default=2, help='pagine della denuncia')
+    parser.add_argument('--photos', type=int, default=4, help='immagini nel pdf delle foto')
+    parser.add_argument('--photo-side', type=int, default=400)
+    parser.add_argument('--repeat-rate', type=float, default=0.0, help='sessioni che ricaricano file già visti (0-1)')
+    parser.add_argument('--rerun', type=float, default=1.0, help='secondi tra due rerun (1 in main.py)')
+    parser.add_argument('--local-text-layer', action='store_true',
+                        help='usa il testo dei pdf nativi invece di inviarli a Document AI')
+    parser.add_argument('--workdir', help='cartella per coda e cache (default: temporanea, quindi cache vuote)')
+    parser.add_argument('--endpoint', help='server finto già avviato (host:porta)')
+    parser.add_argument('--output', help='file JSON dove salvare il rapporto')
+    fake_google.add_arguments(parser)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+    output = os.path.abspath(args.output) if args.output else None
+    if args.recordings:
+        args.recordings = os.path.abspath(args.recordings)
+
+    # Coda dei job e cache (percorsi relativi tmp/...) nella cartella di lavoro, secrets finti se non indicati
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix='rma_load_'))
+    if not os.environ.get('RMA_SECRETS'):
+        with open('secrets.json', 'w', encoding='utf-8') as f:
+            json.dump(FAKE_SECRETS, f)
+        os.environ['RMA_SECRETS'] = os.path.abspath('secrets.json')
+
+    fake = server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        fake = fake_google.from_arguments(args)
+        server, port = fake_google.serve(fake, 0)
+        endpoint = 'localhost:%d' % port
+    # Le impostazioni vengono lette dall'ambiente (RMA_<NOME>) prima di creare i client
+    os.environ['RMA_DOCUMENTAI_ENDPOINT'] = endpoint
+    os.environ['RMA_VISION_ENDPOINT'] = endpoint
+    if not args.local_text_layer:
+        os.environ['RMA_LOCAL_TEXT_LAYER'] = 'false'
+
+    print('Genero i file di %d sessioni...' % args.sessions)
+    uploads = make_uploads(args.sessions, mix, args.pages, args.photos, args.photo_side, args.repeat_rate,
+                           args.seed or 0)
+    import jobs
+    queue = jobs.get_queue()
+
+    print('Avvio %d sessioni, %d alla volta, server %s' % (args.sessions, args.concurrency, endpoint))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda files: run_session(queue, files, args.rerun), uploads))
+    wall = time.perf_counter() - start
+    if server is not None:
+        server.stop(0)
+
+    out = report(results, wall, fake)
+    print_report(out)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(out, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
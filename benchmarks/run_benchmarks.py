@@ -0,0 +1,226 @@
+# Suite di benchmark offline per gli estrattori e per la pipeline delle immagini
+#
+# Uso:
+#   python benchmarks/run_benchmarks.py --output bench.json [--quick] [--only extraction|images|memo]
+#   python benchmarks/run_benchmarks.py --compare vecchio.json nuovo.json
+#
+# I documenti sono generati sinteticamente e il client Vision è sostituito da uno finto: nessuna chiamata remota.
+# Per ogni caso vengono riportati throughput, percentili di latenza e picco di memoria (tracemalloc).
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+
+SIZES = [100, 1000, 10000]
+QUICK_SIZES = [100, 1000]
+PDF_PAGES = [1, 10, 50]
+QUICK_PDF_PAGES = [1, 10]
+UPLOAD_MB = [1, 10, 50]
+QUICK_UPLOAD_MB = [1, 10]
+
+
+class FakeVisionClient(object):
+    # Sostituisce ImageAnnotatorClient: risponde subito con label fisse
+    def batch_annotate_images(self, requests, retry=None, timeout=None):
+        labels = [SimpleNamespace(description='Plumbing', score=0.92),
+                  SimpleNamespace(description='Ceiling', score=0.81)]
+        return SimpleNamespace(responses=[SimpleNamespace(error=SimpleNamespace(message=''), label_annotations=labels)
+                                          for _ in requests])
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def measure(name, size, func, arg, n_bytes, repeat, setup=None):
+    # Latenze su più ripetizioni, poi un'esecuzione separata sotto tracemalloc per il picco di memoria
+    latencies = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    func(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sum(latencies)
+    result = {'name': name,
+              'size': size,
+              'repeat': repeat,
+              'throughput_per_s': repeat / total,
+              'mb_per_s': n_bytes * repeat / total / 1e6,
+              'p50_ms': _percentile(latencies, 50) * 1000,
+              'p95_ms': _percentile(latencies, 95) * 1000,
+              'p99_ms': _percentile(latencies, 99) * 1000,
+              'peak_kb': peak / 1024}
+    print('%-28s %7d %10.2f %10.2f %10.2f %12.0f' % (name, size, result['p50_ms'], result['p95_ms'],
+                                                     result['p99_ms'], result['peak_kb']))
+    sys.stdout.flush()
+    return result
+
+
+def bench_extraction(sizes, repeat):
+    import extraction
+
+    results = []
+    cases = [('extract_polizza', synthetic.denuncia, extraction.extract_polizza),
+             ('extract_data_evento', synthetic.denuncia, extraction.extract_data_evento),
+             ('extract_cf', synthetic.denuncia, extraction.extract_cf),
+             ('extract_iva', synthetic.denuncia, extraction.extract_iva),
+             ('extract_email', synthetic.denuncia, extraction.extract_email),
+             ('extract_category', synthetic.denuncia, extraction.extract_category),
+             ('extract_price', synthetic.fattura, extraction.extract_price),
+             ('read_claim_data', synthetic.denuncia, extraction.read_claim_data),
+             ('read_invoice_data', synthetic.fattura, extraction.read_invoice_data)]
+    for name, generate, func in cases:
+        for size in sizes:
+            lines = generate(size)
+            n_bytes = len(''.join(lines).encode('utf-8'))
+            # Gli estrattori singoli lavorano sul testo già normalizzato, le letture complete sulle righe
+            arg = lines if name.startswith('read_') else extraction.ParsedText(lines)
+            results.append(measure(name, size, func, arg, n_bytes, repeat))
+    return results
+
+
+def bench_images(pages, repeat):
+    import cache
+    import clients
+    import image_hash
+    import image_analysis
+
+    clients._clients['vision'] = FakeVisionClient()
+    workdir = tempfile.mkdtemp()
+
+    def fresh_cache():
+        # Ogni ripetizione parte da cache e indice vuoti, così si misura il percorso completo
+        path = os.path.join(workdir, 'cache_%f.sqlite' % time.time())
+        cache._cache = cache.ResultCache(path)
+        image_hash._index = image_hash.HashIndex(path)
+
+    results = []
+    try:
+        for n_pages in pages:
+            content = synthetic.foto_pdf(n_pages)
+            results.append(measure('iter_images', n_pages, lambda c: list(image_analysis._iter_images(
+                c, 'application/pdf')), content, len(content), repeat))
+            first = next(image_analysis._iter_images(content, 'application/pdf'))
+            results.append(measure('dhash', n_pages, image_hash.dhash, first, len(first), repeat))
+            results.append(measure('analyze_images', n_pages, lambda c: image_analysis.analyze_images(
+                c, 'application/pdf'), content, len(content), repeat, setup=fresh_cache))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+class FakeUpload(io.BytesIO):
+    # Come UploadedFile di Streamlit: a ogni rerun un nuovo oggetto con lo stesso id
+    def __init__(self, content, upload_id, mime_type):
+        super().__init__(content)
+        self.id = upload_id
+        self.type = mime_type
+
+
+def bench_memo(sizes, repeat):
+    # Costo di un rerun su un upload già analizzato: hash dell'intero contenuto (quello che paga una cache che
+    # hasha l'argomento) contro la chiave del job di jobs.poll (digest calcolato una sola volta per upload) e
+    # contro la miniatura memoizzata di image_at
+    import cache
+    import memo
+    import jobs
+
+    @memo.memoize('bench')
+    def shown(file, index):
+        return file.getvalue()[:1000]
+
+    results = []
+    for mb in sizes:
+        content = os.urandom(mb * 1024 * 1024)
+        version = jobs.job_version('denuncia', 'application/pdf')
+        memo.file_key(FakeUpload(content, mb, 'application/pdf'), version)
+        shown(FakeUpload(content, mb, 'application/pdf'), 1)
+        results.append(measure('rerun_full_hash', mb, lambda c: cache.content_key(FakeUpload(c, mb, 'application/pdf')
+                                                                                   .getvalue()), content, len(content),
+                               repeat))
+        results.append(measure('rerun_job_key', mb, lambda c: memo.file_key(FakeUpload(c, mb, 'application/pdf'),
+                                                                             version), content, len(content), repeat))
+        results.append(measure('rerun_image_at', mb, lambda c: shown(FakeUpload(c, mb, 'application/pdf'), 1), content,
+                               len(content), repeat))
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+    print('%-28s %7s %10s %10s %8s' % ('caso', 'size', 'p50 old', 'p50 new', 'ratio'))
+    for r in new:
+        o = old.get((r['name'], r['size']))
+        if o is None:
+            continue
+        print('%-28s %7d %10.2f %10.2f %7.2fx' % (r['name'], r['size'], o['p50_ms'], r['p50_ms'],
+                                                  o['p50_ms'] / r['p50_ms'] if r['p50_ms'] else float('inf')))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='file JSON dove salvare i risultati')
+    parser.add_argument('--quick', action='store_true', help='solo le dimensioni piccole')
+    parser.add_argument('--only', choices=['extraction', 'images', 'memo'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    print('%-28s %7s %10s %10s %10s %12s' % ('caso', 'size', 'p50 ms', 'p95 ms', 'p99 ms', 'peak KB'))
+    results = []
+    if args.only in (None, 'extraction'):
+        results += bench_extraction(QUICK_SIZES if args.quick else SIZES, args.repeat)
+    if args.only in (None, 'images'):
+        results += bench_images(QUICK_PDF_PAGES if args.quick else PDF_PAGES, args.repeat)
+    if args.only in (None, 'memo'):
+        results += bench_memo(QUICK_UPLOAD_MB if args.quick else UPLOAD_MB, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'commit': _commit(),
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Generatore di documenti sintetici (denunce e fatture in italiano) per i benchmark
+import random
+from identifiers import piva_check_digit
+
+FRASI_DENUNCIA = [
+    'Il sinistro è avvenuto in data {data} presso l\'abitazione del contraente.',
+    'Si segnala una perdita d\'acqua dovuta alla rottura di una tubazione nel bagno.',
+    'Polizza n. {polizza} intestata a {nome}, codice fiscale {cf}.',
+    'Contattare il danneggiato all\'indirizzo {email} oppure al numero 011 {telefono}.',
+    'L\'infiltrazione ha danneggiato il soffitto e l\'intonaco del piano inferiore.',
+    'Ditta incaricata P.IVA {iva}, intervento del {data_breve}.',
+    'In seguito al temporale con forte vento e pioggia si è verificato un corto circuito.',
+    'Comunicazione inviata a sinistri@realemutua.it il {data_breve}.',
+    'Riferimento pratica {numero} del {data}, importo stimato da definire.',
+]
+FRASI_FATTURA = [
+    'Fattura n. {numero} del {data_breve}',
+    'Cliente {nome} codice fiscale {cf} P.IVA {iva}',
+    'Sostituzione tubazione in rame, materiale e manodopera € {importo}',
+    'Ricerca perdita con termocamera {importo} euro',
+    'Ripristino intonaco e tinteggiatura soffitto € {importo}',
+    'Totale imponibile € {totale}',
+    'Totale da liquidare {totale} €',
+]
+MESI = ['gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno', 'luglio', 'agosto', 'settembre', 'ottobre',
+        'novembre', 'dicembre']
+NOMI = ['Mario Rossi', 'Giulia Bianchi', 'Luca Verdi', 'Anna Ferrari']
+# Codici fiscali e partite IVA con il carattere (cifra) di controllo corretto
+CF = ['RSSMRA80A01L219M', 'BNCGLI85M41F205B', 'VRDLCU72C15H501Y', 'FRRNNA90E52A944P']
+
+
+def _piva(rnd):
+    # Matricola non nulla e codice di un ufficio provinciale esistente
+    digits = '%07d%03d' % (rnd.randint(1, 9999999), rnd.randint(1, 100))
+    return digits + str(piva_check_digit(digits))
+
+
+def _valori(rnd):
+    return {'data': '%d %s %d' % (rnd.randint(1, 28), rnd.choice(MESI), rnd.randint(2012, 2021)),
+            'data_breve': '%02d/%02d/%d' % (rnd.randint(1, 28), rnd.randint(1, 12), rnd.randint(2012, 2021)),
+            'polizza': '%04d/%02d/%07d' % (rnd.randint(1000, 9999), rnd.randint(10, 99), rnd.randint(0, 9999999)),
+            'nome': rnd.choice(NOMI),
+            'cf': rnd.choice(CF),
+            'email': rnd.choice(['mario.rossi@gmail.com', 'g.bianchi@libero.it', 'info@studio.it']),
+            'telefono': rnd.randint(1000000, 9999999),
+            'iva': _piva(rnd),
+            'numero': rnd.randint(1000, 99999999),
+            'importo': '%d,%02d' % (rnd.randint(10, 3000), rnd.randint(0, 99)),
+            'totale': '%d.%03d,%02d' % (rnd.randint(1, 9), rnd.randint(0, 999), rnd.randint(0, 99))}
+
+
+def _genera(frasi, n_lines, seed):
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(n_lines):
+        lines.append(rnd.choice(frasi).format(**_valori(rnd)) + '\n')
+    return lines
+
+
+def denuncia(n_lines, seed=0):
+    return _genera(FRASI_DENUNCIA, n_lines, seed)
+
+
+def fattura(n_lines, seed=0):
+    return _genera(FRASI_FATTURA, n_lines, seed)
+
+
+def testo_pdf(n_pages, seed=0, generate=denuncia):
+    # Pdf nativo digitale con il testo di una denuncia (o di una fattura, con generate=fattura)
+    import fitz
+    lines = generate(n_pages * 40, seed)
+    doc = fitz.open()
+    for page_index in range(n_pages):
+        page = doc.newPage()
+        page.insertText((40, 40), ''.join(lines[page_index * 40:(page_index + 1) * 40]), fontsize=8)
+    return doc.write()
+
+
+def foto_pdf(n_pages, side=800, seed=0):
+    # Pdf con una foto per pagina: rumore casuale, quindi poco comprimibile come una foto reale
+    import fitz
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(n_pages):
+        size = side * side * 3
+        samples = rnd.getrandbits(size * 8).to_bytes(size, 'little')
+        image = fitz.Pixmap(fitz.csRGB, side, side, samples, False)
+        page = doc.newPage()
+        page.insertImage(page.rect, pixmap=image)
+    return doc.write()
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import metrics
+
+CACHE_PATH = r'tmp/cache.sqlite'
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Gli aggiornamenti di "accessed" letti dalla cache vengono scritti a gruppi: alla scrittura successiva, oppure
+# (in un thread a parte) quando se ne accumulano troppi o sono troppo vecchi. Le letture non attendono mai il lock
+# in scrittura
+CACHE_TOUCH_BATCH = 256
+CACHE_TOUCH_INTERVAL = 30.0
+# Voci esaminate per ogni passo dell'eviction
+CACHE_EVICT_BATCH = 256
+
+
+def content_key(content, version=''):
+    # La chiave dipende solo dal contenuto del file e dalla versione del modello che ha prodotto il risultato
+    h = hashlib.sha256()
+    h.update(version.encode('utf-8'))
+    h.update(b'\x00')
+    h.update(content)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Accessi non ancora salvati: (namespace, key) -> istante dell'ultima lettura
+        self._touched = {}
+        self._touched_since = None
+        self._flushing = False
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                         'namespace TEXT NOT NULL, '
+                         'key TEXT NOT NULL, '
+                         'value TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, '
+                         'accessed REAL NOT NULL, '
+                         'PRIMARY KEY (namespace, key))')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            # Dimensione totale delle voci, aggiornata nella stessa transazione di ogni scrittura
+            conn.execute('CREATE TABLE IF NOT EXISTS results_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            if conn.execute("SELECT value FROM results_meta WHERE name = 'total_bytes'").fetchone() is None:
+                # Database creato da una versione precedente: calcolo il totale una sola volta
+                conn.execute("INSERT INTO results_meta (name, value) "
+                             "SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM results")
+
+    def _connect(self):
+        # Una connessione per thread: le sessioni Streamlit girano su thread diversi
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def get(self, namespace, key):
+        # Lettura in autocommit (in WAL non attende le scritture); l'accesso viene salvato più tardi, a gruppi
+        start = time.perf_counter()
+        row = self._connect().execute('SELECT value FROM results WHERE namespace = ? AND key = ?',
+                                      (namespace, key)).fetchone()
+        if row is not None:
+            self._touch(namespace, key)
+        if row is None:
+            metrics.cache_lookup(namespace, False)
+            metrics.observe('cache.' + namespace, time.perf_counter() - start)
+            return None
+        metrics.cache_lookup(namespace, True)
+        value = json.loads(row[0])
+        metrics.observe('cache.' + namespace, time.perf_counter() - start, len(row[0]))
+        return value
+
+    def _touch(self, namespace, key):
+        now = time.time()
+        with self._lock:
+            self._touched[(namespace, key)] = now
+            if self._touched_since is None:
+                self._touched_since = now
+            due = not self._flushing and (len(self._touched) >= CACHE_TOUCH_BATCH or
+                                          now - self._touched_since >= CACHE_TOUCH_INTERVAL)
+            if due:
+                self._flushing = True
+        if due:
+            threading.Thread(target=self._flush, daemon=True).start()
+
+    def _flush(self):
+        try:
+            with self._transaction() as conn:
+                self._flush_touched(conn)
+        except sqlite3.Error:
+            # Gli accessi persi rendono solo meno precisa l'eviction
+            pass
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def _flush_touched(self, conn):
+        # Da chiamare dentro una transazione in scrittura
+        with self._lock:
+            touched, self._touched, self._touched_since = self._touched, {}, None
+        if touched:
+            conn.executemany('UPDATE results SET accessed = MAX(accessed, ?) WHERE namespace = ? AND key = ?',
+                             [(accessed, namespace, key) for (namespace, key), accessed in touched.items()])
+
+    def put(self, namespace, key, value):
+        data = json.dumps(value)
+        size = len(data.encode('utf-8'))
+        with self._transaction() as conn:
+            self._flush_touched(conn)
+            row = conn.execute('SELECT size FROM results WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO results (namespace, key, value, size, accessed) '
+                         'VALUES (?, ?, ?, ?, ?)', (namespace, key, data, size, time.time()))
+            total = conn.execute("SELECT value FROM results_meta WHERE name = 'total_bytes'").fetchone()[0]
+            total += size - (row[0] if row is not None else 0)
+            if total > self.max_bytes:
+                total = self._evict(conn, total)
+            conn.execute("UPDATE results_meta SET value = ? WHERE name = 'total_bytes'", (total,))
+
+    def _evict(self, conn, total):
+        # Elimino le voci usate meno di recente finché non rientro nella dimensione massima; leggo solo le voci
+        # più vecchie dall'indice su accessed, a blocchi
+        while total > self.max_bytes:
+            rows = conn.execute('SELECT namespace, key, size FROM results ORDER BY accessed ASC LIMIT ?',
+                                (CACHE_EVICT_BATCH,)).fetchall()
+            if not rows:
+                return 0
+            victims = []
+            for namespace, key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                victims.append((namespace, key))
+                total -= size
+            conn.executemany('DELETE FROM results WHERE namespace = ? AND key = ?', victims)
+        return total
+
+
+class _Transaction(object):
+    # Transazione esplicita: BEGIN IMMEDIATE serializza le scritture tra processi e sessioni concorrenti
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
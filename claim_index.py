@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from cache import content_key
+import config
+import metrics
+import memo
+
+# Indice persistente dei dati estratti da denunce e fatture: per ogni documento (chiave: hash del file e tipo di
+# analisi, lo stesso pdf può essere sia denuncia sia fattura) i campi trovati, e un indice invertito
+# campo/valore -> documenti per polizza, codice fiscale, partita IVA ed email. Viene aggiornato a ogni analisi
+# (analyze_text, analyze_invoice): collegare una fattura alla sua denuncia o trovare lo stesso CF/P.IVA in più
+# pratiche è una ricerca sulla chiave primaria, senza rileggere i documenti
+INDEX_PATH = r'tmp/index.sqlite'
+# Campi indicizzati (nome breve -> etichetta nei risultati di read_claim_data / read_invoice_data)
+INDEX_FIELDS = {'polizza': 'Numero polizza',
+                'cf': 'Codice Fiscale',
+                'iva': 'Partita IVA',
+                'email': 'Email'}
+MATCH_LIMIT = 20
+
+# Prefissi catturati da POLIZZA_RE / POLIZZA_LOOSE_RE (n, n., n°, #) e separatori equivalenti
+POLIZZA_PREFIX_RE = re.compile(r'^(?:n°|n\.|n|#)')
+POLIZZA_SEPARATOR_RE = re.compile(r'[\\\-]')
+
+
+def normalize(field, value):
+    # Stessa forma per i valori indicizzati e per quelli cercati
+    value = str(value).strip()
+    if field == 'polizza':
+        return POLIZZA_SEPARATOR_RE.sub('/', POLIZZA_PREFIX_RE.sub('', value.lower()))
+    if field == 'cf':
+        return value.upper()
+    if field == 'email':
+        return value.lower()
+    return value
+
+
+def document_key(content):
+    # L'unica chiave dei documenti nell'indice: l'hash dei byte del file caricato (cache.content_key senza
+    # versione). La usano le analisi dell'app (record), la coda dei job (rebuild_from_jobs) e corpus.py
+    return content_key(content)
+
+
+def upload_key(file):
+    # document_key di un file caricato, calcolata una sola volta per upload (memo.file_key senza versione)
+    return memo.file_key(file)
+
+
+def _postings(fields):
+    postings = []
+    for field, label in INDEX_FIELDS.items():
+        value = fields.get(label)
+        if value:
+            postings.append((field, normalize(field, value)))
+    return postings
+
+
+class ClaimIndex(object):
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Indice creato da una versione precedente, con la sola chiave del file: lo converto
+            old = [row[1] for row in conn.execute('PRAGMA table_info(postings)')]
+            if old and 'kind' not in old:
+                conn.execute('ALTER TABLE documents RENAME TO documents_old')
+                conn.execute('ALTER TABLE postings RENAME TO postings_old')
+                conn.execute('DROP INDEX IF EXISTS postings_key')
+            self._create(conn)
+            if old and 'kind' not in old:
+                conn.execute('INSERT INTO documents SELECT key, kind, fields, indexed FROM documents_old')
+                conn.execute('INSERT INTO postings SELECT p.field, p.value, p.indexed, p.key, d.kind '
+                             'FROM postings_old p JOIN documents_old d ON d.key = p.key')
+                conn.execute('DROP TABLE postings_old')
+                conn.execute('DROP TABLE documents_old')
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _create(self, conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS documents ('
+                     'key TEXT NOT NULL, '
+                     'kind TEXT NOT NULL, '
+                     'fields TEXT NOT NULL, '
+                     'indexed REAL NOT NULL, '
+                     'PRIMARY KEY (key, kind))')
+        # Senza rowid: le righe sono ordinate per (campo, valore, data), una ricerca legge solo le righe più recenti
+        # del valore anche quando il valore compare in moltissimi documenti. Il tipo è anche qui, così le ricerche
+        # per tipo non passano dalla tabella dei documenti
+        conn.execute('CREATE TABLE IF NOT EXISTS postings ('
+                     'field TEXT NOT NULL, '
+                     'value TEXT NOT NULL, '
+                     'indexed REAL NOT NULL, '
+                     'key TEXT NOT NULL, '
+                     'kind TEXT NOT NULL, '
+                     'PRIMARY KEY (field, value, indexed, key, kind)) WITHOUT ROWID')
+        conn.execute('CREATE INDEX IF NOT EXISTS postings_key ON postings (key, kind)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add_many(self, documents):
+        # documents: terne (chiave, tipo, campi); un documento già indicizzato con lo stesso tipo viene sostituito
+        conn = self._connect()
+        now = time.time()
+        with metrics.span('index.add'):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key, kind, fields in documents:
+                    conn.execute('DELETE FROM postings WHERE key = ? AND kind = ?', (key, kind))
+                    conn.execute('INSERT OR REPLACE INTO documents (key, kind, fields, indexed) VALUES (?, ?, ?, ?)',
+                                 (key, kind, json.dumps(fields), now))
+                    conn.executemany('INSERT OR IGNORE INTO postings (field, value, indexed, key, kind) '
+                                     'VALUES (?, ?, ?, ?, ?)',
+                                     [(field, value, now, key, kind) for field, value in _postings(fields)])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def add(self, key, kind, fields):
+        self.add_many([(key, kind, fields)])
+
+    def _find(self, field, value, kind, limit):
+        # Documenti con il valore (già normalizzato) nel campo, dal più recente
+        query = ('SELECT d.key, d.kind, d.fields, d.indexed FROM postings p '
+                 'JOIN documents d ON d.key = p.key AND d.kind = p.kind WHERE p.field = ? AND p.value = ?')
+        params = [field, value]
+        if kind is not None:
+            query += ' AND p.kind = ?'
+            params.append(kind)
+        rows = self._connect().execute(query + ' ORDER BY p.indexed DESC LIMIT ?', params + [limit]).fetchall()
+        return [{'key': key, 'kind': doc_kind, 'fields': json.loads(fields), 'indexed': indexed}
+                for key, doc_kind, fields, indexed in rows]
+
+    def lookup(self, field, value, kind=None, limit=MATCH_LIMIT):
+        # Ricerca per polizza, cf, iva o email
+        with metrics.span('index.lookup'):
+            return self._find(field, normalize(field, value), kind, limit)
+
+    def matches(self, fields, exclude=None, kind=None, limit=MATCH_LIMIT):
+        # Altri documenti che condividono almeno un campo indicizzato con i campi indicati; prima quelli con più
+        # campi in comune, poi i più recenti. matched: etichette dei campi in comune. exclude: chiave del file
+        # analizzato, escluso con qualsiasi tipo
+        found = {}
+        with metrics.span('index.matches'):
+            for field, value in _postings(fields):
+                # Per valore leggo al più limit + 2 documenti (il file escluso può esserci come denuncia e fattura)
+                for document in self._find(field, value, kind, limit + 2):
+                    if document['key'] != exclude:
+                        found.setdefault((document['key'], document['kind']), dict(document, matched=[]))[
+                            'matched'].append(INDEX_FIELDS[field])
+        out = sorted(found.values(), key=lambda d: (len(d['matched']), d['indexed']), reverse=True)
+        return out[:limit]
+
+    def repeated(self, field, kind='denuncia', min_count=2, limit=100):
+        # Valori presenti in almeno min_count documenti dello stesso tipo (es. lo stesso CF su più denunce)
+        rows = self._connect().execute(
+            'SELECT value, COUNT(*) AS n FROM postings WHERE field = ? AND kind = ? '
+            'GROUP BY value HAVING n >= ? ORDER BY n DESC, value LIMIT ?',
+            (field, kind, min_count, limit)).fetchall()
+        return [{'value': value, 'count': count} for value, count in rows]
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ClaimIndex()
+        return _index
+
+
+def record(content, kind, fields):
+    # Chiamata dopo ogni estrazione; l'indice è opzionale (claim_index_enabled=false lo disattiva)
+    if not config.get_setting('claim_index_enabled', True):
+        return
+    get_index().add(document_key(content), kind, fields)
+
+
+def rebuild_from_jobs(jobs_path, index=None):
+    # Popola l'indice con i risultati di denunce e fatture già presenti nella coda dei job (chiave salvata con il
+    # job; per i job più vecchi, calcolata dal contenuto se è ancora presente)
+    if index is None:
+        index = get_index()
+    conn = sqlite3.connect(jobs_path)
+    rows = conn.execute("SELECT kind, document, content, result FROM jobs WHERE status = 'done' AND kind IN "
+                        "('denuncia', 'fattura') AND (document IS NOT NULL OR content IS NOT NULL)")
+    total = 0
+    batch = []
+    for kind, document, content, result in rows:
+        batch.append((document if document is not None else document_key(content), kind, json.loads(result)))
+        if len(batch) == 1000:
+            index.add_many(batch)
+            total += len(batch)
+            batch = []
+    index.add_many(batch)
+    conn.close()
+    return total + len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ricerche nell\'indice dei dati estratti')
+    parser.add_argument('--index', default=INDEX_PATH)
+    parser.add_argument('--rebuild-from-jobs', metavar='JOBS', help='indicizza i job completati (es. tmp/jobs.sqlite)')
+    parser.add_argument('--lookup', nargs=2, metavar=('CAMPO', 'VALORE'), help='campo: ' + ', '.join(INDEX_FIELDS))
+    parser.add_argument('--repeated', choices=list(INDEX_FIELDS), help='valori presenti in più denunce')
+    args = parser.parse_args()
+
+    index = ClaimIndex(args.index)
+    if args.rebuild_from_jobs:
+        print('%d documenti indicizzati' % rebuild_from_jobs(args.rebuild_from_jobs, index))
+    if args.lookup:
+        for document in index.lookup(*args.lookup):
+            print(json.dumps(document, ensure_ascii=False))
+    if args.repeated:
+        for row in index.repeated(args.repeated):
+            print('%s\t%d' % (row['value'], row['count']))
+
+
+if __name__ == '__main__':
+    main()
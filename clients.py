@@ -0,0 +1,90 @@
+import time
+import threading
+from contextlib import contextmanager
+import config
+import metrics
+
+# Registro dei client Google condivisi da tutte le sessioni del processo: i client gRPC sono thread-safe,
+# così canali e connessioni TLS restano aperti tra una richiesta e l'altra
+_lock = threading.Lock()
+_credentials = None
+_clients = {}
+
+
+def credentials():
+    # Un solo oggetto credentials per processo: il token OAuth viene richiesto alla prima chiamata
+    # e rinnovato da google-auth solo quando scade
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            from google.oauth2 import service_account
+            _credentials = service_account.Credentials.from_service_account_info(config.credentials_info())
+        return _credentials
+
+
+def _create_documentai_client():
+    from google.cloud import documentai
+    endpoint = config.get_setting('documentai_endpoint')
+    if endpoint:
+        # Server locale (es. un fake per i test): canale gRPC non cifrato
+        import grpc
+        from google.cloud.documentai_v1.services.document_processor_service.transports import \
+            DocumentProcessorServiceGrpcTransport
+        transport = DocumentProcessorServiceGrpcTransport(channel=grpc.insecure_channel(endpoint))
+        return documentai.DocumentProcessorServiceClient(transport=transport)
+    opts = {}
+    if config.get_secrets()['location'] == "eu":
+        opts = {"api_endpoint": "eu-documentai.googleapis.com"}
+    return documentai.DocumentProcessorServiceClient(client_options=opts, credentials=credentials())
+
+
+def _create_vision_client():
+    from google.cloud import vision
+    endpoint = config.get_setting('vision_endpoint')
+    if endpoint:
+        # Server locale (es. un fake per i test): canale gRPC non cifrato
+        import grpc
+        from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
+        transport = ImageAnnotatorGrpcTransport(channel=grpc.insecure_channel(endpoint))
+        return vision.ImageAnnotatorClient(transport=transport)
+    return vision.ImageAnnotatorClient(credentials=credentials())
+
+
+_FACTORIES = {'documentai': _create_documentai_client,
+              'vision': _create_vision_client}
+
+
+def get_client(api):
+    # Il client viene creato una sola volta e poi riusato
+    with _lock:
+        client = _clients.get(api)
+    if client is not None:
+        return client
+    client = _FACTORIES[api]()
+    with _lock:
+        if api not in _clients:
+            _clients[api] = client
+            metrics.channel_opened(api)
+        return _clients[api]
+
+
+def documentai_client():
+    return get_client('documentai')
+
+
+def vision_client():
+    return get_client('vision')
+
+
+@contextmanager
+def track(api, nbytes=0):
+    # Misuro la latenza di ogni chiamata remota (nbytes: dimensione dei contenuti inviati)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.observe('api.' + api, time.perf_counter() - start, nbytes, error)
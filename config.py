@@ -0,0 +1,68 @@
+import os
+import json
+import threading
+
+# Percorso opzionale dei secrets (TOML o JSON) per l'esecuzione fuori da Streamlit
+SECRETS_ENV = 'RMA_SECRETS'
+
+CREDENTIALS_KEYS = ['type', 'project_id', 'private_key_id', 'private_key', 'client_email', 'client_id', 'auth_uri',
+                    'token_uri', 'auth_provider_x509_cert_url', 'client_x509_cert_url']
+
+_secrets = None
+# Secrets usati per le impostazioni: {} se non ci sono secrets (strumenti offline, benchmark) e valgono i default
+_settings = None
+_lock = threading.Lock()
+
+
+def _load_secrets():
+    path = os.environ.get(SECRETS_ENV)
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                return json.load(f)
+            import toml
+            return toml.load(f)
+    # Altrimenti uso i secrets di Streamlit (.streamlit/secrets.toml)
+    import streamlit as st
+    return {key: st.secrets[key] for key in st.secrets.keys()}
+
+
+def get_secrets():
+    # I secrets vengono letti una sola volta per processo
+    global _secrets
+    with _lock:
+        if _secrets is None:
+            _secrets = _load_secrets()
+        return _secrets
+
+
+def _get_settings():
+    global _settings
+    if _settings is None:
+        try:
+            settings = get_secrets()
+        except (FileNotFoundError, ImportError):
+            # Streamlit non installato, oppure senza .streamlit/secrets.toml (in streamlit 0.83 FileNotFoundError)
+            settings = {}
+        with _lock:
+            _settings = settings
+    return _settings
+
+
+def credentials_info():
+    secrets = get_secrets()
+    return {key: secrets[key] for key in CREDENTIALS_KEYS}
+
+
+def get_setting(name, default=None):
+    # Impostazioni opzionali: prima la variabile d'ambiente RMA_<NOME>, poi la chiave nei secrets, infine il default
+    value = os.environ.get('RMA_' + name.upper())
+    if value is None:
+        value = _get_settings().get(name)
+    if value is None:
+        return default
+    if isinstance(default, bool) and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    if isinstance(default, (int, float)) and not isinstance(default, bool):
+        return type(default)(value)
+    return value
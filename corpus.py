@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import extraction
+from extraction import POLIZZA_RE, POLIZZA_LOOSE_RE, DATE_RE, EMAIL_RE, EMAIL_EXCLUDE_RE, PRICE_RE, ParsedText
+from identifiers import CF_WINDOW_RE, PIVA_WINDOW_RE
+from keywords import get_matcher
+from cache import CACHE_PATH
+import claim_index
+import metrics
+
+# Modalità corpus per gli audit mensili: migliaia di testi già estratti vengono letti in un DataFrame a blocchi.
+# I testi sono quelli dei pdf già letti dall'app (namespace 'documents' della cache dei risultati), oppure una
+# cartella con un file .txt per documento. I campi che dipendono solo da una regex sono estratti con operazioni
+# Series.str sui pattern precompilati, la causale con una regex per categoria su tutto il blocco; quelli con score
+# di prossimità passano dagli estrattori del singolo documento, solo sulle righe con almeno un candidato.
+# Il risultato di ogni riga è identico a read_claim_data / read_invoice_data
+CORPUS_CHUNK_SIZE = 10000
+# Chiavi per query quando leggo i documenti dalla cache
+CACHE_QUERY_KEYS = 500
+
+# Le regex di extraction.py con un gruppo di cattura, come richiesto da Series.str.extract
+POLIZZA_GROUP_RE = '(%s)' % POLIZZA_RE.pattern
+EMAIL_GROUP_RE = '(%s)' % EMAIL_RE.pattern
+
+
+# Ogni sorgente ha due funzioni: l'elenco dei documenti (nel processo principale) e la lettura di un blocco (nei
+# processi del pool). La lettura restituisce la Series dei testi, le chiavi dei documenti per l'indice dei dati
+# estratti (claim_index.document_key del file, come per un upload con lo stesso contenuto) e le righe dei documenti
+# da elaborare singolarmente (posizione nel blocco -> righe)
+
+def corpus_paths(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths += [os.path.join(root, f) for f in files if f.endswith('.txt')]
+    return sorted(paths)
+
+
+def read_texts(paths, directory):
+    # Series dei testi, indicizzata con il percorso relativo del file
+    texts = []
+    keys = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+        # Come ingest per text/plain
+        texts.append(content.decode('utf-8'))
+        keys.append(claim_index.document_key(content))
+    return pd.Series(texts, index=[os.path.relpath(p, directory) for p in paths], dtype=object), keys, {}
+
+
+def cached_keys(cache_path=CACHE_PATH):
+    # Chiavi in cache dei documenti letti dall'app. Lo stesso file letto con versioni diverse (processore, livello
+    # di testo) compare una volta sola, con la lettura più recente; le voci salvate senza la chiave del file (da
+    # una versione precedente) sono escluse
+    conn = sqlite3.connect(cache_path)
+    try:
+        rows = conn.execute("SELECT key, MAX(accessed) FROM results WHERE namespace = 'documents' AND "
+                            "json_extract(value, '$.file') IS NOT NULL GROUP BY json_extract(value, '$.file') "
+                            "ORDER BY json_extract(value, '$.file')").fetchall()
+    finally:
+        conn.close()
+    return [key for key, _ in rows]
+
+
+def read_cached(keys, cache_path=CACHE_PATH):
+    # Testi dei documenti in cache, indicizzati con la chiave del file. Le righe di ingestion vengono da
+    # splitlines: se un documento ha righe terminate da separatori diversi da '\n' (ad es. '\r' o '\x0c') il testo
+    # unito non si divide nelle stesse righe, quindi lo elaboro con le sue righe
+    values = {}
+    conn = sqlite3.connect(cache_path)
+    try:
+        for i in range(0, len(keys), CACHE_QUERY_KEYS):
+            batch = keys[i:i + CACHE_QUERY_KEYS]
+            values.update(conn.execute("SELECT key, value FROM results WHERE namespace = 'documents' AND key IN "
+                                       "(%s)" % ','.join('?' * len(batch)), batch).fetchall())
+    finally:
+        conn.close()
+    texts = []
+    files = []
+    irregular = {}
+    for key in keys:
+        if key not in values:
+            # Voce rimossa dalla cache dopo l'elenco
+            continue
+        data = json.loads(values[key])
+        lines = data['lines']
+        if not all(line.endswith('\n') for line in lines[:-1]):
+            irregular[len(texts)] = lines
+        texts.append(''.join(lines))
+        files.append(data['file'])
+    return pd.Series(texts, index=files, dtype=object), files, irregular
+
+
+def normalize(texts):
+    # Gli stessi buffer di ParsedText, per tutto il blocco: le righe (divise su '\n' come StringIO.readlines)
+    # unite da uno spazio, lo stesso testo senza ritorni a capo e le versioni in minuscolo
+    joined = texts.str.replace(r'\n(?!\Z)', '\n ', regex=True)
+    text = joined.str.replace('\n', '', regex=False)
+    return pd.DataFrame({'joined': joined, 'joined_lower': joined.str.lower(), 'text': text, 'lower': text.str.lower()})
+
+
+def documents(buffers):
+    # Un ParsedText per riga sui buffer già normalizzati, per gli estrattori del singolo documento: le prossimità
+    # alle parole chiave sono cercate solo nelle finestre intorno ai candidati, senza scansionare tutto il testo
+    return [ParsedText.from_buffers(*row) for row in buffers[['joined', 'joined_lower', 'text',
+                                                              'lower']].itertuples(index=False)]
+
+
+def _contains(series, pattern):
+    # str.contains avvisa quando la regex ha gruppi di cattura: qui serve solo sapere se c'è un match
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        return series.str.contains(pattern).values
+
+
+def _scored(buffers, docs, candidates, extract, column='lower'):
+    # I campi con score di prossimità alle parole chiave (finestre con la semantica di \b) vengono valutati
+    # dall'estrattore del singolo documento, ma solo sulle righe in cui la regex trova almeno un candidato
+    out = [''] * len(buffers)
+    for i in _contains(buffers[column], candidates).nonzero()[0]:
+        out[i] = extract(docs[i])
+    return pd.Series(out, index=buffers.index, dtype=object)
+
+
+def extract_polizza(buffers, docs):
+    # Il pattern preciso su tutte le righe, poi la ricerca vicino alla parola polizza dove manca
+    found = buffers['joined_lower'].str.extract(POLIZZA_GROUP_RE, expand=False)
+    missing = found.isna().values
+    found[missing] = ''
+    missing = missing & buffers['lower'].str.contains('polizza', regex=False).values
+    missing = missing & _contains(buffers['lower'], POLIZZA_LOOSE_RE)
+    for i in missing.nonzero()[0]:
+        found.iat[i] = extraction.extract_polizza_loose(docs[i])
+    return found
+
+
+def extract_data_evento(buffers, docs, now=None):
+    # Due colonne come le due etichette di read_claim_data: 'Data evento' se la data è vicina a una parola chiave
+    # (o se non c'è nessuna data), altrimenti 'Data'
+    now = now or datetime.now()
+    found = _scored(buffers, docs, DATE_RE, lambda doc: extraction.extract_data_evento(doc, now))
+    near = found.map(lambda d: d == '' or d[1] == 1)
+    value = found.map(lambda d: d[0].strftime('%d-%m-%Y') if d != '' else '')
+    return value.where(near), value.where(~near)
+
+
+def extract_cf(buffers, docs):
+    return _scored(buffers, docs, CF_WINDOW_RE, extraction.extract_cf, 'text')
+
+
+def extract_iva(buffers, docs):
+    return _scored(buffers, docs, PIVA_WINDOW_RE, extraction.extract_iva)
+
+
+def extract_email(texts):
+    # Primo indirizzo di ogni riga, poi il primo non escluso: come first_per_line + EMAIL_EXCLUDE_RE
+    lines = texts.reset_index(drop=True).str.split('\n').explode()
+    found = lines.str.extract(EMAIL_GROUP_RE, expand=False).dropna()
+    found = found[~found.str.lower().str.contains(EMAIL_EXCLUDE_RE)]
+    first = found.groupby(level=0).first().reindex(range(len(texts))).fillna('')
+    return pd.Series(first.values, index=texts.index)
+
+
+def extract_category(buffers):
+    # Come extraction.extract_category senza la scansione dell'automa documento per documento: unisco i testi del
+    # blocco con '\n' (assente dai testi minuscoli, non è un carattere di parola e nessun termine lo attraversa,
+    # quindi i match sono gli stessi dei singoli documenti), conto i match della regex di ogni causale e li
+    # attribuisco ai documenti in base alla posizione. La causale è la prima con il conteggio massimo
+    matcher = get_matcher()
+    lower = buffers['lower']
+    ends = np.cumsum(lower.str.len().values.astype(np.int64) + 1)
+    blob = '\n'.join(lower.values)
+    counts = np.zeros((len(lower), len(matcher.categories)), dtype=np.int64)
+    for j, pattern in enumerate(matcher.category_res):
+        starts = np.fromiter((match.start() for match in pattern.finditer(blob)), dtype=np.int64)
+        counts[:, j] = np.bincount(np.searchsorted(ends, starts, side='right'), minlength=len(lower))
+    names = np.array([category for category, _ in matcher.categories], dtype=object)
+    return pd.Series(names[counts.argmax(axis=1)], index=buffers.index, dtype=object)
+
+
+def extract_price(buffers, docs):
+    return _scored(buffers, docs, PRICE_RE, extraction.extract_price)
+
+
+def read_claims(texts, now=None):
+    # texts: Series di testi (uno per documento); una riga di risultati per documento
+    nbytes = int(texts.str.len().sum())
+    with metrics.span('corpus.normalize', nbytes):
+        buffers = normalize(texts)
+        docs = documents(buffers)
+    out = pd.DataFrame(index=texts.index)
+    with metrics.span('corpus.polizza', nbytes):
+        out['Numero polizza'] = extract_polizza(buffers, docs)
+    with metrics.span('corpus.data_evento', nbytes):
+        out['Data evento'], out['Data'] = extract_data_evento(buffers, docs, now)
+    with metrics.span('corpus.cf', nbytes):
+        out['Codice Fiscale'] = extract_cf(buffers, docs)
+    with metrics.span('corpus.iva', nbytes):
+        out['Partita IVA'] = extract_iva(buffers, docs)
+    with metrics.span('corpus.email', nbytes):
+        out['Email'] = extract_email(texts)
+    with metrics.span('corpus.category', nbytes):
+        out['Causale'] = extract_category(buffers)
+    return out
+
+
+def read_invoices(texts):
+    nbytes = int(texts.str.len().sum())
+    with metrics.span('corpus.normalize', nbytes):
+        buffers = normalize(texts)
+        docs = documents(buffers)
+    out = pd.DataFrame(index=texts.index)
+    with metrics.span('corpus.cf', nbytes):
+        out['Codice Fiscale'] = extract_cf(buffers, docs)
+    with metrics.span('corpus.iva', nbytes):
+        out['Partita IVA'] = extract_iva(buffers, docs)
+    with metrics.span('corpus.price', nbytes):
+        out['Importo'] = extract_price(buffers, docs)
+    return out
+
+
+def records(results):
+    # Le righe come dizionari, nello stesso formato di read_claim_data / read_invoice_data
+    return [{k: v for k, v in row.items() if not (k in ('Data evento', 'Data') and pd.isna(v))}
+            for row in results.to_dict('records')]
+
+
+def process_chunk(read, items, source, kind, now):
+    # Gira nei processi del pool: legge i documenti del blocco ed estrae i campi. Restituisce anche le misure per
+    # fase e le chiavi dei documenti per l'indice dei dati estratti
+    registry = metrics.Registry()
+    with metrics.scope(registry):
+        texts, keys, irregular = read(items, source)
+        if kind == 'denuncia':
+            results = read_claims(texts, now)
+        else:
+            results = read_invoices(texts)
+        for i, lines in irregular.items():
+            if kind == 'denuncia':
+                single = extraction.read_claim_data(lines)
+            else:
+                single = extraction.read_invoice_data(lines)
+            results.iloc[i] = [single.get(column) for column in results.columns]
+    return results, registry.snapshot(), keys
+
+
+def run(source, output, kind='denuncia', chunksize=CORPUS_CHUNK_SIZE, workers=None, index=None):
+    # Elabora il corpus a blocchi in un pool di processi e accoda i risultati al csv nell'ordine dei documenti:
+    # in memoria restano solo i blocchi in corso, quindi la memoria non dipende dalla dimensione del corpus.
+    # source: cartella di file .txt oppure database della cache dei risultati. Con index (percorso dell'indice)
+    # i campi estratti vengono aggiunti all'indice, un blocco alla volta
+    now = datetime.now()
+    if os.path.isdir(source):
+        read, items = read_texts, corpus_paths(source)
+    else:
+        read, items = read_cached, cached_keys(source)
+    chunks = iter([items[i:i + chunksize] for i in range(0, len(items), chunksize)])
+    if os.path.exists(output):
+        os.remove(output)
+    total = 0
+    workers = workers or os.cpu_count() or 1
+    claims = claim_index.ClaimIndex(index) if index else None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        while True:
+            while len(in_flight) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.append(pool.submit(process_chunk, read, chunk, source, kind, now))
+            if not in_flight:
+                break
+            results, snapshot, keys = in_flight.popleft().result()
+            metrics.REGISTRY.merge(snapshot)
+            results.to_csv(output, mode='a', header=total == 0, index_label='documento')
+            if claims is not None:
+                claims.add_many(zip(keys, [kind] * len(keys), records(results)))
+            total += len(results)
+            print('%d/%d documenti elaborati' % (total, len(items)))
+            sys.stdout.flush()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Estrazione dei dati chiave da un corpus di testi già estratti')
+    parser.add_argument('source', nargs='?', default=CACHE_PATH,
+                        help='cartella con un file .txt per documento, oppure il database della cache dei risultati '
+                             '(default: %s, i pdf già letti dall\'app)' % CACHE_PATH)
+    parser.add_argument('--output', required=True, help='file csv dei risultati (una riga per documento)')
+    parser.add_argument('--kind', choices=['denuncia', 'fattura'], default='denuncia')
+    parser.add_argument('--chunksize', type=int, default=CORPUS_CHUNK_SIZE, help='documenti per blocco')
+    parser.add_argument('--workers', type=int, default=None, help='numero di processi (default: numero di CPU)')
+    parser.add_argument('--metrics', help='file delle metriche per fase (.prom in formato Prometheus, oppure .json)')
+    parser.add_argument('--index', nargs='?', const=claim_index.INDEX_PATH,
+                        help='aggiunge i campi estratti all\'indice (default: %s)' % claim_index.INDEX_PATH)
+    args = parser.parse_args()
+    run(args.source, args.output, args.kind, args.chunksize, args.workers, args.index)
+    if args.metrics:
+        metrics.export(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
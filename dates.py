@@ -0,0 +1,106 @@
+import re
+from datetime import datetime
+
+# Mesi italiani (nomi completi e abbreviazioni) risolti direttamente dal gruppo catturato dalla regex delle date
+MONTHS = {'gennaio': 1, 'febbraio': 2, 'marzo': 3, 'aprile': 4, 'maggio': 5, 'giugno': 6, 'luglio': 7,
+          'agosto': 8, 'settembre': 9, 'ottobre': 10, 'novembre': 11, 'dicembre': 12,
+          'gen': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'mag': 5, 'giu': 6, 'lug': 7, 'ago': 8, 'set': 9, 'ott': 10,
+          'nov': 11, 'dic': 12}
+
+# Separatori per cui la lettura veloce coincide con quella di dateutil; per gli altri (rari) uso dateutil
+NUMERIC_SEPARATORS = {'/', '-', '.', ' '}
+NAME_SEPARATORS = {' ', '-', '/'}
+
+# Traduzione dei mesi in inglese per dateutil, nello stesso ordine usato in origine
+_ENGLISH = [(re.compile(r'gennaio|gen'), 'jan'),
+            (re.compile(r'febbraio|feb'), 'feb'),
+            (re.compile(r'marzo|mar'), 'mar'),
+            (re.compile(r'aprile|apr'), 'apr'),
+            (re.compile(r'maggio|mag'), 'may'),
+            (re.compile(r'giugno|giu'), 'jun'),
+            (re.compile(r'luglio|lug'), 'jul'),
+            (re.compile(r'agosto|ago'), 'aug'),
+            (re.compile(r'settembre|set'), 'sep'),
+            (re.compile(r'ottobre|ott'), 'oct'),
+            (re.compile(r'novembre|nov'), 'nov'),
+            (re.compile(r'dicembre|dic'), 'dec')]
+
+_FALLBACK = object()
+
+
+def _year(value, now):
+    # Anni a due cifre: stesso secolo dell'anno corrente, entro 50 anni (come dateutil)
+    year = int(value)
+    if len(value) == 2:
+        year += now.year // 100 * 100
+        if year >= now.year + 50:
+            year -= 100
+        elif year < now.year - 50:
+            year += 100
+    return year
+
+
+def _fast_parse(match, now):
+    first, month, last = match.group(1), match.group(2), match.group(3)
+    sep1 = match.string[match.end(1):match.start(2)]
+    sep2 = match.string[match.end(2):match.start(3) if last is not None else match.end()]
+
+    name = month.rstrip('.')
+    if name.isdigit():
+        # Stesso separatore tra giorno, mese e anno (12/03/2019, 12.03.2019); senza anno niente punto (12.03)
+        if sep1 not in NUMERIC_SEPARATORS or (sep2 != sep1 if last is not None else sep2 != '' or sep1 == '.'):
+            return _FALLBACK
+        month_n = None
+    else:
+        # Un solo carattere di separazione (12 marzo 2019, 12-mar-19, 12/mar.)
+        if sep1 not in NAME_SEPARATORS or (sep2 not in NAME_SEPARATORS if last is not None else sep2 != ''):
+            return _FALLBACK
+        month_n = MONTHS[name]
+
+    if len(first) == 4:
+        # Anno per primo: anno, mese, giorno (senza giorno dateutil userebbe il giorno corrente)
+        if last is None or len(last) == 4:
+            return _FALLBACK
+        year, day = int(first), int(last)
+        month_n = month_n if month_n is not None else int(month)
+    elif month_n is not None:
+        # Giorno e mese per nome
+        if last is not None and len(last) == 2 and int(first) <= 31 and int(last) <= 31:
+            return _FALLBACK
+        day = int(first)
+        year = _year(last, now) if last is not None else now.year
+    else:
+        # Date numeriche: come dateutil (dayfirst=False) il primo numero è il mese, se può esserlo
+        a, b = int(first), int(month)
+        if last is None:
+            if a > 12:
+                return None
+            month_n, day, year = a, b, now.year
+        else:
+            year = _year(last, now)
+            month_n, day = (a, b) if a <= 12 else (b, a)
+
+    try:
+        return datetime(year, month_n, day)
+    except ValueError:
+        return None
+
+
+def _dateutil_parse(matched_date):
+    import dateutil.parser as dparser
+    # Traduco i mesi in inglese per un corretto parsing
+    for month, english in _ENGLISH:
+        matched_date = month.sub(english, matched_date)
+    try:
+        return dparser.parse(matched_date)
+    except:
+        return None
+
+
+def parse_date(match, now=None):
+    # Restituisce la data letta dal match della regex delle date, oppure None se non è una data valida
+    now = now if now is not None else datetime.now()
+    parsed = _fast_parse(match, now)
+    if parsed is _FALLBACK:
+        parsed = _dateutil_parse(match.group())
+    return parsed
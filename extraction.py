@@ -0,0 +1,267 @@
+import re
+import bisect
+from datetime import datetime
+from dates import parse_date
+from keywords import get_matcher
+from identifiers import best_cf, best_piva
+import metrics
+
+# Pattern compilati una sola volta all'import del modulo
+POLIZZA_RE = re.compile(r"(?:\b|n|n\.|n°|#)\d{4}(?:\\|/|-)\d{2}(?:\\|/|-)\d{7}\b")
+POLIZZA_LOOSE_RE = re.compile(r'(?:\b|n|n\.|n°|#)(\d{7,}|\d{2}(?:\\|/|-)\d{5,})\b')
+
+DATE_RE = re.compile(r'\b(0[1-9]|1[0-9]|2[0-9]|3[01]|(?:19|20)\d{2})[\s\-\\\/\.]{1,3}(0[1-9]|1['
+                     r'012]|gennaio|febbraio|marzo|aprile|maggio|giugno|luglio|agosto|settembre|ottobre|novembre'
+                     r'|dicembre|gen\.*|feb\.*|mar\.*|apr\.*|mag\.*|giu\.*|lug\.*|ago\.*|set\.*|ott\.*|nov\.*|dic'
+                     r'\.*)[\s\-\\\/\.]{0,3}((?:19|20)?\d{2})?\b')
+
+# Codici fiscali e partite IVA sono riconosciuti e validati in identifiers.py
+
+EMAIL_RE = re.compile(r'\b[\w.-]+?@\w+?\.\w+?\b')
+# Escludo l'email del gruppo RealeMutua
+EMAIL_EXCLUDE_RE = re.compile(r'realemutua|reale|sinistr|assicurazion|polizz|insurance')
+
+# Il vocabolario delle causali e le parole chiave di prossimità sono in vocabulary.json (vedi keywords.py)
+
+PRICE_RE = re.compile(
+    r'(?:^|\s)((?:€|euro)\s?\d+(?:,\d+|\.\d+)*[.,]?\d*|\d+(?:,\d+|\.\d+)*[.,]?\d*\s?(?:€|euro))(?:$|\s)')
+PRICE_CURRENCY_RE = re.compile(r'€|euro')
+
+
+class ParsedText(object):
+    # Normalizzo il documento una sola volta: tutti gli estrattori lavorano sugli stessi buffer
+    def __init__(self, lines):
+        self.lines = lines
+        # Testo con i ritorni a capo, per le ricerche riga per riga
+        self.joined = ' '.join(lines)
+        self.joined_lower = self.joined.lower()
+        # Testo su una sola riga, per le ricerche di prossimità
+        self.text = self.joined.replace('\n', '')
+        self.lower = self.text.lower()
+        self._hits = None
+        self._line_starts = None
+
+    @classmethod
+    def from_buffers(cls, joined, joined_lower, text, lower):
+        # Per l'elaborazione vettoriale (corpus.py): i buffer sono già stati normalizzati per tutto il blocco
+        doc = cls.__new__(cls)
+        doc.lines = None
+        doc.joined, doc.joined_lower, doc.text, doc.lower = joined, joined_lower, text, lower
+        doc._hits = None
+        doc._line_starts = None
+        return doc
+
+    @property
+    def line_starts(self):
+        # Posizione di inizio di ogni riga in self.joined
+        if self._line_starts is None:
+            starts = []
+            pos = 0
+            if self.lines is not None:
+                for l in self.lines:
+                    starts.append(pos)
+                    pos += len(l) + 1
+            else:
+                # Testo del corpus: le righe terminano con '\n', seguito dallo spazio del join
+                while pos != -1:
+                    starts.append(pos)
+                    pos = self.joined.find('\n', pos)
+                    pos = pos + 2 if pos != -1 and pos + 1 < len(self.joined) else -1
+            self._line_starts = starts
+        return self._line_starts
+
+    @property
+    def hits(self):
+        # Posizioni di tutti i termini del vocabolario nel testo minuscolo, trovate con una sola scansione
+        if self._hits is None:
+            self._hits = get_matcher().scan(self.lower)
+        return self._hits
+
+    def keyword_near(self, group, lo, hi):
+        # Equivale a cercare le parole chiave del gruppo in self.text[lo:hi].lower(). Se il testo è già stato
+        # scansionato (causale della denuncia) uso le posizioni trovate; altrimenti (fatture, codici) la scansione
+        # completa costerebbe più delle poche finestre da controllare, quindi cerco nella finestra con la regex del
+        # gruppo. Lo stesso se la conversione in minuscolo ha cambiato la lunghezza del testo
+        lo = max(lo, 0)
+        if self._hits is None or len(self.lower) != len(self.text):
+            return get_matcher().near(group, self.text[lo:hi].lower())
+        return self.hits.within(group, lo, hi)
+
+    def first_per_line(self, pattern, lower=False):
+        # Equivale a re.search su ogni riga: nessun pattern attraversa il separatore tra le righe,
+        # quindi basta una sola scansione tenendo il primo match di ogni riga
+        buffer = self.joined_lower if lower else self.joined
+        found = []
+        last_line = -1
+        for match in pattern.finditer(buffer):
+            line = bisect.bisect_right(self.line_starts, match.start()) - 1
+            if line != last_line:
+                found.append(match.group())
+                last_line = line
+        return found
+
+
+def extract_polizza(doc):
+    # Cerco prima i casi che rispettano il pattern preciso
+    match = POLIZZA_RE.search(doc.joined_lower)
+    if match is not None:
+        return match.group()
+    # Se non trovo niente, provo a cercare le stringhe numeriche in prossimità della parola polizza
+    return extract_polizza_loose(doc)
+
+
+def extract_polizza_loose(doc):
+    text = doc.text
+    for match in POLIZZA_LOOSE_RE.finditer(doc.lower):
+        prev = (match.start() - 15 if (match.start() - 15) > 0 else 0)
+        if 'polizza' in text[prev:match.start()].lower():
+            return match.group()
+
+    return ''
+
+
+def extract_data_evento(doc, now=None):
+    now = now or datetime.now()
+    date_l = []
+    # Trovo le date che rispettano un certo formato
+    for match in DATE_RE.finditer(doc.lower):
+        # Scarto le date che non riesco a parsare o che non hanno un anno valido
+        parsed_date = parse_date(match, now)
+        if parsed_date is None or not (now.year - 20 <= parsed_date.year <= now.year):
+            continue
+
+        # Se la data è vicino ad una parola chiave, la considero con priorità maggiore
+        if doc.keyword_near('data_evento', match.start() - 20, match.start()) or \
+                doc.keyword_near('data_evento', match.end(), match.end() + 20):
+            score = 1
+        else:
+            score = 0
+
+        date_l.append((parsed_date, score))
+
+    # Ordino per score
+    date_l.sort(key=lambda tup: tup[1], reverse=True)
+
+    if len(date_l) > 0:
+        return date_l[0]
+    else:
+        return ''
+
+
+def extract_cf(doc):
+    # Il codice fiscale valido più vicino alle parole chiave (cf), altrimenti il primo
+    candidate = best_cf(doc)
+    if candidate is not None:
+        return candidate.value
+    else:
+        return ''
+
+
+def extract_iva(doc):
+    # Do maggiore priorità a quei codici vicini a parole chiave (iva); le partite IVA non valide sono scartate
+    candidate = best_piva(doc)
+    if candidate is not None:
+        return candidate.value
+    else:
+        return ''
+
+
+def extract_email(doc):
+    email_l = [e for e in doc.first_per_line(EMAIL_RE) if EMAIL_EXCLUDE_RE.search(e.lower()) is None]
+
+    if len(email_l) > 0:
+        return email_l[0]
+    else:
+        return ''
+
+
+def extract_category(doc):
+    # Assegno uno score ad ogni categoria di evento in base ad un vocabolario predefinito
+    classes = list(doc.hits.counts())
+    classes.sort(key=lambda tup: tup[1], reverse=True)
+
+    return classes[0][0]
+
+
+def extract_price(doc):
+    # Estraggo gli importi in € dal testo (price_parser viene importato al primo uso)
+    from price_parser import Price
+    text = doc.lower
+    matcher = get_matcher()
+    # Do uno score maggiore agli importi vicino a determinate keyword (finestre nel testo minuscolo)
+    scored = ([], [])
+    for match in PRICE_RE.finditer(text):
+        near = matcher.near('importo', text[max(match.start() - 30, 0):match.start()]) or \
+            matcher.near('importo', text[match.end():match.end() + 30])
+        scored[int(near)].append(match.group())
+
+    # Prendo il valore massimo di quelli con score 1 (se non ci sono con score 1 prendo il massimo con score 0):
+    # il parsing, la parte costosa, serve solo per gli importi con score 0 se nessuno con score 1 è valido.
+    # Elimino i prezzi al di sopra di 10K
+    for group in (scored[1], scored[0]):
+        prices = [p for p in (Price.fromstring(PRICE_CURRENCY_RE.sub('', s).strip()).amount_float for s in group)
+                  if p is not None and p <= 10000]
+        if len(prices) > 0:
+            return max(prices)
+    return ''
+
+
+def _parsed(lines):
+    # Accetto sia le righe del documento sia un testo già normalizzato
+    if isinstance(lines, ParsedText):
+        return lines
+    with metrics.span('extract.parse'):
+        return ParsedText(lines)
+
+
+def read_claim_data(lines):
+    doc = _parsed(lines)
+
+    with metrics.span('extract.keywords', len(doc.text)):
+        doc.hits
+    with metrics.span('extract.polizza'):
+        polizza = extract_polizza(doc)
+    with metrics.span('extract.data_evento'):
+        data_evento = extract_data_evento(doc)
+    with metrics.span('extract.cf'):
+        cf = extract_cf(doc)
+    with metrics.span('extract.iva'):
+        iva = extract_iva(doc)
+    with metrics.span('extract.email'):
+        email = extract_email(doc)
+    with metrics.span('extract.category'):
+        cat = extract_category(doc)
+
+    # Preparo l'output
+    if isinstance(data_evento, tuple):
+        if data_evento[1] == 1:
+            data_evento_label = 'Data evento'
+        else:
+            data_evento_label = 'Data'
+        data_evento_value = data_evento[0].strftime('%d-%m-%Y')
+    else:
+        data_evento_label = 'Data evento'
+        data_evento_value = ''
+
+    return {'Numero polizza': polizza,
+            data_evento_label: data_evento_value,
+            'Codice Fiscale': cf,
+            'Partita IVA': iva,
+            'Email': email,
+            'Causale': cat}
+
+
+def read_invoice_data(lines):
+    doc = _parsed(lines)
+
+    # Nessuna scansione completa delle parole chiave: servono solo nelle finestre vicino a codici e importi
+    with metrics.span('extract.cf'):
+        cf = extract_cf(doc)
+    with metrics.span('extract.iva'):
+        iva = extract_iva(doc)
+    with metrics.span('extract.price'):
+        price = extract_price(doc)
+
+    return {'Codice Fiscale': cf,
+            'Partita IVA': iva,
+            'Importo': price}
@@ -0,0 +1,121 @@
+import re
+from collections import namedtuple
+
+# Riconoscimento di codici fiscali e partite IVA: un filtro economico sulle classi di caratteri trova le parole di
+# 16 caratteri alfanumerici maiuscoli e le sequenze di 11 cifre, poi il carattere di controllo (CF) e la cifra di
+# controllo (P.IVA) scartano i candidati non validi prima della regex completa del codice fiscale e dello score
+
+# Le finestre equivalgono a \b[A-Z\d]{16}\b e \b\d{11}\b, ma iniziano con la classe di caratteri:
+# così il motore delle regex salta subito alle posizioni possibili
+CF_WINDOW_RE = re.compile(r'[A-Z\d](?<!\w[A-Z\d])[A-Z\d]{15}(?!\w)')
+CF_RE = re.compile(
+    r"(?:[A-Z][AEIOU][AEIOUX]|[B-DF-HJ-NP-TV-Z]{2}[A-Z]){2}(?:[\dLMNP-V]{2}(?:[A-EHLMPR-T](?:[04LQ][1-9MNP-V]|["
+    r"15MR][\dLMNP-V]|[26NS][0-8LMNP-U])|[DHPS][37PT][0L]|[ACELMRT][37PT][01LM]|[AC-EHLMPR-T][26NS][9V])|(?:["
+    r"02468LNQSU][048LQU]|[13579MPRTV][26NS])B[26NS][9V])(?:[A-MZ][1-9MNP-V][\dLMNP-V]{2}|[A-M][0L](?:[1-9MNP-V]["
+    r"\dLMNP-V]|[0L][1-9MNP-V]))[A-Z]")
+PIVA_WINDOW_RE = re.compile(r'\d(?<!\w\d)\d{10}(?!\w)')
+
+# Finestre (caratteri prima del codice) in cui cercare le parole chiave per lo score
+CF_KEYWORD_WINDOW = 30
+PIVA_KEYWORD_WINDOW = 10
+
+# Codici dell'ufficio provinciale (8a-10a cifra della partita IVA): 001-100, più 120, 121, 888 e 999
+PIVA_OFFICES = frozenset(['%03d' % i for i in range(1, 101)] + ['120', '121', '888', '999'])
+
+# Valori dei caratteri in posizione dispari (1a, 3a, ...) per il carattere di controllo del codice fiscale
+_CF_ODD = dict(zip('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+                   [1, 0, 5, 7, 9, 13, 15, 17, 19, 21] +
+                   [1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25, 24, 23]))
+_CF_EVEN = dict(zip('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ', list(range(10)) + list(range(26))))
+
+# Posizione nel testo: start/end sugli indici del buffer in cui il codice è stato trovato
+Candidate = namedtuple('Candidate', ['value', 'start', 'end', 'score'])
+
+
+def cf_check_char(code):
+    # Carattere di controllo dei primi 15 caratteri del codice fiscale (anche con omocodia); None se non calcolabile
+    try:
+        total = sum(_CF_ODD[c] if i % 2 == 0 else _CF_EVEN[c] for i, c in enumerate(code[:15]))
+    except KeyError:
+        return None
+    return chr(ord('A') + total % 26)
+
+
+def valid_cf(code):
+    return len(code) == 16 and cf_check_char(code) == code[15] and CF_RE.fullmatch(code) is not None
+
+
+def piva_check_digit(code):
+    # Cifra di controllo delle prime 10 cifre della partita IVA (algoritmo di Luhn)
+    total = 0
+    for i, c in enumerate(code[:10]):
+        d = int(c)
+        if i % 2 == 1:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return (10 - total % 10) % 10
+
+
+def valid_piva(code):
+    # Matricola (prime 7 cifre) non tutta a zero, codice dell'ufficio esistente e cifra di controllo corretta
+    return len(code) == 11 and code.isdecimal() and code[:7] != '0000000' and code[7:10] in PIVA_OFFICES and \
+        piva_check_digit(code) == int(code[10])
+
+
+def _ranked(candidates):
+    # Prima quelli vicini a una parola chiave, poi nell'ordine del testo
+    return sorted(candidates, key=lambda c: (-c.score, c.start))
+
+
+def _best(candidates):
+    # Il primo di _ranked(candidates) leggendo i candidati nell'ordine del testo: mi fermo al primo vicino a una
+    # parola chiave, senza validare né valutare i successivi
+    first = None
+    for candidate in candidates:
+        if candidate.score:
+            return candidate
+        if first is None:
+            first = candidate
+    return first
+
+
+def iter_cf(doc):
+    # I codici fiscali validi del documento nell'ordine del testo; posizioni in doc.text
+    for match in CF_WINDOW_RE.finditer(doc.text):
+        code = match.group()
+        # Il carattere di controllo costa poco e scarta quasi tutti i falsi positivi prima della regex completa
+        if cf_check_char(code) != code[15] or CF_RE.fullmatch(code) is None:
+            continue
+        score = int(doc.keyword_near('cf', match.start() - CF_KEYWORD_WINDOW, match.start()))
+        yield Candidate(code, match.start(), match.end(), score)
+
+
+def iter_piva(doc):
+    # Le partite IVA valide del documento nell'ordine del testo; posizioni in doc.lower
+    for match in PIVA_WINDOW_RE.finditer(doc.lower):
+        code = match.group()
+        if not valid_piva(code):
+            continue
+        score = int(doc.keyword_near('iva', match.start() - PIVA_KEYWORD_WINDOW, match.start()))
+        yield Candidate(code, match.start(), match.end(), score)
+
+
+def find_cf(doc):
+    # Tutti i codici fiscali validi del documento, ordinati per score
+    return _ranked(iter_cf(doc))
+
+
+def find_piva(doc):
+    # Tutte le partite IVA valide del documento, ordinate per score
+    return _ranked(iter_piva(doc))
+
+
+def best_cf(doc):
+    # Il codice fiscale valido più vicino alle parole chiave, altrimenti il primo; None se non ce ne sono
+    return _best(iter_cf(doc))
+
+
+def best_piva(doc):
+    return _best(iter_piva(doc))
@@ -1,72 +1,195 @@
-import streamlit as st
-import fitz
-import os
 import sys
-import pandas as pd
-from google.cloud import vision
-from google.oauth2 import service_account
-import SessionState
-
-# Secrets
-credentials_info = {'type': st.secrets['type'],
-                    'project_id': st.secrets['project_id'],
-                    'private_key_id': st.secrets['private_key_id'],
-                    'private_key': st.secrets['private_key'],
-                    'client_email': st.secrets['client_email'],
-                    'client_id': st.secrets['client_id'],
-                    'auth_uri': st.secrets['auth_uri'],
-                    'token_uri': st.secrets['token_uri'],
-                    'auth_provider_x509_cert_url': st.secrets['auth_provider_x509_cert_url'],
-                    'client_x509_cert_url': st.secrets['client_x509_cert_url']}
-
-
-@st.cache(hash_funcs={"builtins.SwigPyObject": lambda _: None}, show_spinner=False)
-def _extract_images_from_pdf(pdf_file):
-    # opening the file
-    pdf_file = fitz.open(pdf_file.name, stream=pdf_file.getvalue())
-
-    # finding number of pages in the pdf
-    number_of_pages = len(pdf_file)
-
-    images = []
-    # iterating through each page in the pdf
-    for current_page_index in range(number_of_pages):
-        # iterating through each image in every page of PDF
-        for img_index, img in enumerate(pdf_file.getPageImageList(current_page_index)):
-            xref = img[0]
-            image = fitz.Pixmap(pdf_file, xref)
-            #  if it is CMYK: convert to RGB first
-            if image.n >= 5:
-                image = fitz.Pixmap(fitz.csRGB, image)
-            images.append(image.tobytes())
-
-    return images
-
-
-@st.cache(show_spinner=False)
-def _classify_image(image_bytes):
-    # Convert the image
-    image = vision.Image(content=image_bytes)
-
-    # Instantiates a client
-    credentials = service_account.Credentials.from_service_account_info(credentials_info)
-    client = vision.ImageAnnotatorClient(credentials=credentials)
-
-    # Call the API
-    response = client.label_detection(image=image)
-    print('Warning: Vision API call')
-    sys.stdout.flush()
-    sess = SessionState.get(api_calls=0)
-    sess.api_calls = sess.api_calls + 1
-    labels = response.label_annotations
-
-    descriptions = [l.description for l in labels]
-    scores = [l.score for l in labels]
-
-    return dict(zip(descriptions, scores))
-
-
-@st.cache(show_spinner=False)
+import base64
+import itertools
+import fitz
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from cache import get_cache, content_key
+from image_hash import HASH_THRESHOLD, dhash, hamming, get_index, record_duplicate
+from clients import vision_client, track
+import quota
+import image_filter
+from singleflight import SingleFlight
+import config
+import metrics
+import memo
+
+# Le label restituite dipendono dal modello Vision: se cambia, le label in cache non sono più valide
+VISION_MODEL = 'vision/label_detection/builtin-stable'
+
+# Risoluzione massima delle immagini inviate a Vision e memoria massima per le immagini mostrate in una sessione
+IMAGE_MAX_SIDE = 1024
+IMAGE_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Miniature per la pagina dei risultati, larghe quanto le immagini mostrate: la piena risoluzione solo a richiesta.
+# PyMuPDF 1.18 non scrive jpeg, quindi le miniature sono png
+THUMBNAIL_WIDTH = 255
+THUMBNAIL_VERSION = 'thumbnail/%d' % THUMBNAIL_WIDTH
+
+# batch_annotate_images accetta al massimo 16 immagini per richiesta
+VISION_BATCH_SIZE = 16
+VISION_BATCH_MAX_BYTES = 8 * 1024 * 1024
+VISION_MAX_WORKERS = 4
+VISION_TIMEOUT = 60.0
+# Retry con backoff esponenziale; ResourceExhausted è gestito dal rate limiter (quota.call), che rimette
+# la richiesta in coda
+VISION_RETRY_ERRORS = ('ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError')
+_vision_retry = None
+
+
+# Classificazioni in corso: la stessa immagine caricata da più sessioni viene inviata a Vision una sola volta
+_flights = SingleFlight('image_labels')
+
+
+def vision_retry():
+    # L'SDK di Google viene importato al primo uso, non all'avvio della pagina
+    global _vision_retry
+    if _vision_retry is None:
+        from google.api_core import exceptions, retry
+        errors = tuple(getattr(exceptions, name) for name in VISION_RETRY_ERRORS)
+        _vision_retry = retry.Retry(predicate=retry.if_exception_type(*errors),
+                                    initial=0.5, maximum=16.0, multiplier=2.0, deadline=120.0)
+    return _vision_retry
+
+
+def _downscale(image, max_side):
+    # Riduco la risoluzione mantenendo le proporzioni
+    if max(image.width, image.height) <= max_side:
+        return image
+    scale = max_side / max(image.width, image.height)
+    return fitz.Pixmap(image, max(1, int(image.width * scale)), max(1, int(image.height * scale)), None)
+
+
+def _encode_image(pdf_file, xref, max_side):
+    # Se l'immagine è già un jpeg/png RGB o in scala di grigi abbastanza piccolo uso i byte originali,
+    # senza decodificarla
+    info = pdf_file.extractImage(xref)
+    if info and info['ext'] in ('jpeg', 'png') and info['colorspace'] in (1, 3) and not info['smask'] and \
+            max(info['width'], info['height']) <= max_side:
+        return info['image']
+
+    image = fitz.Pixmap(pdf_file, xref)
+    #  if it is CMYK: convert to RGB first
+    if image.n - image.alpha > 3:
+        image = fitz.Pixmap(fitz.csRGB, image)
+    return _downscale(image, max_side).tobytes()
+
+
+def _iter_images(content, mime_type, max_side=None):
+    for im, _ in _iter_images_pages(content, mime_type, max_side):
+        yield im
+
+
+def _iter_images_pages(content, mime_type, max_side=None):
+    # Le immagini vengono prodotte una alla volta, già compresse e ridimensionate per Vision:
+    # in memoria resta al massimo una pixmap decodificata. Per ogni immagine restituisco anche
+    # il numero di pagine del PDF in cui compare (carta intestata, timbri)
+    if max_side is None:
+        max_side = config.get_setting('image_max_side', IMAGE_MAX_SIDE)
+    if mime_type == 'application/pdf':
+        pdf_file = fitz.open(stream=content, filetype='pdf')
+        pages = {}
+        for current_page_index in range(len(pdf_file)):
+            for xref in {img[0] for img in pdf_file.getPageImageList(current_page_index)}:
+                pages[xref] = pages.get(xref, 0) + 1
+        # iterating through each page in the pdf
+        for current_page_index in range(len(pdf_file)):
+            # iterating through each image in every page of PDF
+            for img in pdf_file.getPageImageList(current_page_index):
+                with metrics.span('images.extract_pdf'):
+                    im = _encode_image(pdf_file, img[0], max_side)
+                yield im, pages[img[0]]
+    elif mime_type == 'image/png' or mime_type == 'image/jpeg':
+        with metrics.span('images.decode', len(content)):
+            image = fitz.Pixmap(content)
+            im = content if max(image.width, image.height) <= max_side else _downscale(image, max_side).tobytes()
+        yield im, 1
+
+
+def _thumbnail(im):
+    image = fitz.Pixmap(im)
+    if image.n - image.alpha > 3:
+        image = fitz.Pixmap(fitz.csRGB, image)
+    if image.width > THUMBNAIL_WIDTH:
+        image = fitz.Pixmap(image, THUMBNAIL_WIDTH, max(1, int(image.height * THUMBNAIL_WIDTH / image.width)), None)
+    return image.tobytes()
+
+
+def _store_thumbnail(cache, im):
+    # La miniatura viene creata quando l'immagine viene estratta e salvata in cache (chiave: contenuto dell'immagine)
+    key = content_key(im, THUMBNAIL_VERSION)
+    if cache.get('thumbnails', key) is None:
+        with metrics.span('images.thumbnail', len(im)):
+            thumbnail = _thumbnail(im)
+        cache.put('thumbnails', key, base64.b64encode(thumbnail).decode('ascii'))
+    return key
+
+
+def get_thumbnail(key):
+    # None se la miniatura è stata eliminata dalla cache
+    data = get_cache().get('thumbnails', key)
+    return base64.b64decode(data) if data is not None else None
+
+
+def _batches(items):
+    # Raggruppo le immagini rispettando il numero massimo di immagini e la dimensione massima per richiesta
+    batch_size = config.get_setting('vision_batch_size', VISION_BATCH_SIZE)
+    batch, size = [], 0
+    for key, im in items:
+        if batch and (len(batch) == batch_size or size + len(im) > VISION_BATCH_MAX_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append((key, im))
+        size += len(im)
+    if batch:
+        yield batch
+
+
+def _annotate_batch(client, images):
+    # Una sola richiesta per tutto il gruppo di immagini, con retry e backoff esponenziale sugli errori transitori.
+    # Vision conta la quota per immagine
+    from google.cloud import vision
+    requests = [vision.AnnotateImageRequest(image=vision.Image(content=im),
+                                            features=[vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION)])
+                for im in images]
+
+    def annotate():
+        with track('vision', sum(len(im) for im in images)):
+            return client.batch_annotate_images(requests=requests, retry=vision_retry(), timeout=VISION_TIMEOUT)
+    response = quota.call('vision', annotate, units=len(images))
+
+    out = []
+    for r in response.responses:
+        if r.error.message:
+            raise RuntimeError('Vision API error: ' + r.error.message)
+        out.append(dict(zip([l.description for l in r.label_annotations], [l.score for l in r.label_annotations])))
+    return out
+
+
+def _classify_images(items):
+    # Riceve coppie (chiave, immagine) e restituisce coppie (chiave, label) man mano che i gruppi vengono classificati.
+    # I gruppi sono inviati in parallelo, con al più max_workers richieste (e relative immagini) in memoria
+    client = None
+    max_workers = config.get_setting('vision_max_workers', VISION_MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = {}
+        for batch in _batches(items):
+            if client is None:
+                client = vision_client()
+            if len(in_flight) >= max_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from _completed(future, in_flight)
+            future = pool.submit(metrics.propagate(_annotate_batch), client, [im for _, im in batch])
+            in_flight[future] = [key for key, _ in batch]
+        for future in as_completed(list(in_flight)):
+            yield from _completed(future, in_flight)
+
+
+def _completed(future, in_flight):
+    keys = in_flight.pop(future)
+    return zip(keys, future.result())
+
+
 def _select_labels(labels):
     # Filtro solo le label con score maggiore di 0.7 e che appartengono ad un gruppo prescelto
     selected_labels = []
@@ -89,30 +212,125 @@ def _select_labels(labels):
     return dict(selected_labels)
 
 
-@st.cache(hash_funcs={"builtins.SwigPyObject": lambda _: None}, show_spinner=False)
-def image_analysis(file):
-    if file.type == 'application/pdf':
-        # Estraggo le immagini dal pdf
-        images = _extract_images_from_pdf(file)
-    elif file.type == 'image/png' or file.type == 'image/jpeg':
-        images = [file.read()]
+def analyze_images(content, mime_type, thumbnails=None):
+    # Se thumbnails è un dizionario vi salvo, per ogni immagine, la chiave della sua miniatura
+    cache = get_cache()
+    index = get_index()
+    budget = config.get_setting('image_memory_budget', IMAGE_MEMORY_BUDGET)
+    threshold = config.get_setting('image_hash_threshold', HASH_THRESHOLD)
+    # Solo le immagini estratte da un PDF passano dal filtro locale (loghi, timbri, pagine vuote)
+    embedded = mime_type == 'application/pdf'
+    images = {}
+    labels = {}
+    hashes = {}
+    duplicates = {}
+    waiting = {}
+    leading = set()
+    used = 0
+
+    def to_classify():
+        nonlocal used
+        for i, (im, repeated_pages) in enumerate(_iter_images_pages(content, mime_type), 1):
+            if thumbnails is not None:
+                thumbnails[i] = _store_thumbnail(cache, im)
+            # Conservo per la visualizzazione solo le immagini che rientrano nel budget di memoria della sessione
+            if used + len(im) <= budget:
+                images[i] = im
+                used += len(im)
+            else:
+                images[i] = None
+            # Controllo prima se le label dell'immagine sono già presenti nella cache (chiave: contenuto + modello)
+            key = content_key(im, VISION_MODEL)
+            cached = cache.get('image_labels', key)
+            if cached is not None:
+                labels[i] = cached
+                continue
+
+            # Loghi, immagini vuote o minuscole nel PDF non vengono inviate a Vision: nessuna label
+            if embedded and image_filter.classify(im, repeated_pages) is not None:
+                labels[i] = {}
+                continue
+
+            # Cerco un'immagine quasi identica, prima in questo file e poi tra quelle già classificate
+            with metrics.span('images.dhash', len(im)):
+                h = dhash(im)
+            rep = next((j for j, hj in hashes.items() if hamming(h, hj) <= threshold), None)
+            if rep is not None:
+                record_duplicate()
+                duplicates.setdefault(rep, []).append(i)
+                continue
+            match = index.find(h, threshold)
+            cached = cache.get('image_labels', match) if match is not None else None
+            if cached is not None:
+                record_duplicate()
+                labels[i] = cached
+                cache.put('image_labels', key, cached)
+                continue
+
+            # Se un'altra richiesta sta già classificando la stessa immagine ne attendo il risultato
+            future, leader = _flights.join(key)
+            if not leader:
+                waiting[i] = (future, key, im, h)
+                continue
+            leading.add(key)
+            hashes[i] = h
+            yield (i, key), im
+
+    def classify(items):
+        # Classifico con le API le immagini di cui sono leader; le label vanno in cache, l'hash nell'indice dei
+        # duplicati e il risultato a chi attende la stessa immagine
+        try:
+            for (i, key), l in _classify_images(items):
+                labels[i] = l
+                cache.put('image_labels', key, l)
+                index.add(hashes[i], key)
+                _flights.resolve(key, l)
+                leading.discard(key)
+        except Exception as e:
+            for key in leading:
+                _flights.reject(key, e)
+            raise
+        except BaseException:
+            for key in leading:
+                _flights.abandon(key)
+            raise
+
+    # Solo un'immagine per gruppo di duplicati
+    classify(to_classify())
+
+    for i, (future, key, im, h) in waiting.items():
+        l = _flights.wait(future)
+        while l is None:
+            # La richiesta che stavo attendendo è stata interrotta: riprovo, e se nessun altro la sta classificando
+            # classifico l'immagine io, come leader
+            future, leader = _flights.join(key)
+            if not leader:
+                l = _flights.wait(future)
+                continue
+            leading.add(key)
+            hashes[i] = h
+            classify([((i, key), im)])
+            l = labels[i]
+        labels[i] = l
+
+    # Estendo le label del rappresentante ai suoi duplicati
+    for rep, group in duplicates.items():
+        for j in group:
+            labels[j] = labels[rep]
 
     out = {}
-    for i, im in enumerate(images):
-        # Controllo prima se le label sono già presenti in formato csv nella temporary
-        filename = os.path.splitext(os.path.basename(file.name))[0] + '_' + str(file.size) + '_' + str(i + 1) + '.csv'
-        if os.path.exists(os.path.join(r'tmp/image_labels', filename)):
-            out[i + 1] = (im, pd.read_csv(os.path.join(r'tmp/image_labels', filename),
-                                          header=0, names=['Label', 'Confidence']).set_index('Label').
-                          to_dict()['Confidence'])
-        else:
-            # Classifico l'immagine con le API e salvo le label in csv
-            labels = _classify_image(im)
-            selected_labels = _select_labels(labels)
-            out[i + 1] = (im, selected_labels)
-            if not os.path.exists(r'tmp/image_labels'):
-                os.mkdir(r'tmp/image_labels')
-            pd.DataFrame(selected_labels.values(), index=selected_labels.keys(), columns=['Confidence']). \
-                to_csv(os.path.join(r'tmp/image_labels', filename))
+    for i, im in images.items():
+        out[i] = (im, _select_labels(labels[i]))
 
     return out
+
+
+def extract_image(content, mime_type, index, full_resolution=False):
+    # Immagine i-esima (da 1) del file, per la visualizzazione dei risultati di un job
+    max_side = sys.maxsize if full_resolution else None
+    return next(itertools.islice(_iter_images(content, mime_type, max_side), index - 1, None), None)
+
+
+@memo.memoize('image')
+def image_at(file, index, full_resolution=False):
+    return extract_image(file.getvalue(), file.type, index, full_resolution)
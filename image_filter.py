@@ -0,0 +1,72 @@
+import numpy as np
+import fitz
+import config
+import metrics
+
+# Filtro locale prima di Vision: loghi, firme, timbri, separatori e scansioni quasi vuote non producono label utili
+# (_select_labels le scarterebbe comunque), quindi non vengono inviati. Vale solo per le immagini estratte dai PDF:
+# una foto caricata direttamente è la foto del danno, anche quando è uniforme (un soffitto, un intonaco macchiato).
+# Le soglie sono configurabili con le impostazioni image_filter_<nome>; image_filter_enabled=false disattiva il filtro
+FILTER_MIN_SIDE = 64
+FILTER_MIN_PIXELS = 128 * 128
+FILTER_MAX_ASPECT = 5.0
+# Deviazione standard dei grigi (0-255) sotto cui l'immagine è considerata vuota
+FILTER_MIN_STD = 6.0
+# Entropia dell'istogramma dei grigi (bit, massimo 8) sotto cui l'immagine è un logo o un disegno a pochi colori
+FILTER_MIN_ENTROPY = 3.0
+# Un'immagine ripetuta su almeno questo numero di pagine di un PDF è carta intestata o un timbro
+FILTER_REPEAT_PAGES = 3
+# Lato dell'immagine ridotta su cui calcolo le statistiche
+FILTER_SAMPLE_SIDE = 64
+
+
+def _setting(name, default):
+    return config.get_setting('image_filter_' + name, default)
+
+
+def _gray_sample(image_bytes):
+    # Pixel in scala di grigi dell'immagine ridotta, come matrice NumPy
+    image = fitz.Pixmap(image_bytes)
+    if image.alpha:
+        image = fitz.Pixmap(image, 0)
+    if image.n != 1:
+        image = fitz.Pixmap(fitz.csGRAY, image)
+    width, height = image.width, image.height
+    scale = FILTER_SAMPLE_SIDE / max(width, height)
+    if scale < 1:
+        image = fitz.Pixmap(image, max(1, int(width * scale)), max(1, int(height * scale)), None)
+    pixels = np.frombuffer(image.samples, dtype=np.uint8)
+    return pixels.reshape(image.height, image.width), width, height
+
+
+def _entropy(pixels):
+    counts = np.bincount(pixels.ravel(), minlength=256)
+    p = counts[counts > 0] / pixels.size
+    return float(-(p * np.log2(p)).sum())
+
+
+def classify(image_bytes, repeated_pages=1):
+    # Restituisce il motivo per cui l'immagine va scartata, oppure None se va inviata a Vision
+    if not _setting('enabled', True):
+        return None
+    with metrics.span('images.prefilter', len(image_bytes)):
+        reason = _classify(image_bytes, repeated_pages)
+    if reason is not None:
+        metrics.api_avoided('vision', 'prefilter.' + reason)
+    return reason
+
+
+def _classify(image_bytes, repeated_pages):
+    if repeated_pages >= _setting('repeat_pages', FILTER_REPEAT_PAGES):
+        return 'repeated'
+    pixels, width, height = _gray_sample(image_bytes)
+    if min(width, height) < _setting('min_side', FILTER_MIN_SIDE) or \
+            width * height < _setting('min_pixels', FILTER_MIN_PIXELS):
+        return 'tiny'
+    if max(width, height) / min(width, height) > _setting('max_aspect', FILTER_MAX_ASPECT):
+        return 'aspect'
+    if float(pixels.std()) < _setting('min_std', FILTER_MIN_STD):
+        return 'blank'
+    if _entropy(pixels) < _setting('min_entropy', FILTER_MIN_ENTROPY):
+        return 'logo'
+    return None
@@ -0,0 +1,92 @@
+import sqlite3
+import threading
+import fitz
+from cache import CACHE_PATH
+import metrics
+
+# Distanza di Hamming massima tra due dHash perché le immagini siano considerate duplicate
+HASH_THRESHOLD = 3
+# L'hash a 64 bit è diviso in 4 bande da 16 bit: due hash a distanza < 4 hanno almeno una banda identica
+HASH_BANDS = 4
+
+
+def dhash(image_bytes):
+    # Difference hash: confronto i pixel adiacenti dell'immagine ridotta a 9x8 in scala di grigi
+    image = fitz.Pixmap(image_bytes)
+    if image.alpha:
+        image = fitz.Pixmap(image, 0)
+    if image.n != 1:
+        image = fitz.Pixmap(fitz.csGRAY, image)
+    small = fitz.Pixmap(image, 9, 8, None)
+    pixels = small.samples
+    h = 0
+    for row in range(8):
+        for col in range(8):
+            h = (h << 1) | int(pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return h
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _bands(h):
+    return [(h >> (16 * i)) & 0xFFFF for i in range(HASH_BANDS)]
+
+
+def record_duplicate():
+    metrics.api_avoided('vision', 'duplicate')
+
+
+class HashIndex(object):
+    # Indice persistente hash percettivo -> chiave delle label in cache, condiviso tra pratiche e sessioni
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS image_hashes ('
+                     'hash TEXT NOT NULL, key TEXT NOT NULL, '
+                     'b0 INTEGER NOT NULL, b1 INTEGER NOT NULL, b2 INTEGER NOT NULL, b3 INTEGER NOT NULL, '
+                     'PRIMARY KEY (hash, key))')
+        for i in range(HASH_BANDS):
+            conn.execute('CREATE INDEX IF NOT EXISTS image_hashes_b%d ON image_hashes (b%d)' % (i, i))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def find(self, h, threshold=HASH_THRESHOLD):
+        conn = self._connect()
+        if threshold < HASH_BANDS:
+            # Cerco solo tra gli hash che condividono almeno una banda
+            bands = _bands(h)
+            rows = conn.execute('SELECT hash, key FROM image_hashes WHERE b0 = ? OR b1 = ? OR b2 = ? OR b3 = ?',
+                                bands).fetchall()
+        else:
+            rows = conn.execute('SELECT hash, key FROM image_hashes').fetchall()
+        best = None
+        for stored, key in rows:
+            distance = hamming(h, int(stored, 16))
+            if distance <= threshold and (best is None or distance < best[0]):
+                best = (distance, key)
+        return best[1] if best is not None else None
+
+    def add(self, h, key):
+        self._connect().execute('INSERT OR IGNORE INTO image_hashes (hash, key, b0, b1, b2, b3) '
+                                'VALUES (?, ?, ?, ?, ?, ?)', ['%016x' % h, key] + _bands(h))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = HashIndex()
+        return _index
@@ -0,0 +1,257 @@
+import io
+import fitz
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cache import get_cache, content_key
+from claim_index import document_key
+from extraction import ParsedText
+from clients import documentai_client, track
+import quota
+from singleflight import SingleFlight
+import config
+import metrics
+
+# Ultimi documenti letti, condivisi tra denuncia e fattura: lo stesso file viene letto una sola volta
+MEMORY_DOCUMENTS = 16
+_documents = OrderedDict()
+_lock = threading.Lock()
+# Letture in corso: due sessioni che caricano lo stesso file nello stesso momento fanno una sola lettura
+_flights = SingleFlight('documents')
+
+# Soglie per riconoscere le pagine con un livello di testo utilizzabile
+TEXT_LAYER_MIN_CHARS = 50
+TEXT_LAYER_MAX_GARBAGE = 0.1
+TEXT_LAYER_PUNCTUATION = set('.,;:!?\'"()[]{}<>/\\-_+*=%&#@€$°|~^`’‘“”«»–—…')
+# Lato minimo (pixel) di un'immagine che può essere la scansione di una pagina: loghi e timbri sono più piccoli
+SCAN_MIN_SIDE = 400
+
+# Pagine per richiesta OCR (limite delle richieste sincrone del processore) e richieste in parallelo
+OCR_SHARD_PAGES = 10
+OCR_MAX_WORKERS = 4
+
+
+class ParsedDocument(object):
+    def __init__(self, lines, pages=None, entities=None):
+        self.lines = lines
+        self.pages = pages if pages is not None else [''.join(lines)]
+        self.entities = entities if entities is not None else []
+        self._parsed_text = None
+
+    @property
+    def text(self):
+        return ''.join(self.lines)
+
+    @property
+    def parsed_text(self):
+        # Il testo normalizzato per gli estrattori viene costruito una sola volta per documento
+        if self._parsed_text is None:
+            with metrics.span('extract.parse'):
+                self._parsed_text = ParsedText(self.lines)
+        return self._parsed_text
+
+    def to_dict(self):
+        return {'lines': self.lines, 'pages': self.pages, 'entities': self.entities}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['lines'], data['pages'], data['entities'])
+
+
+def _segment_text(text, layout):
+    return ''.join(text[int(s.start_index):int(s.end_index)] for s in layout.text_anchor.text_segments)
+
+
+def _process_document(content, mime_type):
+    secrets = config.get_secrets()
+    document = {"content": content, "mime_type": mime_type}
+
+    # Configure the process request
+    name = f"projects/{secrets['project_id']}/locations/{secrets['location']}/processors/{secrets['processor_id']}"
+    request = {"name": name, "raw_document": document}
+
+    # Call the API (client condiviso dal registro), rispettando il budget di Document AI
+    client = documentai_client()
+
+    def process():
+        with track('documentai', len(content)):
+            return client.process_document(request=request)
+    document = quota.call('documentai', process).document
+
+    # Conservo testo, pagine ed entità riconosciute per riusarli in tutte le analisi
+    pages = [_segment_text(document.text, page.layout) for page in document.pages]
+    entities = [{'type': e.type_, 'text': e.mention_text, 'confidence': e.confidence, 'page': _entity_page(e)}
+                for e in document.entities]
+    return ParsedDocument(document.text.splitlines(keepends=True), pages, entities)
+
+
+def _entity_page(entity):
+    refs = entity.page_anchor.page_refs
+    return int(refs[0].page) if refs else 0
+
+
+def _has_text_layer(text):
+    # Una pagina nativa digitale ha abbastanza caratteri e pochi caratteri "spazzatura" (glifi non mappati, simboli)
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < config.get_setting('text_layer_min_chars', TEXT_LAYER_MIN_CHARS):
+        return False
+    garbage = sum(1 for c in chars if not (c.isalnum() or c in TEXT_LAYER_PUNCTUATION))
+    return garbage / len(chars) <= config.get_setting('text_layer_max_garbage', TEXT_LAYER_MAX_GARBAGE)
+
+
+def _is_scanned(pdf, index, text):
+    # Una pagina senza un livello di testo utilizzabile va all'OCR solo se può contenere testo da leggere:
+    # un'immagine grande quanto una scansione, oppure testo con glifi non mappati. Le pagine vuote o con poche
+    # parole (separatori, copertine, anche con un logo) restano con il loro testo, senza chiamare Document AI
+    if _has_text_layer(text):
+        return False
+    min_side = config.get_setting('text_layer_scan_min_side', SCAN_MIN_SIDE)
+    if any(min(img[2], img[3]) >= min_side for img in pdf.getPageImageList(index)):
+        return True
+    return len([c for c in text if not c.isspace()]) >= config.get_setting('text_layer_min_chars',
+                                                                           TEXT_LAYER_MIN_CHARS)
+
+
+def _page_fingerprint(pdf, index):
+    # Impronta del contenuto di una pagina (istruzioni di disegno, immagini, font e geometria): non dipende
+    # dal resto del file, così la stessa pagina in un fascicolo ricaricato ha la stessa chiave in cache
+    page = pdf[index]
+    h = hashlib.sha256()
+    h.update(page.readContents())
+    for resources in (pdf.getPageImageList(index), pdf.getPageXObjectList(index), pdf.getPageFontList(index)):
+        for item in resources:
+            h.update(pdf.xrefStream(item[0]) or b'')
+    h.update(repr((tuple(page.rect), page.rotation)).encode('utf-8'))
+    return h.digest()
+
+
+def _pages_pdf(pdf, indexes):
+    subset = fitz.open()
+    for i in indexes:
+        subset.insertPDF(pdf, from_page=i, to_page=i)
+    return subset.write()
+
+
+def _ocr_shard(content, shard):
+    # OCR di un blocco di pagine; restituisce testo ed entità di ogni pagina
+    ocr = _process_document(content, 'application/pdf')
+    out = []
+    for n, (i, key) in enumerate(shard):
+        entities = [dict(e, page=i) for e in ocr.entities if e.get('page', 0) == n]
+        out.append((i, key, {'text': ocr.pages[n] if n < len(ocr.pages) else '', 'entities': entities}))
+    return out
+
+
+def _ocr_pages(pdf, indexes):
+    # Ogni pagina ha la sua voce in cache: ricaricando un fascicolo con una pagina modificata rifaccio l'OCR
+    # solo di quella. Le pagine mancanti vanno a Document AI in blocchi (limite di pagine delle richieste
+    # sincrone), inviati in parallelo con al più max_workers blocchi in memoria
+    cache = get_cache()
+    version = 'documentai/' + config.get_secrets()['processor_id']
+    results = {}
+    missing = []
+    for i in indexes:
+        key = content_key(_page_fingerprint(pdf, i), version)
+        data = cache.get('pages', key)
+        if data is not None:
+            results[i] = data
+        else:
+            missing.append((i, key))
+
+    shard_pages = config.get_setting('ocr_shard_pages', OCR_SHARD_PAGES)
+    max_workers = config.get_setting('ocr_max_workers', OCR_MAX_WORKERS)
+    shards = [missing[n:n + shard_pages] for n in range(0, len(missing), shard_pages)]
+
+    def store(future):
+        for i, key, data in future.result():
+            cache.put('pages', key, data)
+            results[i] = data
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = set()
+        for shard in shards:
+            if len(in_flight) >= max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(future)
+            # I documenti PyMuPDF non sono thread-safe: il pdf del blocco viene preparato in questo thread
+            content = _pages_pdf(pdf, [i for i, _ in shard])
+            in_flight.add(pool.submit(metrics.propagate(_ocr_shard), content, shard))
+        for future in in_flight:
+            store(future)
+    return results
+
+
+def _read_pdf(content):
+    try:
+        pdf = fitz.open(stream=content, filetype='pdf')
+    except RuntimeError:
+        return _process_document(content, 'application/pdf')
+
+    if config.get_setting('local_text_layer', True):
+        # Uso il testo già presente nel pdf e mando all'OCR solo le pagine scansionate
+        with metrics.span('pdf.text_layer', len(content)):
+            pages = [page.getText() for page in pdf]
+            scanned = [i for i, text in enumerate(pages) if _is_scanned(pdf, i, text)]
+    else:
+        pages = [''] * len(pdf)
+        scanned = list(range(len(pdf)))
+
+    entities = []
+    if scanned:
+        ocr = _ocr_pages(pdf, scanned)
+        for i in scanned:
+            pages[i] = ocr[i]['text']
+            entities += ocr[i]['entities']
+
+    # Ogni pagina termina con un ritorno a capo, così le righe di pagine diverse non si uniscono
+    pages = [text if text.endswith('\n') else text + '\n' for text in pages]
+    return ParsedDocument(''.join(pages).splitlines(keepends=True), pages, entities)
+
+
+def _read_document(content, mime_type, key):
+    if mime_type == 'text/plain':
+        # Leggo il file come stringa
+        with metrics.span('decode.text', len(content)):
+            stringio = io.StringIO(content.decode("utf-8"))
+            return ParsedDocument(stringio.readlines())
+    elif mime_type == 'application/pdf':
+        # Controllo prima se il documento è già presente nella cache (chiave: contenuto + processore)
+        cache = get_cache()
+        data = cache.get('documents', key)
+        if data is not None:
+            return ParsedDocument.from_dict(data)
+        # Estraggo il testo dal file (livello di testo locale e/o API Google) e lo salvo, con la chiave del file
+        # dell'indice dei dati estratti: corpus.py rilegge questi testi dalla cache
+        doc = _read_pdf(content)
+        cache.put('documents', key, dict(doc.to_dict(), file=document_key(content)))
+        return doc
+    raise ValueError('Formato non supportato: %s' % mime_type)
+
+
+def _version(mime_type):
+    # Il testo estratto da un pdf dipende dal processore Document AI usato
+    if mime_type == 'application/pdf':
+        version = 'documentai/' + config.get_secrets()['processor_id']
+        if config.get_setting('local_text_layer', True):
+            version += '/textlayer'
+        return version
+    return mime_type
+
+
+def ingest(content, mime_type):
+    key = content_key(content, _version(mime_type))
+    with _lock:
+        doc = _documents.get(key)
+        if doc is not None:
+            _documents.move_to_end(key)
+            return doc
+
+    with metrics.span('ingest.' + mime_type.split('/')[-1], len(content)):
+        doc = _flights.do(key, lambda: _read_document(content, mime_type, key))
+    with _lock:
+        _documents[key] = doc
+        while len(_documents) > MEMORY_DOCUMENTS:
+            _documents.popitem(last=False)
+    return doc
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from cache import content_key
+from claim_index import document_key
+import config
+import metrics
+import memo
+
+# Coda persistente delle analisi: lo script Streamlit accoda i file caricati e mostra i risultati man mano
+# che i worker li completano, senza mai attendere le chiamate remote
+JOBS_PATH = r'tmp/jobs.sqlite'
+JOB_WORKERS = 4
+# I job terminati vengono eliminati dopo una settimana; il file caricato viene eliminato appena il job termina
+JOB_RETENTION = 7 * 24 * 3600
+KINDS = ('denuncia', 'foto', 'fattura')
+# Da incrementare quando cambia il formato dei risultati: i job già salvati non vengono riusati
+RESULT_VERSION = 2
+
+
+def _run(kind, content, mime_type):
+    if kind == 'denuncia':
+        from text_analysis import analyze_text
+        return analyze_text(content, mime_type)
+    elif kind == 'fattura':
+        from invoice_analysis import analyze_invoice
+        return analyze_invoice(content, mime_type)
+    # Per le foto salvo le label e la chiave della miniatura: le immagini vengono estratte dal file quando servono
+    from image_analysis import analyze_images
+    thumbnails = {}
+    results = analyze_images(content, mime_type, thumbnails)
+    return {str(i): {'labels': labels, 'thumbnail': thumbnails[i]} for i, (_, labels) in results.items()}
+
+
+def job_version(kind, mime_type):
+    return '%s/%s/%d' % (kind, mime_type, RESULT_VERSION)
+
+
+def job_id(kind, content, mime_type):
+    # Il job è identificato dal contenuto: lo stesso file caricato più volte (o da più sessioni)
+    # viene analizzato una sola volta
+    return content_key(content, job_version(kind, mime_type))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue(object):
+    def __init__(self, path=JOBS_PATH, workers=JOB_WORKERS):
+        self.path = path
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                     'id TEXT PRIMARY KEY, '
+                     'kind TEXT NOT NULL, '
+                     'mime_type TEXT NOT NULL, '
+                     'content BLOB, '
+                     'status TEXT NOT NULL, '
+                     'owner INTEGER, '
+                     'result TEXT, '
+                     'error TEXT, '
+                     'metrics TEXT, '
+                     'created REAL NOT NULL, '
+                     'started REAL, '
+                     'finished REAL, '
+                     'document TEXT)')
+        # document: chiave del file nell'indice dei dati estratti, che resta anche dopo l'eliminazione del contenuto
+        if 'document' not in [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]:
+            conn.execute('ALTER TABLE jobs ADD COLUMN document TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+        self._recover()
+        self._threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _recover(self):
+        # Dopo un riavvio i job rimasti "running" di processi non più attivi tornano in coda;
+        # elimino i job più vecchi del periodo di conservazione
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute("SELECT id, owner FROM jobs WHERE status = 'running'").fetchall()
+            for job_id, owner in rows:
+                if owner is None or (owner != os.getpid() and not _alive(owner)):
+                    conn.execute("UPDATE jobs SET status = 'queued', owner = NULL, started = NULL WHERE id = ?",
+                                 (job_id,))
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND finished < ?",
+                         (time.time() - JOB_RETENTION,))
+            # Contenuti dei job terminati con una versione precedente, che li conservava
+            conn.execute("UPDATE jobs SET content = NULL WHERE status IN ('done', 'error') AND content IS NOT NULL")
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def submit(self, kind, content, mime_type):
+        # Un job già presente non viene duplicato; un job fallito viene riaccodato. Restituisce la chiave del job e
+        # True se questa chiamata lo ha accodato (False se era già in coda, in corso o completato)
+        key = job_id(kind, content, mime_type)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            created = conn.execute("INSERT OR IGNORE INTO jobs (id, kind, mime_type, content, status, created, "
+                                   "document) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                                   (key, kind, mime_type, content, time.time(), document_key(content))).rowcount
+            created += conn.execute("UPDATE jobs SET status = 'queued', error = NULL, created = ?, content = ? "
+                                    "WHERE id = ? AND status = 'error'", (time.time(), content, key)).rowcount
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._wakeup.set()
+        return key, created > 0
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT id, kind, status, result, error, metrics, created, started, finished '
+                                      'FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(['id', 'kind', 'status', 'result', 'error', 'metrics', 'created', 'started', 'finished'], row))
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        job['metrics'] = json.loads(job['metrics']) if job['metrics'] is not None else None
+        return job
+
+    def _claim(self):
+        # Prendo il job più vecchio in coda; BEGIN IMMEDIATE evita che due worker prendano lo stesso job
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT id, kind, mime_type, content FROM jobs WHERE status = 'queued' "
+                               "ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', owner = ?, started = ? WHERE id = ?",
+                             (os.getpid(), time.time(), row[0]))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return row
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                job = None
+            if job is None:
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            self._execute(*job)
+
+    def _execute(self, job_id, kind, mime_type, content):
+        # Le misure del job (fasi, cache, quote) vengono salvate con il risultato
+        registry = metrics.Registry()
+        try:
+            with metrics.scope(registry), metrics.span('job.' + kind, len(content)):
+                result = _run(kind, content, mime_type)
+        except Exception as e:
+            self._finish(job_id, 'error', None, '%s: %s' % (type(e).__name__, e), registry)
+        else:
+            self._finish(job_id, 'done', json.dumps(result), None, registry)
+
+    def _finish(self, job_id, status, result, error, registry):
+        # Il file caricato non serve più: un job fallito viene riaccodato con il contenuto da submit
+        self._connect().execute('UPDATE jobs SET status = ?, result = ?, error = ?, metrics = ?, finished = ?, '
+                                'owner = NULL, content = NULL WHERE id = ?',
+                                (status, result, error, json.dumps(registry.snapshot()), time.time(), job_id))
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    # Una sola coda (e un solo pool di worker) per processo
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(workers=config.get_setting('job_workers', JOB_WORKERS))
+        return _queue
+
+
+def poll(queue, kind, file, submitted, registry):
+    # Un'esecuzione dello script per un file caricato (main.py, e le sessioni simulate di benchmarks/load_driver.py):
+    # accodo l'analisi una sola volta per sessione e leggo lo stato del job, senza mai attendere le chiamate remote.
+    # submitted è lo stato della sessione: chiave del job -> True finché le misure del job sono da aggiungere al
+    # registro della sessione. Le misure vanno solo alla sessione che ha accodato il job: le altre sessioni con lo
+    # stesso file non hanno fatto chiamate. Un job fallito viene riaccodato all'esecuzione successiva
+    key = memo.file_key(file, job_version(kind, file.type))
+    job = None
+    while job is None:
+        if key not in submitted:
+            _, submitted[key] = queue.submit(kind, file.getvalue(), file.type)
+        job = queue.get(key)
+        if job is None:
+            # Job eliminato dopo l'accodamento (es. da un altro processo): lo accodo di nuovo
+            del submitted[key]
+    if job['status'] in ('done', 'error'):
+        if submitted[key]:
+            registry.merge(job['metrics'])
+            submitted[key] = False
+        if job['status'] == 'error':
+            del submitted[key]
+    return job
+
+
+def job_timings(job):
+    # Attesa in coda, durata dell'analisi e tempo totale per fase (secondi)
+    timings = {}
+    if job['started'] is not None:
+        timings['coda'] = job['started'] - job['created']
+    if job['finished'] is not None and job['started'] is not None:
+        timings['analisi'] = job['finished'] - job['started']
+    if job['metrics'] is not None:
+        for stage, h in job['metrics']['stages'].items():
+            timings[stage] = h['sum']
+    return timings
@@ -0,0 +1,230 @@
+import os
+import re
+import json
+import bisect
+import threading
+from collections import deque
+from config import get_setting
+
+# Vocabolario delle causali e parole chiave degli estrattori, modificabile senza toccare il codice
+VOCABULARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vocabulary.json')
+
+
+def _is_word(c):
+    # Stessa definizione di \w delle regex sulle stringhe unicode
+    return c.isalnum() or c == '_'
+
+
+def _boundary(text, i, lo, hi):
+    # Equivale a \b nella posizione i della finestra text[lo:hi]
+    left = i > lo and _is_word(text[i - 1])
+    right = i < hi and _is_word(text[i])
+    return left != right
+
+
+class Term(object):
+    # Sintassi dei termini come nelle vecchie regex: 'tubazion.' = radice + un carattere qualsiasi,
+    # 'incendi.?' = carattere finale facoltativo; bounded = termine delimitato da \b su entrambi i lati.
+    # 'cod. fisc*' = abbreviazione: delimitata solo all'inizio, trova anche 'cod. fiscale'
+    def __init__(self, spec, bounded=True):
+        self.prefix = spec.endswith('*')
+        if self.prefix:
+            spec = spec[:-1]
+        if spec.endswith('.?'):
+            self.base, self.suffix = spec[:-2], '?'
+        elif spec.endswith('.'):
+            self.base, self.suffix = spec[:-1], '.'
+        else:
+            self.base, self.suffix = spec, ''
+        self.bounded = bounded
+
+    def ends(self, text, end, hi):
+        # Possibili fine del match dopo la radice, nell'ordine in cui le proverebbe la regex (greedy)
+        if self.suffix and end < hi and text[end] != '\n':
+            yield end + 1
+        if self.suffix != '.':
+            yield end
+
+    def match_end(self, text, start, lo, hi):
+        # Fine del match che inizia con la radice in start, oppure None
+        if self.bounded and not _boundary(text, start, lo, hi):
+            return None
+        for e in self.ends(text, start + len(self.base), hi):
+            if not self.bounded or self.prefix or _boundary(text, e, lo, hi):
+                return e
+        return None
+
+    def pattern(self):
+        # La stessa regola come regex: '.' non attraversa il ritorno a capo, '.?' prova prima con il carattere
+        suffix = {'.': '.', '?': '.?', '': ''}[self.suffix]
+        if not self.bounded:
+            return re.escape(self.base) + suffix
+        end = '' if self.prefix else r'\b'
+        if _is_word(self.base[0]):
+            # \b iniziale controllato dopo il primo carattere: un'alternanza che inizia con caratteri letterali
+            # fa saltare il motore delle regex direttamente alle posizioni possibili
+            return re.escape(self.base[0]) + r'(?<!\w.)' + re.escape(self.base[1:]) + suffix + end
+        return r'\b' + re.escape(self.base) + suffix + end
+
+
+class KeywordMatcher(object):
+    # Automa di Aho-Corasick sulle radici di tutti i termini: una sola scansione lineare del testo
+    # trova ogni occorrenza di ogni termine del vocabolario e delle parole chiave
+    def __init__(self, vocabulary):
+        self.terms = []
+        self.categories = []
+        for category, specs in vocabulary['categories'].items():
+            self.categories.append((category, self._add_terms(specs, True)))
+        self.groups = {}
+        for name, group in vocabulary['keywords'].items():
+            self.groups[name] = self._add_terms(group['terms'], group.get('bounded', True))
+        # Le stesse ricerche come regex, equivalenti a r'\b(termine1|termine2|...)\b': per poche finestre brevi
+        # (fatture) e per i testi del corpus uniti in un'unica stringa costano meno della scansione dell'automa
+        self.category_res = [self._regex(term_ids) for _, term_ids in self.categories]
+        self.group_res = dict((name, self._regex(term_ids)) for name, term_ids in self.groups.items())
+
+        self.bases = []
+        self._base_terms = []
+        base_ids = {}
+        for term_id, term in enumerate(self.terms):
+            if term.base not in base_ids:
+                base_ids[term.base] = len(self.bases)
+                self.bases.append(term.base)
+                self._base_terms.append([])
+            self._base_terms[base_ids[term.base]].append(term_id)
+        self._build()
+
+    def _add_terms(self, specs, bounded):
+        ids = []
+        for spec in specs:
+            ids.append(len(self.terms))
+            self.terms.append(Term(spec.lower(), bounded))
+        return ids
+
+    def _regex(self, term_ids):
+        return re.compile('|'.join(self.terms[term_id].pattern() for term_id in term_ids))
+
+    def _build(self):
+        goto, fail, out = [{}], [0], [[]]
+        for base_id, base in enumerate(self.bases):
+            state = 0
+            for c in base:
+                nxt = goto[state].get(c)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                    goto[state][c] = nxt
+                state = nxt
+            out[state].append(base_id)
+
+        # Collegamenti di fallimento in ampiezza, poi le transizioni complete dell'automa deterministico:
+        # nella scansione ogni carattere costa una sola lettura di dizionario
+        alphabet = set(''.join(self.bases))
+        delta = [dict(goto[0])]
+        order = deque(goto[0].values())
+        delta.extend({} for _ in range(len(goto) - 1))
+        while order:
+            state = order.popleft()
+            for c, nxt in goto[state].items():
+                f = fail[state]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(c, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+                order.append(nxt)
+            for c in alphabet:
+                nxt = goto[state].get(c)
+                if nxt is None:
+                    nxt = delta[fail[state]].get(c, 0)
+                if nxt:
+                    delta[state][c] = nxt
+        self._delta = delta
+        self._out = out
+
+    def scan(self, text):
+        delta, out = self._delta, self._out
+        found = []
+        state = 0
+        for i, c in enumerate(text):
+            state = delta[state].get(c, 0)
+            if out[state]:
+                found.append((i + 1, state))
+
+        starts = [[] for _ in self.terms]
+        for end, state in found:
+            for base_id in out[state]:
+                start = end - len(self.bases[base_id])
+                for term_id in self._base_terms[base_id]:
+                    starts[term_id].append(start)
+        return KeywordHits(self, text, starts)
+
+    def near(self, group, window):
+        # True se una parola chiave del gruppo compare nella finestra (già in minuscolo)
+        return self.group_res[group].search(window) is not None
+
+
+class KeywordHits(object):
+    # Indice delle posizioni dei termini in un testo, interrogato dallo score delle causali e dagli estrattori
+    def __init__(self, matcher, text, starts):
+        self.matcher = matcher
+        self.text = text
+        self.starts = starts
+        self._counts = None
+
+    def counts(self):
+        # Occorrenze di ogni categoria, come len(re.findall(r'\b(termine1|termine2|...)\b', text))
+        if self._counts is None:
+            self._counts = [(category, self._count(term_ids)) for category, term_ids in self.matcher.categories]
+        return self._counts
+
+    def _count(self, term_ids):
+        text, hi = self.text, len(self.text)
+        candidates = []
+        for order, term_id in enumerate(term_ids):
+            term = self.matcher.terms[term_id]
+            for start in self.starts[term_id]:
+                end = term.match_end(text, start, 0, hi)
+                if end is not None:
+                    candidates.append((start, order, end))
+        # findall non sovrappone i match e, a parità di inizio, sceglie la prima alternativa
+        candidates.sort()
+        count, pos = 0, 0
+        for start, order, end in candidates:
+            if start >= pos:
+                count += 1
+                pos = end
+        return count
+
+    def within(self, group, lo, hi):
+        # True se una parola chiave del gruppo compare nella finestra text[lo:hi]
+        lo, hi = max(lo, 0), min(hi, len(self.text))
+        for term_id in self.matcher.groups[group]:
+            term = self.matcher.terms[term_id]
+            starts = self.starts[term_id]
+            i = bisect.bisect_left(starts, lo)
+            while i < len(starts) and starts[i] + len(term.base) <= hi:
+                if term.match_end(self.text, starts[i], lo, hi) is not None:
+                    return True
+                i += 1
+        return False
+
+
+def load_vocabulary(path=None):
+    path = path or get_setting('vocabulary_path', VOCABULARY_PATH)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+_matcher = None
+_lock = threading.Lock()
+
+
+def get_matcher():
+    # L'automa viene costruito una sola volta per processo
+    global _matcher
+    with _lock:
+        if _matcher is None:
+            _matcher = KeywordMatcher(load_vocabulary())
+        return _matcher
@@ -1,15 +1,85 @@
+import time
 import streamlit as st
 import pandas as pd
-from text_analysis import text_analysis
-from image_analysis import image_analysis
-from invoice_analysis import invoice_analysis
 import SessionState
+import claim_index
+import jobs
+import metrics
+import config
+import warmup
 
 
 def any_in(a, b):
     return any(i in b for i in a)
 
 
+def run_job(kind, file):
+    # I risultati compaiono alle esecuzioni successive; le misure del job vanno alla sessione che lo ha accodato
+    return jobs.poll(queue, kind, file, session.jobs, session.metrics)
+
+
+def show_job(job):
+    # Stato del job e tempi (attesa in coda e durata dell'analisi)
+    global pending
+    timings = jobs.job_timings(job)
+    if job['status'] == 'queued':
+        st.info('In coda da %.0f s' % (time.time() - job['created']))
+    elif job['status'] == 'running':
+        st.info('Analisi in corso da %.0f s (attesa in coda %.1f s)' % (time.time() - job['started'],
+                                                                          timings['coda']))
+    elif job['status'] == 'error':
+        st.error('Analisi non riuscita: %s (verrà ripetuta al prossimo aggiornamento della pagina)' % job['error'])
+    else:
+        st.text('Analisi completata in %.1f s (attesa in coda %.1f s)' % (timings['analisi'], timings['coda']))
+    if job['status'] in ('queued', 'running'):
+        pending = True
+        return None
+    return job['result']
+
+
+def show_matches(file, fields):
+    # Denunce e fatture già analizzate con la stessa polizza, lo stesso CF, la stessa P.IVA o la stessa email
+    if not config.get_setting('claim_index_enabled', True):
+        return
+    matches = claim_index.get_index().matches(fields, exclude=claim_index.upload_key(file))
+    if not matches:
+        return
+    repeated = sum(1 for m in matches if m['kind'] == 'denuncia' and 'Codice Fiscale' in m['matched'])
+    if repeated:
+        st.warning('Codice fiscale presente in %d denunce già analizzate' % repeated)
+    st.markdown('**Documenti già analizzati con dati in comune**')
+    rows = [{'Tipo': m['kind'],
+             'Analizzato il': time.strftime('%d-%m-%Y %H:%M', time.localtime(m['indexed'])),
+             'In comune': ', '.join(m['matched']),
+             'Numero polizza': m['fields'].get('Numero polizza', ''),
+             'Codice Fiscale': m['fields'].get('Codice Fiscale', ''),
+             'Partita IVA': m['fields'].get('Partita IVA', ''),
+             'Importo': m['fields'].get('Importo', '')} for m in matches]
+    st.dataframe(pd.DataFrame(rows))
+
+
+# Le misure di questa esecuzione finiscono anche nel registro della sessione; le metriche di processo
+# sono esposte su un endpoint locale e/o scritte su file, se configurati
+session = SessionState.get(metrics=None, jobs=None)
+if session.metrics is None:
+    session.metrics = metrics.Registry()
+    session.jobs = {}
+metrics.bind(session.metrics)
+if config.get_setting('metrics_port', 0):
+    metrics.serve(config.get_setting('metrics_port', 0))
+
+# Gli SDK di Google, PyMuPDF e i moduli di analisi vengono importati al primo uso (nei worker della coda);
+# con warmup=true un thread li pre-carica in background al primo avvio del processo
+if config.get_setting('warmup', False):
+    warmup.start()
+
+# Le analisi girano nei worker della coda persistente; finché ci sono job in corso la pagina si aggiorna da sola
+queue = jobs.get_queue()
+pending = False
+key_data = None
+labels = None
+
+
 # -----Sidebar----- #
 st.sidebar.image(r'figures/MicrosoftTeams-image.png', width=225)
 st.sidebar.title('AI per la Polizza Globale Fabbricati')
@@ -20,7 +90,7 @@ uploaded_file_2 = st.sidebar.file_uploader("Carica le foto dell'evento", type=['
 uploaded_file_3 = st.sidebar.file_uploader("Carica il documento di fattura/preventivo", type=['pdf', 'txt'])
 
 api_calls = st.sidebar.empty()
-api_calls.text('API Calls: ' + str(SessionState.get(api_calls=0).api_calls))
+api_calls.text('API Calls: ' + str(session.metrics.api_calls()))
 st.sidebar.markdown(
     "<h5 style='text-align: center; color: black;'>si consiglia refresh del browser ad ogni nuovo file testato ("
     "pulizia cache)</h4>",
@@ -36,11 +106,12 @@ else:
     st.subheader('Dati chiave trovati nel testo')
 
     # Estraggo le info chiave
-    key_data = text_analysis(uploaded_file_1)
-    api_calls.text('API Calls: ' + str(SessionState.get(api_calls=0).api_calls))
+    key_data = show_job(run_job('denuncia', uploaded_file_1))
 
     # Mostro i risultati
-    st.dataframe(pd.DataFrame(key_data.values(), index=key_data.keys(), columns=['Valori trovati']))
+    if key_data is not None:
+        st.dataframe(pd.DataFrame(key_data.values(), index=key_data.keys(), columns=['Valori trovati']))
+        show_matches(uploaded_file_1, key_data)
 
 # Nella seconda colonna gestisco l'estrazione dei dati da file immagine
 if uploaded_file_2 is None:
@@ -50,31 +121,41 @@ else:
     st.subheader('Contenuto delle immagini')
 
     # Classifico le immagini
-    results = image_analysis(uploaded_file_2)
-    api_calls.text('API Calls: ' + str(SessionState.get(api_calls=0).api_calls))
+    results = show_job(run_job('foto', uploaded_file_2))
 
     # Mostro i risultati
-    if len(results) > 1:
-        option = st.selectbox('Quale immagine vuoi visualizzare?', options=list(results.keys()))
+    if results is None:
+        option = None
+    elif len(results) > 1:
+        option = st.selectbox('Quale immagine vuoi visualizzare?', options=[int(i) for i in results.keys()])
     else:
         option = 1
 
     if option is not None:
-        im = results[option][0]
-        labels = results[option][1]
-        if uploaded_file_1 is not None and key_data['Causale'] == 'Acqua condotta' and any_in(
+        # Mostro la miniatura salvata durante l'analisi; la piena risoluzione viene estratta dal file solo a richiesta
+        from image_analysis import image_at, get_thumbnail
+        labels = results[str(option)]['labels']
+        full_resolution = st.checkbox('Mostra a piena risoluzione')
+        if full_resolution:
+            im = image_at(uploaded_file_2, option, True)
+        else:
+            im = get_thumbnail(results[str(option)]['thumbnail']) or image_at(uploaded_file_2, option)
+        if key_data is not None and key_data['Causale'] == 'Acqua condotta' and any_in(
                 ['Tubature', 'Impianto idraulico'], labels):
             caption = 'Danneggiante'
-        elif uploaded_file_1 is not None and key_data['Causale'] == 'Acqua condotta' and any_in(
+        elif key_data is not None and key_data['Causale'] == 'Acqua condotta' and any_in(
                 ['Soffitto', 'Intonaco'], labels):
             caption = 'Danneggiato'
         else:
             caption = None
-        st.image(im, width=255, caption=caption)
+        if im is not None:
+            st.image(im, width=None if full_resolution else 255, caption=caption)
+        else:
+            st.text('Immagine non trovata nel file')
         st.dataframe(pd.DataFrame(labels.values(), index=labels.keys(), columns=['Confidence']).
                      sort_values('Confidence', ascending=False))
 
-if uploaded_file_1 is not None and uploaded_file_2 is not None:
+if key_data is not None and labels is not None:
 
     # lab = [l for r in results.values() for l in r[1].keys()]
     if key_data['Causale'] == 'Acqua condotta' and \
@@ -89,8 +170,32 @@ else:
     st.subheader('Importo stimato')
 
     # Estraggo le info chiave
-    key_data = invoice_analysis(uploaded_file_3)
-    api_calls.text('API Calls: ' + str(SessionState.get(api_calls=0).api_calls))
+    invoice_data = show_job(run_job('fattura', uploaded_file_3))
 
     # Mostro i risultati
-    st.dataframe(pd.DataFrame(key_data.values(), index=key_data.keys(), columns=['Valori trovati']))
+    if invoice_data is not None:
+        st.dataframe(pd.DataFrame(invoice_data.values(), index=invoice_data.keys(), columns=['Valori trovati']))
+        show_matches(uploaded_file_3, invoice_data)
+
+api_calls.text('API Calls: ' + str(session.metrics.api_calls()))
+
+# -----Prestazioni----- #
+summary = session.metrics.summary()
+with st.sidebar.beta_expander('Prestazioni della sessione'):
+    if summary['stages']:
+        st.dataframe(pd.DataFrame.from_dict(summary['stages'], orient='index').round(2))
+    if summary['cache']:
+        st.dataframe(pd.DataFrame.from_dict(summary['cache'], orient='index').round(2))
+    if summary['apis']:
+        # Consumo delle quote e attesa dovuta al rate limiter
+        st.dataframe(pd.DataFrame.from_dict(summary['apis'], orient='index').round(2))
+    if metrics.channels():
+        # Client condivisi da tutte le sessioni: un canale per API finché il processo è attivo
+        st.text('Canali API del processo: ' + ', '.join('%s %d' % item for item in sorted(metrics.channels().items())))
+if config.get_setting('metrics_file'):
+    metrics.export(config.get_setting('metrics_file'))
+
+# Ricarico la pagina finché tutti i job non sono terminati
+if pending:
+    time.sleep(1)
+    st.experimental_rerun()
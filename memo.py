@@ -0,0 +1,117 @@
+import sys
+import threading
+import functools
+from collections import OrderedDict
+from cache import content_key
+import config
+import metrics
+
+# Memoizzazione in memoria al posto di st.cache: la chiave è il digest del contenuto del file, calcolato una sola
+# volta per upload, e i risultati non vengono ri-hashati a ogni rerun per controllarne le modifiche
+# (i chiamanti non devono modificarli). La dimensione totale dei risultati conservati è limitata (LRU)
+MEMO_MAX_BYTES = 256 * 1024 * 1024
+
+
+def sizeof(value):
+    # Stima dei byte occupati da un risultato: conta i buffer (bytes, stringhe) e i contenitori
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value) + 49
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LRU(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.used -= old[1]
+            # Un risultato più grande dell'intero budget non viene conservato
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.used += size
+            while self.used > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.used -= evicted
+
+    def __len__(self):
+        return len(self._items)
+
+
+_lru = None
+_lru_lock = threading.Lock()
+
+
+def get_lru():
+    # Un solo budget di memoria condiviso da tutte le funzioni memoizzate del processo
+    global _lru
+    with _lru_lock:
+        if _lru is None:
+            _lru = LRU(config.get_setting('memo_max_bytes', MEMO_MAX_BYTES))
+        return _lru
+
+
+# Digest dei file caricati per id dell'upload: a ogni rerun Streamlit restituisce un nuovo oggetto per lo stesso
+# upload, ma con lo stesso id
+MAX_DIGESTS = 1024
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def file_key(file, version=''):
+    # Chiave di contenuto di un file caricato (uguale a cache.content_key), calcolata una sola volta per upload
+    upload = getattr(file, 'id', None)
+    key = (upload, len(file.getvalue()), version)
+    if upload is not None:
+        with _digests_lock:
+            digest = _digests.get(key)
+            if digest is not None:
+                _digests.move_to_end(key)
+                return digest
+    content = file.getvalue()
+    with metrics.span('memo.digest', len(content)):
+        digest = content_key(content, version)
+    if upload is not None:
+        with _digests_lock:
+            _digests[key] = digest
+            if len(_digests) > MAX_DIGESTS:
+                _digests.popitem(last=False)
+    return digest
+
+
+def memoize(namespace):
+    # Decoratore per funzioni il cui primo argomento è un file caricato (gli altri devono essere hashable)
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(file, *args):
+            key = (namespace, file_key(file, file.type), args)
+            lru = get_lru()
+            result = lru.get(key)
+            metrics.cache_lookup('memo.' + namespace, result is not None)
+            if result is None:
+                result = func(file, *args)
+                lru.put(key, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Limiti superiori (in secondi) dei bucket degli istogrammi di latenza, come nei client Prometheus
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0)
+PREFIX = 'rma'
+
+
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.errors = 0
+
+    def observe(self, seconds, nbytes=0, error=False):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.bytes += nbytes
+        self.errors += int(error)
+
+    def merge(self, data):
+        for i, n in enumerate(data['buckets']):
+            self.buckets[i] += n
+        self.count += data['count']
+        self.sum += data['sum']
+        self.max = max(self.max, data['max'])
+        self.bytes += data['bytes']
+        self.errors += data['errors']
+
+    def quantile(self, q):
+        # Stima per interpolazione lineare dentro il bucket, come histogram_quantile di Prometheus
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if seen + n >= rank and n:
+                lo = BUCKETS[i - 1] if i > 0 else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max, 'bytes': self.bytes, 'errors': self.errors,
+                'buckets': list(self.buckets)}
+
+
+class Registry(object):
+    # Istogrammi per fase, esiti delle ricerche in cache e consumo delle quote API; uno per processo,
+    # più quelli delle sessioni o pratiche
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.cache = {}
+        self.apis = {}
+        self.avoided = {}
+        # Canali gRPC aperti dai client condivisi (clients.py): solo nel registro di processo
+        self.channels = {}
+
+    def observe(self, stage, seconds, nbytes=0, error=False):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds, nbytes, error)
+
+    def cache_lookup(self, namespace, hit):
+        with self._lock:
+            counters = self.cache.setdefault(namespace, {'hits': 0, 'misses': 0})
+            counters['hits' if hit else 'misses'] += 1
+
+    def api_call(self, api, units=1, wait=0.0, retries=0):
+        with self._lock:
+            usage = self.apis.setdefault(api, {'calls': 0, 'units': 0, 'wait_seconds': 0.0, 'retries': 0})
+            usage['calls'] += 1
+            usage['units'] += units
+            usage['wait_seconds'] += wait
+            usage['retries'] += retries
+
+    def api_avoided(self, api, reason, units=1):
+        # Unità di quota risparmiate: immagini duplicate o scartate dal filtro locale prima di Vision
+        with self._lock:
+            reasons = self.avoided.setdefault(api, {})
+            reasons[reason] = reasons.get(reason, 0) + units
+
+    def channel_opened(self, api):
+        with self._lock:
+            self.channels[api] = self.channels.get(api, 0) + 1
+
+    def api_calls(self):
+        with self._lock:
+            return sum(usage['calls'] for usage in self.apis.values())
+
+    def merge(self, snapshot):
+        # Aggiungo le misure raccolte altrove (es. in un processo del batch)
+        with self._lock:
+            for stage, data in snapshot['stages'].items():
+                self.stages.setdefault(stage, Histogram()).merge(data)
+            for namespace, counters in snapshot['cache'].items():
+                mine = self.cache.setdefault(namespace, {'hits': 0, 'misses': 0})
+                mine['hits'] += counters['hits']
+                mine['misses'] += counters['misses']
+            for api, usage in snapshot['apis'].items():
+                mine = self.apis.setdefault(api, {'calls': 0, 'units': 0, 'wait_seconds': 0.0, 'retries': 0})
+                for name, value in usage.items():
+                    mine[name] += value
+            for api, reasons in snapshot.get('avoided', {}).items():
+                mine = self.avoided.setdefault(api, {})
+                for reason, units in reasons.items():
+                    mine[reason] = mine.get(reason, 0) + units
+            for api, n in snapshot.get('channels', {}).items():
+                self.channels[api] = self.channels.get(api, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {'stages': {stage: h.to_dict() for stage, h in self.stages.items()},
+                    'cache': {namespace: dict(c) for namespace, c in self.cache.items()},
+                    'apis': {api: dict(usage) for api, usage in self.apis.items()},
+                    'avoided': {api: dict(reasons) for api, reasons in self.avoided.items()},
+                    'channels': dict(self.channels)}
+
+    def summary(self):
+        # Tabella riassuntiva per la sidebar e per il JSON: latenze in millisecondi
+        with self._lock:
+            stages = {}
+            for stage, h in sorted(self.stages.items()):
+                stages[stage] = {'count': h.count,
+                                 'p50_ms': h.quantile(0.5) * 1000,
+                                 'p95_ms': h.quantile(0.95) * 1000,
+                                 'max_ms': h.max * 1000,
+                                 'total_ms': h.sum * 1000,
+                                 'mb': h.bytes / 1e6,
+                                 'errors': h.errors}
+            cache = {}
+            for namespace, c in sorted(self.cache.items()):
+                total = c['hits'] + c['misses']
+                cache[namespace] = {'hits': c['hits'], 'misses': c['misses'],
+                                    'hit_rate': c['hits'] / total if total else 0.0}
+            apis = {api: dict(usage) for api, usage in sorted(self.apis.items())}
+            for api, reasons in self.avoided.items():
+                apis.setdefault(api, {'calls': 0, 'units': 0, 'wait_seconds': 0.0, 'retries': 0})
+                apis[api]['avoided'] = sum(reasons.values())
+            for api, n in self.channels.items():
+                apis.setdefault(api, {'calls': 0, 'units': 0, 'wait_seconds': 0.0, 'retries': 0})
+                apis[api]['channels'] = n
+            return {'stages': stages, 'cache': cache, 'apis': apis}
+
+    def to_json(self):
+        data = self.summary()
+        data['histograms'] = self.snapshot()['stages']
+        data['bucket_bounds'] = list(BUCKETS)
+        return json.dumps(data, indent=2)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        out = ['# HELP %s_stage_seconds Durata delle fasi di elaborazione' % PREFIX,
+               '# TYPE %s_stage_seconds histogram' % PREFIX]
+        for stage, h in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, n in zip(list(BUCKETS) + ['+Inf'], h['buckets']):
+                cumulative += n
+                out.append('%s_stage_seconds_bucket{stage="%s",le="%s"} %d' % (PREFIX, stage, bound, cumulative))
+            out.append('%s_stage_seconds_sum{stage="%s"} %f' % (PREFIX, stage, h['sum']))
+            out.append('%s_stage_seconds_count{stage="%s"} %d' % (PREFIX, stage, h['count']))
+        out += ['# HELP %s_stage_bytes_total Byte elaborati per fase' % PREFIX,
+                '# TYPE %s_stage_bytes_total counter' % PREFIX]
+        out += ['%s_stage_bytes_total{stage="%s"} %d' % (PREFIX, stage, h['bytes'])
+                for stage, h in sorted(snapshot['stages'].items())]
+        out += ['# HELP %s_stage_errors_total Fasi terminate con un errore' % PREFIX,
+                '# TYPE %s_stage_errors_total counter' % PREFIX]
+        out += ['%s_stage_errors_total{stage="%s"} %d' % (PREFIX, stage, h['errors'])
+                for stage, h in sorted(snapshot['stages'].items())]
+        out += ['# HELP %s_cache_lookups_total Ricerche nella cache dei risultati' % PREFIX,
+                '# TYPE %s_cache_lookups_total counter' % PREFIX]
+        for namespace, c in sorted(snapshot['cache'].items()):
+            out.append('%s_cache_lookups_total{namespace="%s",outcome="hit"} %d' % (PREFIX, namespace, c['hits']))
+            out.append('%s_cache_lookups_total{namespace="%s",outcome="miss"} %d' % (PREFIX, namespace, c['misses']))
+        for name, key, help_text in [('api_calls_total', 'calls', 'Chiamate alle API Google'),
+                                     ('api_units_total', 'units', 'Unità di quota consumate'),
+                                     ('api_wait_seconds_total', 'wait_seconds', 'Attesa dovuta al rate limiter'),
+                                     ('api_retries_total', 'retries', 'Tentativi ripetuti per quota esaurita')]:
+            out += ['# HELP %s_%s %s' % (PREFIX, name, help_text), '# TYPE %s_%s counter' % (PREFIX, name)]
+            out += ['%s_%s{api="%s"} %s' % (PREFIX, name, api, usage[key])
+                    for api, usage in sorted(snapshot['apis'].items())]
+        out += ['# HELP %s_api_avoided_total Unità di quota risparmiate senza chiamare le API' % PREFIX,
+                '# TYPE %s_api_avoided_total counter' % PREFIX]
+        for api, reasons in sorted(snapshot['avoided'].items()):
+            out += ['%s_api_avoided_total{api="%s",reason="%s"} %d' % (PREFIX, api, reason, units)
+                    for reason, units in sorted(reasons.items())]
+        out += ['# HELP %s_api_channels Canali gRPC aperti dai client condivisi del processo' % PREFIX,
+                '# TYPE %s_api_channels gauge' % PREFIX]
+        out += ['%s_api_channels{api="%s"} %d' % (PREFIX, api, n) for api, n in sorted(snapshot['channels'].items())]
+        return '\n'.join(out) + '\n'
+
+
+# Registro di processo e registri aggiuntivi legati al thread corrente (sessione Streamlit, pratica del batch)
+REGISTRY = Registry()
+_local = threading.local()
+
+
+def _scopes():
+    return getattr(_local, 'scopes', ())
+
+
+@contextmanager
+def scope(registry):
+    # Le misure raccolte nel blocco finiscono anche nel registro indicato
+    previous = _scopes()
+    _local.scopes = previous + (registry,)
+    try:
+        yield registry
+    finally:
+        _local.scopes = previous
+
+
+def bind(registry):
+    # Per lo script Streamlit: il thread che esegue lo script registra le misure nel registro della sessione
+    _local.scopes = (registry,)
+
+
+def propagate(func):
+    # Per i thread di un pool: la funzione registra le misure negli stessi registri del thread che la crea
+    scopes = _scopes()
+
+    def wrapper(*args, **kwargs):
+        previous = _scopes()
+        _local.scopes = scopes
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.scopes = previous
+    return wrapper
+
+
+def observe(stage, seconds, nbytes=0, error=False):
+    REGISTRY.observe(stage, seconds, nbytes, error)
+    for registry in _scopes():
+        registry.observe(stage, seconds, nbytes, error)
+
+
+def cache_lookup(namespace, hit):
+    REGISTRY.cache_lookup(namespace, hit)
+    for registry in _scopes():
+        registry.cache_lookup(namespace, hit)
+
+
+def api_call(api, units=1, wait=0.0, retries=0):
+    REGISTRY.api_call(api, units, wait, retries)
+    for registry in _scopes():
+        registry.api_call(api, units, wait, retries)
+
+
+def api_avoided(api, reason, units=1):
+    REGISTRY.api_avoided(api, reason, units)
+    for registry in _scopes():
+        registry.api_avoided(api, reason, units)
+
+
+def channel_opened(api):
+    # I client sono condivisi dal processo: il canale non viene attribuito alla sessione che lo apre per prima
+    REGISTRY.channel_opened(api)
+
+
+def channels():
+    # Canali aperti nel processo per API
+    return REGISTRY.snapshot()['channels']
+
+
+@contextmanager
+def span(stage, nbytes=0):
+    # Misuro la durata di una fase; un'eccezione viene contata come errore e poi rilanciata
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, nbytes, error)
+
+
+def export(path):
+    # Formato in base all'estensione: .json oppure testo Prometheus (es. per il textfile collector di node_exporter)
+    data = REGISTRY.to_json() if path.endswith('.json') else REGISTRY.to_prometheus()
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port, host='127.0.0.1'):
+    # Endpoint locale: /metrics in formato Prometheus, /metrics.json in JSON. Avviato una sola volta per processo
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = REGISTRY.to_prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = REGISTRY.to_json(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
@@ -0,0 +1,191 @@
+import time
+import heapq
+import random
+import sqlite3
+import itertools
+import threading
+from cache import CACHE_PATH
+from api_usage import record_api_call
+import config
+
+# Priorità delle richieste in coda: a parità di quota le sessioni interattive passano prima del batch
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Budget predefiniti per API: unità al minuto e burst massimo (Vision consuma un'unità per immagine)
+BUDGETS = {'documentai': (120, 10),
+           'vision': (1800, 64)}
+
+# Tentativi e backoff con jitter quando Google risponde ResourceExhausted
+QUOTA_MAX_ATTEMPTS = 6
+QUOTA_BACKOFF_INITIAL = 1.0
+QUOTA_BACKOFF_MAX = 32.0
+
+_default_priority = PRIORITY_INTERACTIVE
+
+
+def set_default_priority(priority):
+    # Priorità delle chiamate fatte da questo processo (i processi del batch usano PRIORITY_BATCH)
+    global _default_priority
+    _default_priority = priority
+
+
+class _MemoryBucket(object):
+    # Token bucket nella memoria del processo
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, n):
+        # Restituisce 0 se i token sono stati consumati, altrimenti i secondi da attendere
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+    def drain(self):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class _SqliteBucket(object):
+    # Token bucket condiviso tra processi (Streamlit e batch sulla stessa macchina) nel database della cache
+    def __init__(self, api, rate, capacity, path=CACHE_PATH):
+        self.api = api
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute('CREATE TABLE IF NOT EXISTS rate_buckets ('
+                                'api TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _update(self, change):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE api = ?', (self.api,)).fetchone()
+            now = time.time()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+            tokens, result = change(tokens)
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (api, tokens, updated) VALUES (?, ?, ?)',
+                         (self.api, tokens, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def take(self, n):
+        def change(tokens):
+            if tokens >= n:
+                return tokens - n, 0.0
+            return tokens, (n - tokens) / self.rate
+        return self._update(change)
+
+    def drain(self):
+        self._update(lambda tokens: (0.0, None))
+
+
+class RateLimiter(object):
+    # Coda con priorità davanti al token bucket: solo la richiesta in testa prova a prendere i token,
+    # le altre attendono il proprio turno (a parità di priorità in ordine di arrivo)
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def acquire(self, n=1, priority=PRIORITY_INTERACTIVE):
+        # Restituisce i secondi passati in attesa
+        n = min(n, self.bucket.capacity)
+        start = time.monotonic()
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiting[0] == ticket:
+                        wait = self.bucket.take(n)
+                        if wait == 0:
+                            break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        return time.monotonic() - start
+
+    def drain(self):
+        # Quota esaurita lato Google: svuoto il bucket così rallentano anche le altre richieste
+        with self._cond:
+            self.bucket.drain()
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def get_limiter(api):
+    with _lock:
+        limiter = _limiters.get(api)
+        if limiter is None:
+            per_minute, burst = BUDGETS[api]
+            rate = config.get_setting(api + '_per_minute', per_minute) / 60.0
+            capacity = config.get_setting(api + '_burst', burst)
+            if config.get_setting('rate_limit_shared', False):
+                bucket = _SqliteBucket(api, rate, capacity)
+            else:
+                bucket = _MemoryBucket(rate, capacity)
+            limiter = _limiters[api] = RateLimiter(bucket)
+        return limiter
+
+
+def call(api, func, units=1, priority=None):
+    # Esegue func rispettando il budget dell'API; su ResourceExhausted attende con backoff esponenziale
+    # e jitter, poi rimette la richiesta in coda. Consumo, attese e tentativi vengono registrati per sessione,
+    # contando solo le chiamate arrivate all'API (risposta o errore di Google)
+    limiter = get_limiter(api)
+    priority = _default_priority if priority is None else priority
+    max_attempts = config.get_setting('quota_max_attempts', QUOTA_MAX_ATTEMPTS)
+    delay = QUOTA_BACKOFF_INITIAL
+    waited, retries, attempts = 0.0, 0, 0
+    # Import al primo uso: l'SDK di Google non rallenta l'avvio della pagina
+    from google.api_core import exceptions
+    try:
+        while True:
+            waited += limiter.acquire(units, priority)
+            try:
+                result = func()
+            except exceptions.ResourceExhausted:
+                attempts += 1
+                if retries + 1 >= max_attempts:
+                    raise
+                limiter.drain()
+                pause = random.uniform(0, delay)
+                time.sleep(pause)
+                waited += pause
+                retries += 1
+                delay = min(delay * 2, QUOTA_BACKOFF_MAX)
+            except exceptions.GoogleAPIError:
+                attempts += 1
+                raise
+            else:
+                attempts += 1
+                return result
+    finally:
+        if attempts:
+            record_api_call(api, units * attempts, waited, retries)
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import Future, CancelledError
+import metrics
+
+
+class SingleFlight(object):
+    # Richieste identiche in corso nello stesso processo (stessa chiave di contenuto) condividono un solo
+    # risultato: il primo chiamante (leader) esegue il lavoro, gli altri attendono il suo future
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def join(self, key):
+        # Restituisce (future, leader): se leader è True il chiamante deve poi chiamare resolve/reject/abandon
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        metrics.cache_lookup('inflight.' + self.name, not leader)
+        return future, leader
+
+    def _pop(self, key):
+        with self._lock:
+            return self._calls.pop(key, None)
+
+    def resolve(self, key, result):
+        future = self._pop(key)
+        if future is not None:
+            future.set_result(result)
+
+    def reject(self, key, error):
+        # L'errore del leader viene rilanciato a tutti quelli che attendono
+        future = self._pop(key)
+        if future is not None:
+            future.set_exception(error)
+
+    def abandon(self, key):
+        # Il leader è stato interrotto (es. rerun o stop della sessione): chi attende riprova da capo
+        future = self._pop(key)
+        if future is not None:
+            future.cancel()
+
+    def wait(self, future, timeout=None):
+        # None se il leader ha abbandonato la richiesta; il timeout vale solo per chi attende, non per il leader
+        try:
+            return future.result(timeout)
+        except CancelledError:
+            return None
+
+    def do(self, key, func, timeout=None):
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            try:
+                return future.result(timeout)
+            except CancelledError:
+                continue
+        try:
+            result = func()
+        except Exception as e:
+            self.reject(key, e)
+            raise
+        except BaseException:
+            self.abandon(key)
+            raise
+        self.resolve(key, result)
+        return result
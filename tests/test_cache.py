@@ -0,0 +1,59 @@
+# Test della cache dei risultati: eviction, totale delle dimensioni e transazioni
+#
+# Uso: python -m pytest tests
+import os
+import sys
+import time
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import ResultCache
+
+
+def _total(cache):
+    conn = sqlite3.connect(cache.path)
+    try:
+        stored = conn.execute("SELECT value FROM results_meta WHERE name = 'total_bytes'").fetchone()[0]
+        actual = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+    finally:
+        conn.close()
+    return stored, actual
+
+
+def test_cache_evicts_least_recently_read(tmp_path):
+    value = 'x' * 100
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'), max_bytes=350)
+    for key in ('a', 'b', 'c'):
+        cache.put('documents', key, value)
+        time.sleep(0.01)
+    # La lettura di 'a' viene salvata alla scrittura successiva: la voce meno recente diventa 'b'
+    assert cache.get('documents', 'a') == value
+    cache.put('documents', 'd', value)
+    assert cache.get('documents', 'b') is None
+    for key in ('a', 'c', 'd'):
+        assert cache.get('documents', key) == value
+    stored, actual = _total(cache)
+    assert stored == actual <= 350
+
+
+def test_cache_replace_keeps_total(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    cache.put('labels', 'k', 'x' * 1000)
+    cache.put('labels', 'k', 'y' * 10)
+    stored, actual = _total(cache)
+    assert stored == actual == len('"%s"' % ('y' * 10))
+
+
+def test_cache_transaction_rolls_back(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    with pytest.raises(RuntimeError):
+        with cache._transaction() as conn:
+            conn.execute("INSERT INTO results (namespace, key, value, size, accessed) VALUES ('n', 'k', '1', 1, 0)")
+            raise RuntimeError('interrotta')
+    assert cache.get('n', 'k') is None
+    # La connessione resta utilizzabile dopo il rollback
+    cache.put('n', 'k', 1)
+    assert cache.get('n', 'k') == 1
@@ -0,0 +1,195 @@
+# Test delle parti concorrenti: rate limiter con priorità e single-flight
+#
+# Uso: python -m pytest tests
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+import quota
+from quota import RateLimiter, _MemoryBucket, _SqliteBucket, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from singleflight import SingleFlight
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condizione non raggiunta')
+        time.sleep(0.005)
+
+
+# -----Rate limiter----- #
+
+def test_sqlite_bucket_is_shared(tmp_path):
+    # Due bucket sulla stessa API (come due processi) consumano gli stessi token
+    path = str(tmp_path / 'cache.sqlite')
+    first = _SqliteBucket('vision', 0.001, 3, path)
+    second = _SqliteBucket('vision', 0.001, 3, path)
+    assert first.take(2) == 0
+    assert second.take(2) > 0
+    assert second.take(1) == 0
+    second.drain()
+    assert first.take(1) > 0
+
+
+def test_rate_limiter_priority_order(tmp_path):
+    # Con il bucket vuoto le richieste interattive arrivate dopo passano prima di quella del batch, e tra loro
+    # in ordine di arrivo
+    bucket = _SqliteBucket('documentai', 5.0, 1, str(tmp_path / 'cache.sqlite'))
+    bucket.drain()
+    limiter = RateLimiter(bucket)
+    order = []
+
+    def acquire(name, priority):
+        limiter.acquire(1, priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=acquire, args=('batch', PRIORITY_BATCH))]
+    threads[0].start()
+    _wait_until(lambda: len(limiter._waiting) == 1)
+    for name in ('interattiva 1', 'interattiva 2'):
+        threads.append(threading.Thread(target=acquire, args=(name, PRIORITY_INTERACTIVE)))
+        threads[-1].start()
+        _wait_until(lambda: len(limiter._waiting) == len(threads))
+    for thread in threads:
+        thread.join(10)
+    assert order == ['interattiva 1', 'interattiva 2', 'batch']
+    assert limiter._waiting == []
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    # Chiamate registrate da quota.call, con un limiter senza attese e backoff brevi
+    pytest.importorskip('google.api_core')
+    limiter = RateLimiter(_MemoryBucket(1000.0, 10))
+    monkeypatch.setattr(quota, 'get_limiter', lambda api: limiter)
+    monkeypatch.setattr(quota, 'QUOTA_BACKOFF_INITIAL', 0.001)
+    registry = metrics.Registry()
+    with metrics.scope(registry):
+        yield registry
+
+
+def test_call_records_attempts(api_calls):
+    from google.api_core import exceptions
+    failures = [exceptions.ResourceExhausted('quota')]
+
+    def request():
+        if failures:
+            raise failures.pop()
+        return 'ok'
+
+    assert quota.call('vision', request, units=4) == 'ok'
+    assert api_calls.summary()['apis']['vision'] == {'calls': 1, 'units': 8, 'wait_seconds': pytest.approx(0, abs=0.1),
+                                                     'retries': 1}
+
+
+def test_call_records_api_errors(api_calls):
+    from google.api_core import exceptions
+
+    def request():
+        raise exceptions.ServiceUnavailable('non disponibile')
+
+    with pytest.raises(exceptions.ServiceUnavailable):
+        quota.call('documentai', request, units=2)
+    assert api_calls.summary()['apis']['documentai']['units'] == 2
+
+
+def test_call_skips_requests_never_sent(api_calls, monkeypatch):
+    # Errori prima dell'invio (richiesta non valida, attesa interrotta) non consumano quota
+    def invalid():
+        raise ValueError('richiesta non valida')
+
+    def interrupted(n, priority):
+        raise KeyboardInterrupt()
+
+    with pytest.raises(ValueError):
+        quota.call('vision', invalid)
+    monkeypatch.setattr(quota.get_limiter('vision'), 'acquire', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        quota.call('vision', lambda: 'ok')
+    assert api_calls.summary()['apis'] == {}
+
+
+# -----Single-flight----- #
+
+class _Flight(SingleFlight):
+    # Segnala quando un chiamante si è unito a una richiesta già in corso
+    def __init__(self, name):
+        super().__init__(name)
+        self.followed = threading.Event()
+
+    def join(self, key):
+        future, leader = super().join(key)
+        if not leader:
+            self.followed.set()
+        return future, leader
+
+
+class _Stop(BaseException):
+    # Come l'interruzione di un rerun di Streamlit
+    pass
+
+
+def _follow(flight, func):
+    # Il leader esegue func, un secondo thread chiede la stessa chiave mentre il leader è in corso
+    started = threading.Event()
+    outcome = {}
+
+    def lead():
+        started.set()
+        flight.followed.wait(5)
+        return func()
+
+    def leader():
+        try:
+            outcome['leader'] = flight.do('k', lead)
+        except BaseException as e:
+            outcome['leader'] = e
+
+    def follower():
+        try:
+            outcome['follower'] = flight.do('k', lambda: 'follower')
+        except BaseException as e:
+            outcome['follower'] = e
+
+    threads = [threading.Thread(target=leader), threading.Thread(target=follower)]
+    threads[0].start()
+    started.wait(5)
+    threads[1].start()
+    for thread in threads:
+        thread.join(10)
+    return outcome
+
+
+def test_singleflight_shares_result():
+    outcome = _follow(_Flight('test'), lambda: 'leader')
+    assert outcome == {'leader': 'leader', 'follower': 'leader'}
+
+
+def test_singleflight_propagates_leader_error():
+    error = ValueError('documento illeggibile')
+
+    def fail():
+        raise error
+
+    outcome = _follow(_Flight('test'), fail)
+    assert outcome['leader'] is error
+    assert outcome['follower'] is error
+
+
+def test_singleflight_abandon_lets_follower_lead():
+    def stop():
+        raise _Stop()
+
+    flight = _Flight('test')
+    outcome = _follow(flight, stop)
+    assert isinstance(outcome['leader'], _Stop)
+    # Chi attendeva ripete la richiesta come nuovo leader
+    assert outcome['follower'] == 'follower'
+    assert flight._calls == {}
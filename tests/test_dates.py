@@ -0,0 +1,92 @@
+# Parità del riconoscimento delle date (dates.parse_date: lettura veloce e fallback su dateutil) con la cascata
+# originale di _extract_data_evento: traduzione dei mesi con re.sub e dateutil
+#
+# Uso: python -m pytest tests
+import os
+import re
+import sys
+import itertools
+from datetime import datetime
+
+import dateutil.parser as dparser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dates
+from extraction import DATE_RE
+
+FIRSTS = ['%02d' % d for d in range(1, 32)] + ['1999', '2005', '2019', '2030']
+MONTHS = ['%02d' % m for m in range(1, 13)] + list(dates.MONTHS) + ['mar.', 'set.', 'dic..']
+LASTS = [None, '05', '12', '19', '31', '45', '99', '1999', '2019', '2030']
+SEPARATORS_1 = [' ', '-', '/', '.', '  ', ' - ', '. ', '\\', '\t', '-/']
+SEPARATORS_2 = ['', ' ', '-', '/', '.', '  ', ' - ', '. ', '\\', '\t']
+
+
+def legacy_parse(matched_date):
+    # Copia del codice originale di _extract_data_evento
+    matched_date = re.sub(r'gennaio|gen', 'jan', matched_date)
+    matched_date = re.sub(r'febbraio|feb', 'feb', matched_date)
+    matched_date = re.sub(r'marzo|mar', 'mar', matched_date)
+    matched_date = re.sub(r'aprile|apr', 'apr', matched_date)
+    matched_date = re.sub(r'maggio|mag', 'may', matched_date)
+    matched_date = re.sub(r'giugno|giu', 'jun', matched_date)
+    matched_date = re.sub(r'luglio|lug', 'jul', matched_date)
+    matched_date = re.sub(r'agosto|ago', 'aug', matched_date)
+    matched_date = re.sub(r'settembre|set', 'sep', matched_date)
+    matched_date = re.sub(r'ottobre|ott', 'oct', matched_date)
+    matched_date = re.sub(r'novembre|nov', 'nov', matched_date)
+    matched_date = re.sub(r'dicembre|dic', 'dec', matched_date)
+    try:
+        return dparser.parse(matched_date)
+    except:
+        return None
+
+
+def _matches(firsts, months, lasts, separators):
+    # Testi che la regex delle date cattura interamente, con l'anno (o il giorno) finale atteso
+    for first, month, last, (sep1, sep2) in itertools.product(firsts, months, lasts, separators):
+        text = first + sep1 + month + sep2 + (last or '')
+        match = DATE_RE.search(text)
+        if match is not None and match.group() == text and match.group(3) == last:
+            yield match
+
+
+def _mismatches(matches):
+    now = datetime.now()
+    return [(match.group(), dates.parse_date(match, now), legacy_parse(match.group())) for match in matches
+            if dates.parse_date(match, now) != legacy_parse(match.group())]
+
+
+def test_all_formats():
+    # Ogni forma del mese con ogni coppia di separatori, giorno/anno in testa e anno assente, breve o lungo
+    separators = list(itertools.product(SEPARATORS_1, SEPARATORS_2))
+    assert _mismatches(_matches(['12', '2019'], MONTHS, [None, '19', '2019'], separators)) == []
+
+
+def test_all_values():
+    # Ogni giorno o anno in testa con ogni anno finale, nei formati più comuni
+    separators = [(s, s) for s in ('/', '-', '.', ' ')] + [(' ', '')]
+    months = ['02', '03', '12', 'febbraio', 'marzo', 'mar.', 'dic']
+    assert _mismatches(_matches(FIRSTS, months, LASTS, separators)) == []
+
+
+def test_fallback_inputs():
+    # Forme che la lettura veloce lascia a dateutil
+    texts = ['12\\03\\2019', '12 - 03 - 2019', '12-/03/19', '12. 03. 2019', '12.03', '12\t03\t2019', '12/03-2019',
+             '12 mar 19', '12-marzo 05', '2019 03', '2019 marzo', '2019-03-2019', '12  dic..  2019']
+    matches = [DATE_RE.search(text) for text in texts]
+    assert all(match is not None and match.group() == text for match, text in zip(matches, texts))
+    now = datetime.now()
+    assert all(dates._fast_parse(match, now) is dates._FALLBACK for match in matches)
+    assert _mismatches(matches) == []
+
+
+def test_invalid_dates():
+    texts = ['31/02/2019', '29/02/2019', '31.04.2021', '30 febbraio 2020', '31 nov 2019', '31 giu 2020', '31-06-19',
+             '30/02', '2019\\02\\30']
+    now = datetime.now()
+    for text in texts:
+        match = DATE_RE.search(text)
+        assert dates.parse_date(match, now) is None, text
+        assert legacy_parse(match.group()) is None, text
+    assert dates.parse_date(DATE_RE.search('29/02/2020'), now) == legacy_parse('29/02/2020') == datetime(2020, 2, 29)
@@ -0,0 +1,87 @@
+# Test del riconoscimento di codici fiscali e partite IVA: caratteri di controllo, uffici provinciali e ordine dei
+# candidati per vicinanza alle parole chiave
+#
+# Uso: python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import ParsedText
+from identifiers import cf_check_char, valid_cf, piva_check_digit, valid_piva, find_cf, find_piva, best_cf, best_piva
+
+# Codici fiscali validi, anche con omocodia (cifre sostituite da lettere)
+VALID_CF = ['RSSMRA80A01L219M', 'BNCGLI85M41F205B', 'VRDLCU72C15H501Y', 'FRRNNA90E52A944P', 'RSSMRA80A01L21VB',
+            'RSSMRA80A01LNMVB']
+INVALID_CF = [('RSSMRA80A01L219X', 'carattere di controllo errato'),
+              ('RSSMRA80A01L219', 'troppo corto'),
+              ('rssmra80a01l219m', 'minuscolo'),
+              ('RSSMRA80Z01L219' + cf_check_char('RSSMRA80Z01L219'), 'mese inesistente'),
+              ('RSSMRA80A01L2_9M', 'carattere non ammesso')]
+
+# Partite IVA valide: uffici provinciali 001-100, 120, 121, 888 e 999, matricola anche con zeri iniziali
+VALID_PIVA = ['12345670017', '00000011205', '00000011213', '00000018887', '00000019992', '01234560017']
+INVALID_PIVA = [('12345670014', 'cifra di controllo errata'),
+                ('00000000000', 'matricola a zero'),
+                ('12345671015', 'ufficio provinciale inesistente'),
+                ('12345670009', 'ufficio provinciale inesistente'),
+                ('1234567001', 'troppo corta'),
+                ('1234567001A', 'carattere non numerico')]
+
+
+def test_cf_check_char():
+    assert cf_check_char('RSSMRA80A01L219') == 'M'
+    assert cf_check_char('RSSMRA80A01L219M') == 'M'
+    assert cf_check_char('RSSMRA80A01L2_9') is None
+
+
+@pytest.mark.parametrize('code', VALID_CF)
+def test_valid_cf(code):
+    assert valid_cf(code)
+
+
+@pytest.mark.parametrize('code, reason', INVALID_CF)
+def test_invalid_cf(code, reason):
+    assert not valid_cf(code), reason
+
+
+def test_piva_check_digit():
+    # Algoritmo di Luhn: le cifre in posizione pari (2a, 4a, ...) raddoppiate, sottraendo 9 se superano 9
+    assert piva_check_digit('1234567001') == 7
+    assert piva_check_digit('0000000001') == 8
+    assert piva_check_digit('9999999999') == 0
+
+
+@pytest.mark.parametrize('code', VALID_PIVA)
+def test_valid_piva(code):
+    assert valid_piva(code)
+
+
+@pytest.mark.parametrize('code, reason', INVALID_PIVA)
+def test_invalid_piva(code, reason):
+    assert not valid_piva(code), reason
+
+
+def test_cf_ranking():
+    # Prima i codici vicini alle parole chiave, poi nell'ordine del testo; i codici non validi sono scartati
+    doc = ParsedText(['Intestatario RSSMRA80A01L219M\n', 'Codice fiscale RSSMRA80A01L219X\n',
+                      'Delegato BNCGLI85M41F205B, C.F. VRDLCU72C15H501Y\n'])
+    assert [c.value for c in find_cf(doc)] == ['VRDLCU72C15H501Y', 'RSSMRA80A01L219M', 'BNCGLI85M41F205B']
+    assert best_cf(doc).value == 'VRDLCU72C15H501Y'
+    assert best_cf(doc) == find_cf(doc)[0]
+
+    doc = ParsedText(['Intestatario RSSMRA80A01L219M\n', 'Delegato BNCGLI85M41F205B\n'])
+    assert [c.score for c in find_cf(doc)] == [0, 0]
+    assert best_cf(doc).value == 'RSSMRA80A01L219M'
+    assert best_cf(ParsedText(['Codice fiscale RSSMRA80A01L219X\n'])) is None
+
+
+def test_piva_ranking():
+    # La parola chiave conta solo nei 10 caratteri prima del codice
+    doc = ParsedText(['Ditta 12345670017\n', 'P.IVA 12345670014\n', 'P.IVA 00000011205 oppure 01234560017\n'])
+    assert [c.value for c in find_piva(doc)] == ['00000011205', '12345670017', '01234560017']
+    assert best_piva(doc).value == '00000011205'
+    assert best_piva(doc) == find_piva(doc)[0]
+    assert best_piva(ParsedText(['partita iva: 12345670014\n'])) is None
@@ -0,0 +1,146 @@
+# Test dell'analisi delle immagini senza Vision: filtro locale, percorso delle foto verso la classificazione e
+# richieste identiche in corso in più sessioni
+#
+# Uso: python -m pytest tests
+import os
+import sys
+import threading
+
+import fitz
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_analysis
+import image_filter
+from cache import ResultCache, content_key
+from image_hash import HashIndex
+from singleflight import SingleFlight
+
+# Label restituite dalla Vision finta: diventano Soffitto e Intonaco in _select_labels
+LABELS = {'Ceiling': 0.93, 'Plaster': 0.81}
+
+
+def _png(pixels):
+    pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    height, width = pixels.shape[:2]
+    colorspace = fitz.csGRAY if pixels.ndim == 2 else fitz.csRGB
+    return fitz.Pixmap(colorspace, width, height, pixels.tobytes(), 0).tobytes()
+
+
+def _ceiling(light, stain, seed=0, width=800, height=600):
+    # Foto di un soffitto bianco: luce che cala dal punto più illuminato, eventuale macchia d'acqua e rumore del
+    # sensore. Con poca luce e nessuna macchia la foto è uniforme quasi quanto una pagina vuota
+    rnd = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    distance = np.hypot((x - width * 0.4) / width, (y - height * 0.3) / height)
+    shade = -light * distance / distance.max()
+    shade -= stain * np.exp(-(((x - width * 0.6) / (width * 0.12)) ** 2 + ((y - height * 0.55) / (height * 0.1)) ** 2))
+    return _png(np.stack([c + shade for c in (228, 224, 216)], axis=2) + rnd.normal(0, 3, (height, width, 1)))
+
+
+def _logo():
+    # Due forme a tinta unita su fondo bianco
+    pixels = np.full((300, 300, 3), 255.0)
+    pixels[60:240, 60:120] = (200, 30, 30)
+    pixels[60:120, 60:240] = (30, 30, 160)
+    return _png(pixels)
+
+
+def _blank_scan():
+    return _png(250 + np.random.default_rng(1).normal(0, 2, (1100, 800)))
+
+
+def _pdf(images):
+    # Un'immagine per pagina
+    pdf = fitz.open()
+    for im in images:
+        page = pdf.new_page()
+        page.insert_image(fitz.Rect(36, 36, 556, 426), stream=im)
+    return pdf.tobytes()
+
+
+@pytest.fixture
+def vision(tmp_path, monkeypatch):
+    # Cache e indice degli hash in una cartella temporanea; la classificazione restituisce sempre LABELS
+    sent = []
+
+    def classify(items):
+        for key, im in items:
+            sent.append(im)
+            yield key, dict(LABELS)
+
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    index = HashIndex(str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setattr(image_analysis, 'get_cache', lambda: cache)
+    monkeypatch.setattr(image_analysis, 'get_index', lambda: index)
+    monkeypatch.setattr(image_analysis, '_classify_images', classify)
+    return sent
+
+
+def test_filter_drops_logos_and_blank_scans():
+    assert image_filter.classify(_logo()) == 'logo'
+    assert image_filter.classify(_blank_scan()) == 'blank'
+    assert image_filter.classify(_png(np.random.default_rng(2).normal(128, 40, (40, 40)))) == 'tiny'
+    assert image_filter.classify(_png(np.random.default_rng(3).normal(128, 40, (100, 900)))) == 'aspect'
+    assert image_filter.classify(_ceiling(30, 25), repeated_pages=3) == 'repeated'
+
+
+def test_filter_keeps_damage_photo():
+    assert image_filter.classify(_ceiling(30, 25)) is None
+
+
+@pytest.mark.parametrize('light, stain', [(2, 0), (6, 0), (4, 8), (15, 20)])
+def test_flat_photo_upload_reaches_vision(vision, light, stain):
+    # Le statistiche di una foto uniforme sono quelle di una pagina vuota: il filtro la scarterebbe
+    photo = _ceiling(light, stain)
+    assert image_filter.classify(photo) == 'blank'
+    out = image_analysis.analyze_images(photo, 'image/png')
+    assert out[1][1] == {'Soffitto': 0.93, 'Intonaco': 0.81}
+    assert vision == [photo]
+
+
+@pytest.mark.skipif(not hasattr(fitz.Document, 'getPageImageList'), reason='richiede le API di PyMuPDF 1.18')
+def test_pdf_logo_skips_vision(vision):
+    photo = _ceiling(30, 25)
+    out = image_analysis.analyze_images(_pdf([_logo(), photo]), 'application/pdf')
+    assert out[1][1] == {}
+    assert out[2][1] == {'Soffitto': 0.93, 'Intonaco': 0.81}
+    assert len(vision) == 1
+
+
+class _Flight(SingleFlight):
+    # Segnala quando un chiamante si è unito a una richiesta già in corso
+    def __init__(self, name):
+        super().__init__(name)
+        self.followed = threading.Event()
+
+    def join(self, key):
+        future, leader = super().join(key)
+        if not leader:
+            self.followed.set()
+        return future, leader
+
+
+def test_follower_of_abandoned_request_indexes_labels(vision, monkeypatch):
+    # Un'altra sessione sta classificando la stessa foto e viene interrotta: chi attendeva la classifica al suo
+    # posto e salva l'hash, così una foto quasi identica caricata dopo non arriva a Vision
+    flight = _Flight('image_labels')
+    monkeypatch.setattr(image_analysis, '_flights', flight)
+    photo = _ceiling(30, 25)
+    key = content_key(photo, image_analysis.VISION_MODEL)
+    flight.join(key)
+    out = {}
+    follower = threading.Thread(target=lambda: out.update(image_analysis.analyze_images(photo, 'image/png')))
+    follower.start()
+    assert flight.followed.wait(5)
+    flight.abandon(key)
+    follower.join(10)
+    assert out[1][1] == {'Soffitto': 0.93, 'Intonaco': 0.81}
+    assert vision == [photo]
+    assert flight._calls == {}
+
+    again = image_analysis.analyze_images(_ceiling(30, 25, seed=1), 'image/png')
+    assert again[1][1] == {'Soffitto': 0.93, 'Intonaco': 0.81}
+    assert vision == [photo]
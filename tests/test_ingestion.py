@@ -0,0 +1,68 @@
+# Test della lettura dei pdf: livello di testo locale e pagine mandate all'OCR
+#
+# Uso: python -m pytest tests
+import os
+import sys
+
+import fitz
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingestion
+
+pytestmark = pytest.mark.skipif(not hasattr(fitz.Page, 'getText'), reason='richiede le API di PyMuPDF 1.18')
+
+TEXT = ('Il sottoscritto Mario Rossi, titolare della polizza n. 123/456, denuncia il sinistro avvenuto il '
+        '12/03/2021 nella propria abitazione.')
+
+
+def _png(side, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (side, side), dtype=np.uint8)
+    return fitz.Pixmap(fitz.csGRAY, side, side, pixels.tobytes(), 0).tobytes()
+
+
+def _pdf(pages):
+    # pages: (testo, lato dell'immagine o None) per ogni pagina
+    pdf = fitz.open()
+    for text, side in pages:
+        page = pdf.new_page()
+        if text:
+            page.insert_text((72, 72), text, fontsize=8)
+        if side:
+            page.insert_image(fitz.Rect(72, 100, 72 + side / 4, 100 + side / 4), stream=_png(side))
+    return pdf.tobytes()
+
+
+@pytest.fixture
+def ocr(monkeypatch):
+    # Pagine mandate a Document AI
+    sent = []
+
+    def pages(pdf, indexes):
+        sent.extend(indexes)
+        return {i: {'text': 'Testo letto con OCR\n', 'entities': []} for i in indexes}
+
+    monkeypatch.setattr(ingestion, '_ocr_pages', pages)
+    return sent
+
+
+def test_native_pages_use_text_layer(ocr):
+    doc = ingestion._read_pdf(_pdf([(TEXT, None), (TEXT, 200)]))
+    assert ocr == []
+    assert 'polizza n. 123/456' in doc.pages[1]
+
+
+def test_blank_and_short_pages_skip_ocr(ocr):
+    # Separatore vuoto, copertina con poche parole e un logo
+    doc = ingestion._read_pdf(_pdf([(TEXT, None), ('', None), ('Denuncia di sinistro', 200)]))
+    assert ocr == []
+    assert doc.pages[1] == '\n'
+    assert doc.pages[2].strip() == 'Denuncia di sinistro'
+
+
+def test_scanned_pages_go_to_ocr(ocr):
+    doc = ingestion._read_pdf(_pdf([(TEXT, None), ('', 1200), ('Pagina 3', 800)]))
+    assert ocr == [1, 2]
+    assert doc.pages[1] == doc.pages[2] == 'Testo letto con OCR\n'
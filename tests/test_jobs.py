@@ -0,0 +1,121 @@
+# Test della coda dei job: accodamento, transazioni tra processi, riaccodamento e misure per sessione
+#
+# Uso: python -m pytest tests
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+import metrics
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # Coda senza worker: i job vengono presi ed eseguiti dal test
+    outcomes = {}
+
+    def run(kind, content, mime_type):
+        outcome = outcomes.get(content)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return {'kind': kind, 'size': len(content)}
+
+    monkeypatch.setattr(jobs, '_run', run)
+    q = jobs.JobQueue(str(tmp_path / 'jobs.sqlite'), workers=0)
+    q.outcomes = outcomes
+    return q
+
+
+def _content(q, key):
+    return q._connect().execute('SELECT content FROM jobs WHERE id = ?', (key,)).fetchone()[0]
+
+
+def test_job_submitted_once(queue):
+    key, created = queue.submit('denuncia', b'testo', 'text/plain')
+    assert created
+    assert queue.submit('denuncia', b'testo', 'text/plain') == (key, False)
+    job = queue._claim()
+    assert job[0] == key
+    assert queue._claim() is None
+    queue._execute(*job)
+    done = queue.get(key)
+    assert done['status'] == 'done'
+    assert done['result'] == {'kind': 'denuncia', 'size': 5}
+    # Il file caricato non resta nel database dopo la fine del job
+    assert _content(queue, key) is None
+    assert queue.submit('denuncia', b'testo', 'text/plain') == (key, False)
+
+
+def test_failed_job_is_requeued(queue):
+    queue.outcomes[b'rotto'] = ValueError('pdf illeggibile')
+    key, _ = queue.submit('fattura', b'rotto', 'text/plain')
+    queue._execute(*queue._claim())
+    failed = queue.get(key)
+    assert failed['status'] == 'error'
+    assert failed['error'] == 'ValueError: pdf illeggibile'
+    assert _content(queue, key) is None
+
+    del queue.outcomes[b'rotto']
+    assert queue.submit('fattura', b'rotto', 'text/plain') == (key, True)
+    job = queue._claim()
+    assert job[3] == b'rotto'
+    queue._execute(*job)
+    assert queue.get(key)['status'] == 'done'
+
+
+def test_concurrent_claims_take_each_job_once(queue):
+    # Due code sullo stesso database (come due processi) e più thread: ogni job viene preso una sola volta
+    other = jobs.JobQueue(queue.path, workers=0)
+    keys = set(queue.submit('denuncia', b'documento %d' % i, 'text/plain')[0] for i in range(40))
+    claimed = []
+    lock = threading.Lock()
+
+    def claim(q):
+        while True:
+            job = q._claim()
+            if job is None:
+                return
+            with lock:
+                claimed.append(job[0])
+
+    threads = [threading.Thread(target=claim, args=(q,)) for q in (queue, other, queue, other)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert sorted(claimed) == sorted(keys)
+
+
+class _Upload(io.BytesIO):
+    # Come UploadedFile di Streamlit, senza id: la chiave viene calcolata dal contenuto
+    type = 'text/plain'
+
+
+def test_poll_charges_metrics_to_submitting_session(queue):
+    # Due sessioni caricano lo stesso file: le misure del job vanno solo a quella che lo ha accodato, una volta
+    first, second = metrics.Registry(), metrics.Registry()
+    first_jobs, second_jobs = {}, {}
+    jobs.poll(queue, 'denuncia', _Upload(b'condiviso'), first_jobs, first)
+    jobs.poll(queue, 'denuncia', _Upload(b'condiviso'), second_jobs, second)
+    queue._execute(*queue._claim())
+    for _ in range(2):
+        assert jobs.poll(queue, 'denuncia', _Upload(b'condiviso'), first_jobs, first)['status'] == 'done'
+        assert jobs.poll(queue, 'denuncia', _Upload(b'condiviso'), second_jobs, second)['status'] == 'done'
+    assert first.summary()['stages']['job.denuncia']['count'] == 1
+    assert second.summary()['stages'] == {}
+
+
+def test_poll_resubmits_deleted_job(queue):
+    # Il job accodato dalla sessione è stato eliminato da un altro processo: viene accodato di nuovo
+    submitted = {}
+    key = jobs.poll(queue, 'fattura', _Upload(b'eliminato'), submitted, metrics.Registry())['id']
+    queue._connect().execute('DELETE FROM jobs WHERE id = ?', (key,))
+    job = jobs.poll(queue, 'fattura', _Upload(b'eliminato'), submitted, metrics.Registry())
+    assert job['id'] == key
+    assert job['status'] == 'queued'
+    assert submitted == {key: True}
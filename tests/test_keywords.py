@@ -0,0 +1,101 @@
+# Parità dell'automa delle parole chiave (keywords.py) con le regex originali: conteggio delle causali come in
+# _extract_category e controlli di prossimità degli estrattori, anche con termini sovrapposti o prefissi di altri
+#
+# Uso: python -m pytest tests
+import os
+import re
+import sys
+import random
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import extraction
+import legacy_extraction
+import synthetic
+from keywords import KeywordMatcher, load_vocabulary
+
+# Parole chiave di prossimità degli estrattori originali
+LEGACY_NEAR = {'data_evento': re.compile(r'data evento|avvenut|sinistro|accadut|verificat'),
+               'iva': re.compile(r'\biva\b'),
+               'importo': re.compile(r'\b(totale|finale|liquidazione|liquidato|indennizzo)\b')}
+
+# Termini che si sovrappongono o sono prefissi di altri termini, con i confini di parola più delicati
+TRICKY = ['corto circuito', 'corto circuiti', 'circuito', 'cortocircuito', 'neve', 'nevicata', 'nevi.', 'incendi',
+          'incendio', 'incendiato', 'cavo', 'cavi_', 'cavolo', 'vento', 'ventoso', 'venti\n', 'idrici', 'idrico',
+          'colonna montante', 'colonna  montante', 'scarico', 'scaricoo', 'fuoco', 'fuochi', 'rubare', 'rubata',
+          'data evento', 'data  evento', 'avvenuto', 'sinistrosità', 'iva', 'p.iva', 'iva:', 'ivato', 'riva',
+          'totale', 'totalmente', 'sub-totale', 'finale.', 'liquidato', 'indennizzo2', 'codice fiscale', 'cf']
+SEPARATORS = [' ', '  ', '', '.', ',', '-', '_', '\n', "'", '2', 'à', 'x']
+
+
+def _legacy_category(specs):
+    return re.compile(r'\b(' + '|'.join(specs) + r')\b')
+
+
+def _texts(seed, n=200):
+    # Testi casuali fatti di termini, pezzi di termini e separatori, già in minuscolo
+    rnd = random.Random(seed)
+    vocabulary = load_vocabulary()
+    words = TRICKY + [spec.replace('.?', '').rstrip('.*') for specs in vocabulary['categories'].values()
+                      for spec in specs]
+    for _ in range(n):
+        parts = []
+        for _ in range(rnd.randint(1, 12)):
+            word = rnd.choice(words)
+            if rnd.random() < 0.2:
+                word = word[:rnd.randint(1, len(word))]
+            parts.append(word + rnd.choice(SEPARATORS))
+        yield ''.join(parts)
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return KeywordMatcher(load_vocabulary())
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_counts_match_legacy_regex(matcher, seed):
+    regexes = [(category, _legacy_category(specs)) for category, specs in load_vocabulary()['categories'].items()]
+    for text in _texts(seed):
+        expected = [(category, len(regex.findall(text))) for category, regex in regexes]
+        assert matcher.scan(text).counts() == expected, text
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_near_matches_legacy_regex(matcher, seed):
+    # Stesse finestre cercate con l'automa (posizioni della scansione) e con le regex dei gruppi
+    rnd = random.Random(seed)
+    for text in _texts(seed):
+        hits = matcher.scan(text)
+        for _ in range(10):
+            lo = rnd.randint(-5, len(text))
+            hi = rnd.randint(max(lo, 0), len(text) + 5)
+            window = text[max(lo, 0):hi]
+            for group, regex in LEGACY_NEAR.items():
+                expected = regex.search(window) is not None
+                assert matcher.near(group, window) == expected, (group, window)
+                assert hits.within(group, lo, hi) == expected, (group, window)
+
+
+def test_category_matches_legacy():
+    for seed in range(40):
+        lines = synthetic.denuncia(1 + seed % 8, seed)
+        for text in _texts(seed, 5):
+            lines.append(text + '\n')
+            assert extraction.extract_category(extraction.ParsedText(lines)) == \
+                legacy_extraction._extract_category(lines), lines
+
+
+@pytest.mark.parametrize('window, expected', [
+    ('codice fiscale: ', True), ('cod. fisc. ', True), ('cod. fiscale ', True), ('cod.fiscale ', False),
+    ('c.f. ', True), ('c.f.: ', True), ('cf: ', True), ('cfr. ', False), ('xcod. fiscale ', False),
+    ('codice fiscalex ', False),
+])
+def test_cf_keywords(matcher, window, expected):
+    # Le abbreviazioni ('cod. fisc*') sono delimitate solo all'inizio: trovano anche la parola completa
+    assert matcher.near('cf', window) == expected
+    assert matcher.scan(window).within('cf', 0, len(window)) == expected
@@ -0,0 +1,55 @@
+import threading
+import importlib
+import config
+import metrics
+
+# Pre-caricamento opzionale (impostazione warmup=true): all'avvio di un nuovo worker un thread in background importa
+# gli SDK e i moduli di analisi, legge i secrets e crea i client, mentre la pagina viene già mostrata.
+# Senza warm-up tutto viene caricato comunque al primo uso
+WARMUP_MODULES = ['fitz', 'numpy', 'price_parser', 'dateutil.parser', 'google.api_core.retry',
+                  'google.cloud.documentai', 'google.cloud.vision',
+                  'text_analysis', 'invoice_analysis', 'image_analysis']
+
+_lock = threading.Lock()
+_thread = None
+_done = threading.Event()
+_errors = {}
+
+
+def _step(name, func):
+    # Un passo non riuscito non blocca gli altri: lo stesso errore si ripresenterà al primo uso
+    try:
+        with metrics.span('warmup.' + name):
+            func()
+    except Exception as e:
+        _errors[name] = repr(e)
+
+
+def _warm_up():
+    from keywords import get_matcher
+    from clients import get_client
+    for module in WARMUP_MODULES:
+        _step(module, lambda: importlib.import_module(module))
+    _step('secrets', config.get_secrets)
+    _step('keywords', get_matcher)
+    for api in ('documentai', 'vision'):
+        _step('client.' + api, lambda: get_client(api))
+    _done.set()
+
+
+def start():
+    # Una sola volta per processo, anche se lo script Streamlit viene rieseguito
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_warm_up, name='warmup', daemon=True)
+            _thread.start()
+        return _thread
+
+
+def wait(timeout=None):
+    return _done.wait(timeout)
+
+
+def errors():
+    return dict(_errors)